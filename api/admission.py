@@ -0,0 +1,116 @@
+"""
+Admission control and load shedding for LLM-backed endpoints
+
+Each controller caps concurrent upstream work and keeps a moving average of
+service time. A new request is only admitted if its estimated latency
+(queueing + service) stays under the configured target; otherwise the caller
+is told to back off (503 + Retry-After) or to fall back to a cheaper path.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Any
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """Raised when admitting a request would miss the latency target"""
+
+    def __init__(self, name: str, estimated_latency: float, retry_after: int):
+        super().__init__(f"{name} overloaded (estimated latency {estimated_latency:.1f}s)")
+        self.estimated_latency = estimated_latency
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounded-concurrency gate with queue-latency based rejection"""
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int = 8,
+        latency_target: float = 20.0,
+        initial_service_time: float = 5.0,
+        smoothing: float = 0.2
+    ):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.latency_target = latency_target
+        self.service_time = initial_service_time
+        self.smoothing = smoothing
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def estimated_latency(self) -> float:
+        """Expected latency for one more request: waves of work ahead of it plus its own service"""
+        waves = (self.in_flight // self.max_concurrency) + 1
+        return waves * self.service_time
+
+    def _record(self, duration: float):
+        """Update the service time moving average"""
+        self.service_time = (1 - self.smoothing) * self.service_time + self.smoothing * duration
+
+    def check(self):
+        """Raise Overloaded if a new request would miss the latency target"""
+        estimate = self.estimated_latency()
+        if estimate > self.latency_target:
+            self.rejected += 1
+            # Time for the queue ahead to drain back under the target
+            retry_after = max(1, math.ceil(estimate - self.latency_target + self.service_time))
+            logger.warning(f"Shedding {self.name} request: estimated latency {estimate:.1f}s > target {self.latency_target:.1f}s")
+            raise Overloaded(self.name, estimate, retry_after)
+
+    @asynccontextmanager
+    async def admit(self):
+        """Admit the request or raise Overloaded before any work is queued"""
+        self.check()
+
+        self.in_flight += 1
+        self.admitted += 1
+        started = None
+        try:
+            async with self._semaphore:
+                started = time.monotonic()
+                yield
+        finally:
+            self.in_flight -= 1
+            if started is not None:
+                self._record(time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        """Current load figures"""
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "service_time": round(self.service_time, 3),
+            "estimated_latency": round(self.estimated_latency(), 3),
+            "latency_target": self.latency_target,
+            "admitted": self.admitted,
+            "rejected": self.rejected
+        }
+
+
+def controller_from_env(name: str, latency_target: float, initial_service_time: float, max_concurrency: int = 8) -> AdmissionController:
+    """Build a controller overridable with ADMISSION_<NAME>_* environment variables"""
+    prefix = f"ADMISSION_{name.upper()}"
+    return AdmissionController(
+        name=name,
+        max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", str(max_concurrency))),
+        latency_target=float(os.getenv(f"{prefix}_TARGET_SECONDS", str(latency_target))),
+        initial_service_time=float(os.getenv(f"{prefix}_SERVICE_SECONDS", str(initial_service_time)))
+    )
+
+
+# Shared controllers, one per upstream-bound endpoint
+generate_admission = controller_from_env("generate", latency_target=25.0, initial_service_time=8.0)
+chat_admission = controller_from_env("chat", latency_target=15.0, initial_service_time=4.0)
+legal_admission = controller_from_env("legal", latency_target=20.0, initial_service_time=6.0)
+
+# When true, /generate falls back to the template path instead of returning 503
+GENERATE_DEGRADE_ON_OVERLOAD = os.getenv("ADMISSION_GENERATE_DEGRADE", "false").lower() == "true"
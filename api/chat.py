@@ -1,11 +1,32 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, AsyncIterator, Tuple
+import asyncio
 import json
 import os
+import re
+import threading
 import logging
 from openai import OpenAI
 
+from idempotency import (
+    idempotency_store, scoped_key, fingerprint_payload,
+    IdempotencyConflict, IDEMPOTENCY_HEADER, REPLAY_HEADER
+)
+from admission import chat_admission, legal_admission, Overloaded
+from chat_history import history_compactor
+from chat_sessions import session_store, ChatSession
+from keywords import chat_matcher, legal_matcher, merge_matches, Matches
+from extraction import field_extractor, merge_fields, Fields, form_schemas, form_properties, validate_values
+from intent import get_intent_model, merge_intent, suggest_tool
+from response_cache import chat_cache, prompt_version, CACHE_ENABLED
+
+try:
+    from legal.router import find_legal_citations
+except ImportError:
+    find_legal_citations = None
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -24,12 +45,16 @@ class ChatMessage(BaseModel):
 
 class ChatRequest(BaseModel):
     tool_id: Optional[str] = None
-    messages: List[ChatMessage]
+    conversation_id: Optional[str] = None
+    message: Optional[str] = None  # Latest user message of a server-side session
+    messages: List[ChatMessage] = []  # Full history (replaces the stored one)
     current_form_values: Optional[Dict[str, Any]] = None
 
 class ChatResponse(BaseModel):
     answer: str
     suggested_fields: Optional[Dict[str, Any]] = None
+    suggested_tool: Optional[str] = None
+    conversation_id: Optional[str] = None
 
 # System prompt for chat assistant
 CHAT_SYSTEM_PROMPT = """Tu es un assistant juridique français expert et bienveillant, spécialisé en démarches administratives citoyennes. Tu aides les citoyens français à comprendre leurs droits et à réaliser leurs démarches.
@@ -77,148 +102,206 @@ Réponds toujours en français clair et bienveillant avec une approche révoluti
 
 Si tu penses qu'un outil peut aider ET que tu as assez d'informations pour pré-remplir intelligemment des champs, tu peux suggérer des champs préremplis avec créativité et personnalisation. Mais seulement si tu es sûr des informations et que cela apporte une vraie valeur ajoutée."""
 
-# Predefined suggested fields for each tool
-TOOL_FIELD_MAPPINGS = {
-    "amendes": {
-        "type_amende": ["stationnement", "vitesse", "transports", "autre"],
-        "date_infraction": "Date de l'infraction (JJ/MM/AAAA)",
-        "lieu": "Lieu de l'infraction",
-        "motif_contestation": "Motif de contestation",
-        "nom": "Nom complet",
-        "adresse": "Adresse complète"
-    },
-    "caf": {
-        "type_courrier_caf": "Type de courrier reçu",
-        "resume_courrier": "Résumé du courrier",
-        "situation": "Description de votre situation",
-        "nom": "Nom complet",
-        "numero_allocataire": "Numéro d'allocataire"
-    },
-    "loyers": {
-        "type_probleme": ["loyer_trop_cher", "charges_abusives", "travaux_non_faits", "autre"],
-        "loyer_hc": "Montant du loyer hors charges",
-        "surface_m2": "Surface du logement en m²",
-        "ville": "Ville",
-        "nom": "Nom complet",
-        "adresse_complete": "Adresse complète du logement"
-    },
-    "travail": {
-        "type_probleme": ["licenciement", "harcelement", "salaire", "conditions", "autre"],
-        "entreprise": "Nom de l'entreprise",
-        "poste": "Intitulé du poste",
-        "date_debut": "Date de début (JJ/MM/AAAA)",
-        "nom": "Nom complet"
-    }
+# Time legal enrichment may take, counted from the start of the LLM call
+LEGAL_ENRICHMENT_BUDGET = float(os.getenv("CHAT_LEGAL_BUDGET_SECONDS", "3.0"))
+
+# With a tool in context, one function-calling completion returns the answer and the form fields
+STRUCTURED_CHAT = os.getenv("CHAT_STRUCTURED_OUTPUT", "true").lower() == "true"
+ANSWER_FUNCTION = "repondre"
+
+OPENAI_UNAVAILABLE_ANSWER = "🚧 Service OpenAI non configuré. L'assistant intelligent nécessite une clé API OpenAI valide pour fonctionner optimalement."
+
+# Unknown or expired conversation id: clients resend the whole history in `messages`
+SESSION_EXPIRED_DETAIL = {
+    "code": "session_expired",
+    "message": "Cette conversation a expiré. Renvoyez l'historique complet pour la poursuivre."
 }
 
-def analyze_conversation_context(messages: List[ChatMessage]) -> Dict[str, Any]:
-    """Analyze conversation to extract context and emotional state"""
-    if not messages:
-        return {"emotional_state": "neutral", "topics": [], "urgency": "normal", "user_text": ""}
-    
-    # Combine all user messages for analysis
-    user_messages = [msg.content.lower() for msg in messages if msg.role == "user"]
-    all_text = " ".join(user_messages)
-    
-    # Detect emotional indicators
-    stress_indicators = ["urgent", "catastrophe", "désespéré", "paniqué", "aide", "sos", "grave"]
-    anger_indicators = ["scandaleux", "inadmissible", "révoltant", "injuste", "colère", "inacceptable"]
-    anxiety_indicators = ["inquiet", "peur", "angoisse", "nerveux", "stress", "préoccupé"]
-    
-    emotional_scores = {
-        "stress": sum(1 for indicator in stress_indicators if indicator in all_text),
-        "anger": sum(1 for indicator in anger_indicators if indicator in all_text),
-        "anxiety": sum(1 for indicator in anxiety_indicators if indicator in all_text)
+def answer_tool(tool_id: str) -> Dict[str, Any]:
+    """Function spec for one tool: the answer text plus the form fields, typed from the tool schema"""
+    properties = {}
+    for name, spec in form_properties(form_schemas[tool_id]).items():
+        description = " - ".join(part for part in (spec.get("title"), spec.get("description")) if part)
+        properties[name] = {"type": spec.get("type", "string"), "description": description}
+        if spec.get("enum"):
+            properties[name]["enum"] = spec["enum"]
+    return {
+        "type": "function",
+        "function": {
+            "name": ANSWER_FUNCTION,
+            "description": "Répond à l'utilisateur et préremplit les champs du formulaire déjà connus grâce à la conversation.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "answer": {"type": "string", "description": "Réponse à l'utilisateur"},
+                    "fields": {
+                        "type": "object",
+                        "description": "Champs du formulaire dont la valeur a été donnée par l'utilisateur. N'invente aucune valeur, omets les champs inconnus.",
+                        "properties": properties,
+                        "additionalProperties": False
+                    }
+                },
+                "required": ["answer", "fields"]
+            }
+        }
     }
+
+ANSWER_TOOLS = {tool_id: answer_tool(tool_id) for tool_id in form_schemas}
+
+# Opening of the answer string in the streamed function arguments
+ANSWER_VALUE = re.compile(r'"answer"\s*:\s*"')
+
+class StructuredAnswerStream:
+    """Text of the "answer" argument, decoded as the function arguments stream in"""
+
+    def __init__(self, tool_id: str):
+        self.tool_id = tool_id
+        self.arguments = ""
+        self._start: Optional[int] = None  # First character of the answer string
+        self._decoded = 0  # Characters of the answer string already decoded
+        self._closed = False
+
+    def feed(self, chunk: str) -> str:
+        """Answer text completed by an arguments delta"""
+        self.arguments += chunk
+        if self._closed:
+            return ""
+        if self._start is None:
+            match = ANSWER_VALUE.search(self.arguments)
+            if not match:
+                return ""
+            self._start = match.end()
+        raw = self.arguments[self._start + self._decoded:]
+        # Stop before the closing quote or an escape sequence still incomplete
+        end = 0
+        while end < len(raw):
+            if raw[end] == '"':
+                self._closed = True
+                break
+            if raw[end] == "\\":
+                size = 6 if raw[end + 1:end + 2] == "u" else 2
+                if end + size > len(raw):
+                    break
+                end += size
+            else:
+                end += 1
+        text = json.loads(f'"{raw[:end]}"', strict=False)
+        if text and not self._closed and "\ud800" <= text[-1] <= "\udbff":
+            # High surrogate: wait for the other half of the character
+            end -= 6
+            text = text[:-1]
+        self._decoded += end
+        return text
+
+    def result(self) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """Full answer and validated fields, once the stream is over"""
+        return parse_answer_arguments(self.arguments, self.tool_id)
+
+def analyze_message(text: str) -> Matches:
+    """Keywords found in one user message"""
+    return chat_matcher.scan(text)
+
+def merge_analysis(analysis: Optional[Matches], update: Matches) -> Matches:
+    """Fold a message analysis into the rolling conversation analysis"""
+    return merge_matches(analysis, update)
+
+def message_intent(text: str) -> Optional[List[float]]:
+    """Tool scores of one user message from the local classifier"""
+    model = get_intent_model()
+    return [float(score) for score in model.score(text)] if model else None
+
+def merge_message_intent(intent: Optional[List[float]], text: str) -> Optional[List[float]]:
+    """Fold a user message into the rolling tool scores"""
+    scores = message_intent(text)
+    return merge_intent(intent, scores) if scores is not None else intent
+
+def merge_message_fields(fields: Optional[Fields], text: str) -> Fields:
+    """Fold the field values found in a user message into the rolling ones"""
+    return merge_fields(fields, field_extractor.extract(text))
+
+def context_from_analysis(analysis: Optional[Matches], intent: Optional[List[float]] = None, fields: Optional[Fields] = None) -> Dict[str, Any]:
+    """Conversation context (emotional state, topics, urgency, field values, likely tool) from the rolling analysis"""
+    analysis = analysis or {}
     
+    emotions = analysis.get("emotions", {})
+    emotional_scores = {emotion: len(emotions.get(emotion, [])) for emotion in chat_matcher.labels("emotions")}
     emotional_state = "neutral"
-    if max(emotional_scores.values()) > 0:
+    if emotional_scores and max(emotional_scores.values()) > 0:
         emotional_state = max(emotional_scores.keys(), key=lambda k: emotional_scores[k])
     
-    # Detect topics and tools mentioned
-    topics = []
-    if "amende" in all_text or "contravention" in all_text or "pv" in all_text:
-        topics.append("amendes")
-    if "caf" in all_text or "allocation" in all_text or "rsa" in all_text:
-        topics.append("caf")
-    if "loyer" in all_text or "bailleur" in all_text or "logement" in all_text:
-        topics.append("loyers")
-    if "travail" in all_text or "licenciement" in all_text or "employeur" in all_text:
-        topics.append("travail")
-    
-    # Detect urgency
-    urgency = "normal"
-    urgent_words = ["urgent", "rapidement", "vite", "délai", "échéance"]
-    if any(word in all_text for word in urgent_words):
-        urgency = "high"
-    
+    topics = analysis.get("topics", {})
     return {
         "emotional_state": emotional_state,
-        "topics": topics,
-        "urgency": urgency,
-        "user_text": all_text
+        "topics": [topic for topic in chat_matcher.labels("topics") if topics.get(topic)],
+        "urgency": "high" if analysis.get("urgency") else "normal",
+        "fields": fields or {},
+        "suggested_tool": suggest_tool(intent)
     }
 
-def enhance_chat_response_with_legal_search(user_question: str, context: Dict[str, Any]) -> str:
-    """Enhance chat response with relevant legal information"""
+def analyze_conversation_context(messages: List[ChatMessage]) -> Dict[str, Any]:
+    """Analyze conversation to extract context and emotional state"""
+    analysis, intent, fields = None, None, None
+    for msg in messages:
+        if msg.role == "user":
+            analysis = merge_analysis(analysis, analyze_message(msg.content))
+            intent = merge_message_intent(intent, msg.content)
+            fields = merge_message_fields(fields, msg.content)
+    return context_from_analysis(analysis, intent, fields)
+
+def format_legal_enrichment(citations: List[Any]) -> str:
+    """Top legal citations appended to a chat answer"""
+    if not citations:
+        return ""
+    legal_context = "\n\n📚 **Références juridiques récentes** :\n"
+    for citation in citations:
+        legal_context += f"• {citation.title} ({citation.source}) - {citation.date}\n"
+    return legal_context.rstrip()
+
+async def admitted_legal_citations(question: str) -> List[Any]:
+    """Legal retrieval for the chat, skipped when the legal search is saturated"""
     try:
-        # Import legal search functionality
-        from api.legal.router import search_legal, LegalQueryIn
-        
-        # If the question seems legal, try to get relevant sources
-        legal_keywords = ["droit", "loi", "article", "code", "juridique", "légal", "jurisprudence"]
-        if any(keyword in user_question.lower() for keyword in legal_keywords):
-            # Perform a legal search
-            query = LegalQueryIn(question=user_question, limit=3, since_months=12)
-            legal_result = search_legal(query)
-            
-            if legal_result and legal_result.citations:
-                legal_context = f"\n\n📚 **Références juridiques récentes** :\n"
-                for citation in legal_result.citations[:2]:  # Limit to top 2
-                    legal_context += f"• {citation.title} ({citation.source}) - {citation.date}\n"
-                legal_context += f"\n💡 **Synthèse** : {legal_result.answer[:200]}..."
-                return legal_context
-    
-    except Exception as e:
-        logger.warning(f"Could not enhance with legal search: {e}")
-    
-    return ""
+        async with legal_admission.admit():
+            return await find_legal_citations(question, limit=2, since_months=12)
+    except Overloaded:
+        return []
+
+async def legal_citations(question: str) -> List[Any]:
+    """Legal retrieval that keeps its admission slot until its worker thread returns"""
+    search = asyncio.ensure_future(admitted_legal_citations(question))
+    # A worker thread cannot be cancelled: when the chat stops waiting, the search
+    # runs on and only releases its slot once done, so in_flight stays accurate.
+    # Its outcome is read even then, so a late failure is not reported as unhandled.
+    search.add_done_callback(lambda task: task.cancelled() or task.exception())
+    return await asyncio.shield(search)
+
+def start_legal_enrichment(question: Optional[str]) -> Optional[asyncio.Task]:
+    """Launch legal retrieval alongside the LLM call when the question looks legal"""
+    if find_legal_citations is None or not question:
+        return None
+    if not legal_matcher.scan(question).get("legal"):
+        return None
+    return asyncio.create_task(legal_citations(question))
+
+async def collect_legal_enrichment(task: Optional[asyncio.Task], deadline: float) -> str:
+    """Citations formatted for the answer if they arrived within the budget, otherwise nothing"""
+    if task is None:
+        return ""
+    if not task.done():
+        await asyncio.wait({task}, timeout=max(0.0, deadline - asyncio.get_running_loop().time()))
+    if not task.done():
+        task.cancel()
+        logger.info("Legal enrichment dropped: over the time budget")
+        return ""
+    if task.cancelled() or task.exception() is not None:
+        logger.warning(f"Could not enhance with legal search: {None if task.cancelled() else task.exception()}")
+        return ""
+    return format_legal_enrichment(task.result())
 
 def extract_info_from_conversation(messages: List[ChatMessage], tool_id: str) -> Optional[Dict[str, Any]]:
     """Extract relevant information from conversation to suggest form fields"""
-    if tool_id not in TOOL_FIELD_MAPPINGS:
+    if tool_id not in field_extractor.fields:
         return None
-    
-    # Simple extraction based on conversation content
-    conversation_text = " ".join([msg.content for msg in messages if msg.role == "user"]).lower()
-    suggested_fields = {}
-    
-    # Basic extraction patterns - this could be enhanced with more sophisticated NLP
-    if tool_id == "amendes":
-        if "stationnement" in conversation_text:
-            suggested_fields["type_amende"] = "stationnement"
-        elif "vitesse" in conversation_text or "radar" in conversation_text:
-            suggested_fields["type_amende"] = "vitesse"
-        elif "transport" in conversation_text or "métro" in conversation_text or "bus" in conversation_text:
-            suggested_fields["type_amende"] = "transports"
-    
-    elif tool_id == "loyers":
-        if "trop cher" in conversation_text or "cher" in conversation_text:
-            suggested_fields["type_probleme"] = "loyer_trop_cher"
-        elif "charge" in conversation_text:
-            suggested_fields["type_probleme"] = "charges_abusives"
-        elif "travaux" in conversation_text or "réparation" in conversation_text:
-            suggested_fields["type_probleme"] = "travaux_non_faits"
-    
-    elif tool_id == "travail":
-        if "licenci" in conversation_text:
-            suggested_fields["type_probleme"] = "licenciement"
-        elif "harcèlement" in conversation_text or "harcel" in conversation_text:
-            suggested_fields["type_probleme"] = "harcelement"
-        elif "salaire" in conversation_text or "paye" in conversation_text:
-            suggested_fields["type_probleme"] = "salaire"
-    
-    return suggested_fields if suggested_fields else None
+    return analyze_conversation_context(messages)["fields"].get(tool_id) or None
 
 def get_chat_response(messages: List[ChatMessage], tool_id: Optional[str] = None, current_form_values: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """Generate chat response using OpenAI or fallback"""
@@ -241,7 +324,7 @@ def get_chat_response(messages: List[ChatMessage], tool_id: Optional[str] = None
             
             # Prepare messages for OpenAI
             openai_messages = [{"role": "system", "content": system_prompt}]
-            openai_messages.extend([{"role": msg.role, "content": msg.content} for msg in messages])
+            openai_messages.extend(build_history(messages))
             
             response = openai_client.chat.completions.create(
                 model="gpt-4o-mini",
@@ -282,22 +365,70 @@ def get_chat_response(messages: List[ChatMessage], tool_id: Optional[str] = None
         }
 
 @router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, req: Request, response: Response):
     """Enhanced chat endpoint with emotional intelligence and legal integration"""
+    client_ip = req.client.host if req.client else "unknown"
+    try:
+        idempotency_key = scoped_key("chat", client_ip, req.headers.get(IDEMPOTENCY_HEADER))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if not idempotency_key:
+        return await run_chat(request)
+    
+    try:
+        result, replayed = await idempotency_store.run(
+            idempotency_key,
+            fingerprint_payload(request.model_dump()),
+            lambda: run_chat(request)
+        )
+    except IdempotencyConflict:
+        raise HTTPException(status_code=422, detail=f"{IDEMPOTENCY_HEADER} already used with a different payload")
+    
+    if replayed:
+        response.headers[REPLAY_HEADER] = "true"
+    return result
+
+async def run_chat(request: ChatRequest) -> ChatResponse:
+    """Analyze the conversation and produce the assistant reply"""
     try:
-        if not request.messages:
+        if not request.messages and not request.message:
             raise HTTPException(status_code=400, detail="Messages cannot be empty")
         
-        # Analyze conversation context for enhanced personalization
-        context = analyze_conversation_context(request.messages)
+        # Conversation state and rolling context analysis are kept server-side
+        session = await open_session(request)
+        messages = session_messages(session)
+        context = session_context(session)
         logger.info(f"Detected context: {context}")
         
         # Get enhanced response using the new intelligent system
-        result = get_enhanced_chat_response(request.messages, request.tool_id, request.current_form_values, context)
+        if openai_client:
+            # Frequent first questions are answered from the semantic cache
+            version = cache_version(session, context)
+            question = latest_user_message(session)
+            result = chat_cache.lookup(question, version) if version else None
+            if result is None:
+                result = await answer_with_llm(session, messages, context)
+                if version and not result.get("fallback"):
+                    # Model text only: the footer and citations belong to this request
+                    chat_cache.store(question, version, {"answer": result["answer"]})
+            else:
+                # Field values belong to this conversation, not to the cached one
+                result["suggested_fields"] = suggest_fields(context, session.tool_id)
+            if not result.pop("fallback", False):
+                result["answer"] += emotional_footer(context)
+            result["answer"] += result.pop("legal", "")
+        else:
+            result = get_enhanced_chat_response(messages, session.tool_id, session.form_values, context)
+        
+        record_turn(session, "assistant", result["answer"])
+        await session_store.save_async(session)
         
         return ChatResponse(
             answer=result["answer"],
-            suggested_fields=result.get("suggested_fields")
+            suggested_fields=result.get("suggested_fields"),
+            suggested_tool=context["suggested_tool"],
+            conversation_id=session.conversation_id
         )
         
     except HTTPException:
@@ -309,67 +440,376 @@ async def chat(request: ChatRequest):
             suggested_fields=None
         )
 
+async def answer_with_llm(session: ChatSession, messages: List[ChatMessage], context: Dict[str, Any]) -> Dict[str, Any]:
+    """Model answer, plus the legal citations retrieved within the time budget (key "legal")"""
+    # Legal retrieval runs concurrently with the LLM call, within a shared budget
+    deadline = asyncio.get_running_loop().time() + LEGAL_ENRICHMENT_BUDGET
+    legal_task = start_legal_enrichment(latest_user_message(session))
+    try:
+        # Shed load early rather than letting LLM calls pile up
+        async with chat_admission.admit():
+            result = await asyncio.to_thread(
+                get_enhanced_chat_response,
+                messages, session.tool_id, session.form_values, context
+            )
+        result["legal"] = await collect_legal_enrichment(legal_task, deadline)
+        return result
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=503,
+            detail="L'assistant est très sollicité en ce moment. Merci de réessayer dans quelques instants.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    finally:
+        if legal_task and not legal_task.done():
+            legal_task.cancel()
+
+def cache_version(session: ChatSession, context: Dict[str, Any]) -> Optional[str]:
+    """Cache version for a single-turn question asked outside any form, None if not cacheable"""
+    if not CACHE_ENABLED or len(session.messages) != 1 or any(session.form_values.values()):
+        return None
+    # Answers depend on the prompt, on the tool the question was routed to and on
+    # the context build_enhanced_messages adapts the prompt to
+    return prompt_version(
+        CHAT_SYSTEM_PROMPT, session.tool_id or "",
+        context["emotional_state"], context["urgency"], context.get("suggested_tool") or ""
+    )
+
+def record_turn(session: ChatSession, role: str, content: str):
+    """Append a turn to the session, updating the rolling analysis with user messages"""
+    session.append(role, content)
+    if role == "user":
+        session.analysis = merge_analysis(session.analysis, analyze_message(content))
+        session.intent = merge_message_intent(session.intent, content)
+        session.fields = merge_message_fields(session.fields, content)
+
+async def open_session(request: ChatRequest) -> ChatSession:
+    """Load (or start) the conversation and record the incoming user turn"""
+    stored = await session_store.get_async(request.conversation_id) if request.conversation_id else None
+    if request.conversation_id and stored is None and not request.messages:
+        # Answering without the lost history would quietly drop the context
+        raise HTTPException(status_code=409, detail=SESSION_EXPIRED_DETAIL)
+    # Work on a copy: the turn only becomes part of the session once answered
+    session = stored.copy() if stored else session_store.create(request.tool_id)
+    if request.tool_id:
+        session.tool_id = request.tool_id
+    if request.current_form_values is not None:
+        session.form_values = request.current_form_values
+    
+    if request.messages:
+        # Clients sending the whole conversation replace the stored history
+        session.messages, session.summary = [], []
+        session.analysis, session.intent, session.fields = None, None, None
+        for msg in request.messages:
+            record_turn(session, msg.role, msg.content)
+    if request.message:
+        record_turn(session, "user", request.message)
+    return session
+
+def latest_user_message(session: ChatSession) -> Optional[str]:
+    """Content of the last user turn"""
+    return next((msg["content"] for msg in reversed(session.messages) if msg["role"] == "user"), None)
+
+def session_messages(session: ChatSession) -> List[ChatMessage]:
+    """Stored turns still kept verbatim"""
+    return [ChatMessage(**msg) for msg in session.messages]
+
+def session_context(session: ChatSession) -> Dict[str, Any]:
+    """Context from the rolling analysis, plus the summary of turns folded out of the session"""
+    context = context_from_analysis(session.analysis, session.intent, session.fields)
+    context["history_summary"] = session.summary
+    return context
+
+def build_enhanced_messages(messages: List[ChatMessage], context: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Build the OpenAI conversation with a system prompt adapted to the detected context"""
+    # Build enhanced system prompt based on context
+    enhanced_system_prompt = CHAT_SYSTEM_PROMPT
+    
+    # Adapt system prompt based on emotional state
+    if context["emotional_state"] == "stress":
+        enhanced_system_prompt += "\n\n🌟 PRIORITÉ ABSOLUE : Cette personne semble en détresse. Adopte un ton particulièrement rassurant, donne des étapes concrètes immédiates, et rappelle que ses droits sont protégés."
+    elif context["emotional_state"] == "anger":
+        enhanced_system_prompt += "\n\n⚡ CONTEXTE ÉMOTIONNEL : Cette personne semble en colère. Valide sa frustration comme légitime, canalise cette énergie vers une action constructive."
+    elif context["emotional_state"] == "anxiety":
+        enhanced_system_prompt += "\n\n🌈 ADAPTATION TONALE : Cette personne semble anxieuse. Décompose chaque étape, rassure sur la normalité de ses inquiétudes."
+    
+    # Add urgency awareness
+    if context["urgency"] == "high":
+        enhanced_system_prompt += "\n\n⏰ URGENCE DÉTECTÉE : Priorise les actions immédiates, donne des délais précis."
+    
+    # Tool identified locally, so the model can recommend it right away
+    if context.get("suggested_tool"):
+        enhanced_system_prompt += f"\n\n🧭 OUTIL PROBABLEMENT PERTINENT : \"{context['suggested_tool']}\"."
+    
+    # Build conversation for OpenAI
+    openai_messages = [{"role": "system", "content": enhanced_system_prompt}]
+    
+    # Add conversation history within the token budget
+    openai_messages.extend(build_history(messages, context.get("history_summary")))
+    
+    return openai_messages
+
+def build_history(messages: List[ChatMessage], base_summary: Optional[List[str]] = None) -> List[Dict[str, str]]:
+    """Recent turns verbatim, older turns folded into a rolling summary"""
+    summary, recent = history_compactor.build([(msg.role, msg.content) for msg in messages], base_summary)
+    history = [{"role": "system", "content": summary}] if summary else []
+    return history + recent
+
+def emotional_footer(context: Dict[str, Any]) -> str:
+    """Emotional adaptation footer appended to the answer"""
+    if context["emotional_state"] == "stress":
+        return "\n\n💪 **Vous n'êtes pas seul(e)** : Des milliers de citoyens vivent des situations similaires et s'en sortent. Vos droits sont solides, votre démarche est légitime."
+    if context["emotional_state"] == "anger":
+        return "\n\n⚖️ **Votre colère est légitime** : Le système juridique français est conçu pour protéger les citoyens comme vous. Transformez cette énergie en action déterminée !"
+    return ""
+
+def suggest_fields(context: Dict[str, Any], tool_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Prefilled field suggestions for the current tool, or the one the classifier suggests"""
+    tool_id = tool_id or context.get("suggested_tool")
+    if tool_id and tool_id in field_extractor.fields:
+        return context["fields"].get(tool_id) or None
+    return None
+
+def structured_completion(messages: List[ChatMessage], context: Dict[str, Any], tool_id: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Answer and validated form fields from a single function-calling completion"""
+    response = openai_client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=build_enhanced_messages(messages, context),
+        max_tokens=1000,
+        temperature=0.7,
+        tools=[ANSWER_TOOLS[tool_id]],
+        tool_choice={"type": "function", "function": {"name": ANSWER_FUNCTION}}
+    )
+    message = response.choices[0].message
+    tool_calls = getattr(message, "tool_calls", None)
+    if not tool_calls:
+        # The model answered in plain text anyway
+        return message.content.strip(), None
+    return parse_answer_arguments(tool_calls[0].function.arguments, tool_id)
+
+def parse_answer_arguments(arguments: str, tool_id: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Answer and validated form fields from the function-call arguments"""
+    arguments = json.loads(arguments)
+    answer = str(arguments.get("answer") or "").strip()
+    if not answer:
+        raise ValueError("Structured completion without an answer")
+    fields = arguments.get("fields")
+    return answer, validate_values(form_schemas[tool_id], fields) if isinstance(fields, dict) else None
+
+def structured_tool(tool_id: Optional[str], context: Dict[str, Any]) -> Optional[str]:
+    """Tool whose form fields the completion returns along with the answer, if any"""
+    form_tool = tool_id or context.get("suggested_tool")
+    return form_tool if STRUCTURED_CHAT and form_tool in ANSWER_TOOLS else None
+
+def merged_fields(model_fields: Optional[Dict[str, Any]], context: Dict[str, Any], tool_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Prefilled fields: the model's, overridden by values found verbatim in the messages"""
+    return {**(model_fields or {}), **(suggest_fields(context, tool_id) or {})} or None
+
 def get_enhanced_chat_response(messages: List[ChatMessage], tool_id: Optional[str], current_form_values: Optional[Dict[str, Any]], context: Dict[str, Any]) -> Dict[str, Any]:
     """Get enhanced chat response with emotional intelligence and legal integration"""
     try:
         if not openai_client:
             return {
-                "answer": "🚧 Service OpenAI non configuré. L'assistant intelligent nécessite une clé API OpenAI valide pour fonctionner optimalement.",
+                "answer": OPENAI_UNAVAILABLE_ANSWER,
                 "suggested_fields": None
             }
         
-        # Build enhanced system prompt based on context
-        enhanced_system_prompt = CHAT_SYSTEM_PROMPT
-        
-        # Adapt system prompt based on emotional state
-        if context["emotional_state"] == "stress":
-            enhanced_system_prompt += "\n\n🌟 PRIORITÉ ABSOLUE : Cette personne semble en détresse. Adopte un ton particulièrement rassurant, donne des étapes concrètes immédiates, et rappelle que ses droits sont protégés."
-        elif context["emotional_state"] == "anger":
-            enhanced_system_prompt += "\n\n⚡ CONTEXTE ÉMOTIONNEL : Cette personne semble en colère. Valide sa frustration comme légitime, canalise cette énergie vers une action constructive."
-        elif context["emotional_state"] == "anxiety":
-            enhanced_system_prompt += "\n\n🌈 ADAPTATION TONALE : Cette personne semble anxieuse. Décompose chaque étape, rassure sur la normalité de ses inquiétudes."
-        
-        # Add urgency awareness
-        if context["urgency"] == "high":
-            enhanced_system_prompt += "\n\n⏰ URGENCE DÉTECTÉE : Priorise les actions immédiates, donne des délais précis."
-        
-        # Build conversation for OpenAI
-        openai_messages = [{"role": "system", "content": enhanced_system_prompt}]
-        
-        # Add conversation history
-        for message in messages[-5:]:  # Keep last 5 messages for context
-            openai_messages.append({
-                "role": message.role,
-                "content": message.content
-            })
-        
         # Call OpenAI with enhanced context
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=openai_messages,
-            max_tokens=800,
-            temperature=0.7
-        )
-        
-        answer = response.choices[0].message.content.strip()
-        
-        # Add emotional adaptation footer
-        if context["emotional_state"] == "stress":
-            answer += "\n\n💪 **Vous n'êtes pas seul(e)** : Des milliers de citoyens vivent des situations similaires et s'en sortent. Vos droits sont solides, votre démarche est légitime."
-        elif context["emotional_state"] == "anger":
-            answer += "\n\n⚖️ **Votre colère est légitime** : Le système juridique français est conçu pour protéger les citoyens comme vous. Transformez cette énergie en action déterminée !"
-        
-        # Try to suggest relevant tools and prefilled fields
-        suggested_fields = None
-        if tool_id and tool_id in TOOL_FIELD_MAPPINGS:
-            suggested_fields = extract_info_from_conversation(messages, tool_id)
+        form_tool = structured_tool(tool_id, context)
+        if form_tool:
+            answer, model_fields = structured_completion(messages, context, form_tool)
+        else:
+            response = openai_client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=build_enhanced_messages(messages, context),
+                max_tokens=800,
+                temperature=0.7
+            )
+            answer, model_fields = response.choices[0].message.content.strip(), None
         
         return {
             "answer": answer,
-            "suggested_fields": suggested_fields
+            "suggested_fields": merged_fields(model_fields, context, tool_id)
         }
         
     except Exception as e:
         logger.error(f"Enhanced chat error: {e}")
         # Fallback to basic response
-        return get_chat_response(messages, tool_id, current_form_values)
\ No newline at end of file
+        result = get_chat_response(messages, tool_id, current_form_values)
+        result["fallback"] = True
+        return result
+
+def format_sse(event: str, data: Any) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_completion(openai_messages: List[Dict[str, str]], structured: Optional[StructuredAnswerStream] = None) -> AsyncIterator[str]:
+    """Yield completion deltas as they arrive, reading the blocking stream in a worker thread
+
+    The call runs under chat admission (Overloaded is raised before any delta).
+    With a structured stream, the answer function is forced and the deltas are
+    those of its "answer" argument; the full arguments are kept in `structured`.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    # Set when the consumer goes away (client disconnect, error)
+    stop = threading.Event()
+    options = {"max_tokens": 800}
+    if structured:
+        options = {
+            "max_tokens": 1000,
+            "tools": [ANSWER_TOOLS[structured.tool_id]],
+            "tool_choice": {"type": "function", "function": {"name": ANSWER_FUNCTION}}
+        }
+    
+    def produce():
+        stream = None
+        try:
+            if stop.is_set():
+                return
+            stream = openai_client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=openai_messages,
+                temperature=0.7,
+                stream=True,
+                **options
+            )
+            for chunk in stream:
+                if stop.is_set():
+                    break
+                delta = chunk.choices[0].delta if chunk.choices else None
+                if delta:
+                    loop.call_soon_threadsafe(queue.put_nowait, delta)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            if stream is not None and hasattr(stream, "close"):
+                try:
+                    stream.close()
+                except Exception as e:
+                    logger.warning(f"Could not close the completion stream: {e}")
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+    
+    async def run_admitted():
+        try:
+            async with chat_admission.admit():
+                await loop.run_in_executor(None, produce)
+        except Overloaded as e:
+            queue.put_nowait(e)
+            queue.put_nowait(None)
+    
+    # A worker thread cannot be cancelled: when the consumer stops, the thread is
+    # told to stop and closes the upstream stream, and the admission slot is only
+    # released once it has returned, so in_flight keeps counting it meanwhile
+    asyncio.ensure_future(run_admitted())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            # Plain text, also when the model answers without calling the function
+            text = item.content or ""
+            for call in (getattr(item, "tool_calls", None) or []) if structured else []:
+                if call.index == 0 and call.function and call.function.arguments:
+                    text += structured.feed(call.function.arguments)
+            if text:
+                yield text
+    finally:
+        stop.set()
+
+async def stream_chat_events(session: ChatSession) -> AsyncIterator[str]:
+    """SSE events: token deltas, then footer, legal, suggested_fields and done"""
+    messages = session_messages(session)
+    context = session_context(session)
+    answer = ""
+    model_fields = None
+    
+    if not openai_client:
+        answer = OPENAI_UNAVAILABLE_ANSWER
+        yield format_sse("token", {"delta": answer})
+    else:
+        version = cache_version(session, context)
+        question = latest_user_message(session)
+        cached = chat_cache.lookup(question, version) if version else None
+        legal_task = None
+        try:
+            if cached:
+                answer = cached["answer"]
+                yield format_sse("token", {"delta": answer})
+            else:
+                # Legal retrieval runs while tokens stream, within a shared budget
+                deadline = asyncio.get_running_loop().time() + LEGAL_ENRICHMENT_BUDGET
+                legal_task = start_legal_enrichment(question)
+                # With a form tool, the answer streams out of the function call that also returns the fields
+                form_tool = structured_tool(session.tool_id, context)
+                structured = StructuredAnswerStream(form_tool) if form_tool else None
+                try:
+                    async for delta in stream_completion(build_enhanced_messages(messages, context), structured):
+                        answer += delta
+                        yield format_sse("token", {"delta": delta})
+                    if structured and structured.arguments:
+                        full_answer, model_fields = structured.result()
+                        if not answer.strip():
+                            # Arguments the stream could not follow: the answer arrives in one piece
+                            answer = full_answer
+                            yield format_sse("token", {"delta": answer})
+                except Overloaded as e:
+                    # The response is already a 200: the event carries the status the client acts on
+                    yield format_sse("error", {"detail": "L'assistant est très sollicité en ce moment. Merci de réessayer dans quelques instants.", "status": 503, "retry_after": e.retry_after})
+                    return
+                except Exception as e:
+                    logger.error(f"Chat stream error: {e}")
+                    yield format_sse("error", {"detail": "Je suis désolé, j'ai rencontré un problème technique. Pouvez-vous reformuler votre question ?", "status": 500})
+                    return
+                if version:
+                    # Model text only: the footer and citations belong to this request
+                    chat_cache.store(question, version, {"answer": answer.strip()})
+            
+            footer = emotional_footer(context)
+            if footer:
+                answer += footer
+                yield format_sse("footer", {"delta": footer})
+            
+            enrichment = await collect_legal_enrichment(legal_task, deadline) if legal_task else ""
+            if enrichment:
+                answer += enrichment
+                yield format_sse("legal", {"delta": enrichment})
+        finally:
+            if legal_task and not legal_task.done():
+                legal_task.cancel()
+
+    answer = answer.strip()
+    record_turn(session, "assistant", answer)
+    await session_store.save_async(session)
+    
+    yield format_sse("suggested_fields", merged_fields(model_fields, context, session.tool_id))
+    yield format_sse("done", {
+        "answer": answer,
+        "suggested_tool": context["suggested_tool"],
+        "conversation_id": session.conversation_id
+    })
+
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Chat endpoint streaming the answer as Server-Sent Events"""
+    if not request.messages and not request.message:
+        raise HTTPException(status_code=400, detail="Messages cannot be empty")
+    
+    # Reject before the stream starts so clients get a real 503
+    if openai_client:
+        try:
+            chat_admission.check()
+        except Overloaded as e:
+            raise HTTPException(
+                status_code=503,
+                detail="L'assistant est très sollicité en ce moment. Merci de réessayer dans quelques instants.",
+                headers={"Retry-After": str(e.retry_after)}
+            )
+    
+    return StreamingResponse(
+        stream_chat_events(await open_session(request)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
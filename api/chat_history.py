@@ -0,0 +1,154 @@
+"""
+Token-budgeted conversation history for the chat assistant
+
+Recent turns are kept verbatim within a token budget; older turns are folded
+into a compact rolling summary. Summaries are cached by a chained hash of the
+folded prefix, so each new turn only summarizes the messages that just left
+the verbatim window instead of the whole conversation.
+"""
+import hashlib
+import logging
+import os
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1200"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("CHAT_SUMMARY_TOKEN_BUDGET", "300"))
+MESSAGE_TOKEN_CAP = int(os.getenv("CHAT_MESSAGE_TOKEN_CAP", "500"))
+
+SUMMARY_HEADER = "Résumé des échanges précédents (informations déjà données par l'utilisateur) :"
+ROLE_LABELS = {"user": "Utilisateur", "assistant": "Assistant"}
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (about 4 characters per token for French text)"""
+    return len(text) // 4 + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Keep the beginning and the end of an oversized message"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    keep = max_tokens * 4
+    head = text[: keep * 2 // 3].rstrip()
+    tail = text[-(keep // 3):].lstrip()
+    return f"{head} […] {tail}"
+
+
+def summarize_turn(role: str, content: str) -> str:
+    """One summary line: the first sentences of a user turn, the first one of an assistant turn"""
+    sentences = re.split(r"(?<=[.!?])\s+", " ".join(content.split()))
+    limit = 2 if role == "user" else 1
+    line = " ".join(sentences[:limit])
+    line = truncate_to_tokens(line, 60 if role == "user" else 25)
+    return f"- {ROLE_LABELS.get(role, role)} : {line}"
+
+
+def _chain(previous: str, role: str, content: str) -> str:
+    """Chained hash identifying a conversation prefix"""
+    return hashlib.sha1(f"{previous}\x1f{role}\x1f{content}".encode("utf-8")).hexdigest()
+
+
+def _fit_summary(lines: List[str], budget: int) -> List[str]:
+    """Drop the oldest assistant lines first, then the oldest user lines, until within budget"""
+    lines = list(lines)
+    while lines and estimate_tokens("\n".join(lines)) > budget:
+        assistant_index = next((i for i, line in enumerate(lines) if not line.startswith("- Utilisateur")), None)
+        del lines[assistant_index if assistant_index is not None else 0]
+    return lines
+
+
+def fold_turns(lines: List[str], turns: Sequence[Tuple[str, str]], budget: int = SUMMARY_TOKEN_BUDGET) -> List[str]:
+    """Append summary lines for the given turns, staying within budget"""
+    for role, content in turns:
+        lines = _fit_summary(list(lines) + [summarize_turn(role, content)], budget)
+    return lines
+
+
+class HistoryCompactor:
+    """Builds bounded prompt history and caches rolling summaries"""
+
+    def __init__(
+        self,
+        token_budget: int = HISTORY_TOKEN_BUDGET,
+        summary_budget: int = SUMMARY_TOKEN_BUDGET,
+        message_cap: int = MESSAGE_TOKEN_CAP,
+        cache_size: int = 2000
+    ):
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.message_cap = message_cap
+        self.cache_size = cache_size
+        self._summaries: "OrderedDict[str, List[str]]" = OrderedDict()
+
+    def _remember(self, key: str, lines: List[str]):
+        self._summaries[key] = lines
+        self._summaries.move_to_end(key)
+        while len(self._summaries) > self.cache_size:
+            self._summaries.popitem(last=False)
+
+    def summary_lines(self, older: Sequence[Tuple[str, str]], base: Optional[List[str]] = None) -> List[str]:
+        """Rolling summary of the folded turns, extended from the longest cached prefix"""
+        base = list(base or [])
+        hashes = []
+        previous = _chain("", "summary", "\n".join(base)) if base else ""
+        for role, content in older:
+            previous = _chain(previous, role, content)
+            hashes.append(previous)
+
+        start, lines = 0, _fit_summary(base, self.summary_budget)
+        for index in range(len(hashes) - 1, -1, -1):
+            cached = self._summaries.get(hashes[index])
+            if cached is not None:
+                start, lines = index + 1, cached
+                break
+
+        for index in range(start, len(older)):
+            role, content = older[index]
+            lines = _fit_summary(lines + [summarize_turn(role, content)], self.summary_budget)
+            self._remember(hashes[index], lines)
+        return lines
+
+    def build(
+        self,
+        messages: Sequence[Tuple[str, str]],
+        base_summary: Optional[List[str]] = None
+    ) -> Tuple[Optional[str], List[Dict[str, str]]]:
+        """
+        Split a conversation into a summary and verbatim recent turns
+
+        Args:
+            messages: (role, content) pairs, oldest first
+            base_summary: Summary lines of turns no longer in `messages` (server-side sessions)
+
+        Returns:
+            (summary text or None, recent messages as OpenAI dicts)
+        """
+        recent: List[Dict[str, str]] = []
+        used = 0
+        split = len(messages)
+        for index in range(len(messages) - 1, -1, -1):
+            role, content = messages[index]
+            content = truncate_to_tokens(content, self.message_cap)
+            cost = estimate_tokens(content)
+            # The latest message is always kept, even over budget
+            if recent and used + cost > self.token_budget:
+                break
+            recent.insert(0, {"role": role, "content": content})
+            used += cost
+            split = index
+
+        older = messages[:split]
+        if not older and not base_summary:
+            return None, recent
+
+        lines = self.summary_lines(older, base_summary)
+        summary = f"{SUMMARY_HEADER}\n" + "\n".join(lines) if lines else None
+        return summary, recent
+
+
+# Shared compactor for the chat router
+history_compactor = HistoryCompactor()
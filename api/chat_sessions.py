@@ -0,0 +1,226 @@
+"""
+Server-side chat sessions
+
+Conversations are kept by the API, keyed by conversation id, so clients only
+post the latest message. Sessions live in an in-memory LRU with TTL
+eviction; setting CHAT_SESSION_DB adds a SQLite persistence tier read on
+cache misses (restarts, multiple workers on one host). Async handlers use
+get_async/save_async so SQLite I/O stays off the event loop.
+"""
+import asyncio
+import copy
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from chat_history import fold_turns, SUMMARY_TOKEN_BUDGET
+
+logger = logging.getLogger(__name__)
+
+# Messages kept verbatim per session; older ones are folded into the session summary
+MAX_SESSION_MESSAGES = int(os.getenv("CHAT_SESSION_MAX_MESSAGES", "40"))
+
+
+class ChatSession:
+    """Conversation state: history, form values and rolling analysis"""
+
+    def __init__(
+        self,
+        conversation_id: str,
+        tool_id: Optional[str] = None,
+        messages: Optional[List[Dict[str, str]]] = None,
+        form_values: Optional[Dict[str, Any]] = None,
+        analysis: Optional[Dict[str, Any]] = None,
+        summary: Optional[List[str]] = None,
+        intent: Optional[List[float]] = None,
+        fields: Optional[Dict[str, Dict[str, Any]]] = None,
+        updated_at: Optional[float] = None
+    ):
+        self.conversation_id = conversation_id
+        self.tool_id = tool_id
+        self.messages = messages or []
+        self.form_values = form_values or {}
+        self.analysis = analysis
+        self.summary = summary or []
+        self.intent = intent
+        self.fields = fields
+        self.updated_at = updated_at or time.time()
+
+    def append(self, role: str, content: str):
+        """Add a turn, folding the oldest ones into the summary past the cap"""
+        self.messages.append({"role": role, "content": content})
+        overflow = len(self.messages) - MAX_SESSION_MESSAGES
+        if overflow > 0:
+            folded = [(msg["role"], msg["content"]) for msg in self.messages[:overflow]]
+            self.summary = fold_turns(self.summary, folded, SUMMARY_TOKEN_BUDGET)
+            self.messages = self.messages[overflow:]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "conversation_id": self.conversation_id,
+            "tool_id": self.tool_id,
+            "messages": self.messages,
+            "form_values": self.form_values,
+            "analysis": self.analysis,
+            "summary": self.summary,
+            "intent": self.intent,
+            "fields": self.fields,
+            "updated_at": self.updated_at
+        }
+
+    def copy(self) -> "ChatSession":
+        """Working copy, so a failed turn leaves the stored session untouched"""
+        return ChatSession.from_dict(copy.deepcopy(self.to_dict()))
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ChatSession":
+        return cls(**data)
+
+
+class SessionStore:
+    """LRU + TTL session cache with an optional SQLite tier"""
+
+    def __init__(self, max_sessions: int = 10000, ttl_seconds: int = 6 * 3600, db_path: Optional[str] = None):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        if self.db_path:
+            self._init_db()
+
+    def _init_db(self):
+        """Initialize SQLite persistence tier"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS chat_sessions (
+                conversation_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        conn.commit()
+        conn.close()
+
+    def _expired(self, session: ChatSession) -> bool:
+        return time.time() - session.updated_at > self.ttl_seconds
+
+    def _cache(self, session: ChatSession):
+        self._sessions[session.conversation_id] = session
+        self._sessions.move_to_end(session.conversation_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def _load(self, conversation_id: str) -> Optional[ChatSession]:
+        """Read a session from the SQLite tier"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            row = conn.execute(
+                "SELECT data FROM chat_sessions WHERE conversation_id = ?",
+                (conversation_id,)
+            ).fetchone()
+            conn.close()
+            return ChatSession.from_dict(json.loads(row[0])) if row else None
+        except Exception as e:
+            logger.error(f"Error loading chat session {conversation_id}: {e}")
+            return None
+
+    def _write(self, conversation_id: str, data: str, updated_at: float):
+        """Write a serialized session to the SQLite tier"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            # Writes may land out of order from worker threads: never overwrite a newer turn
+            conn.execute(
+                """INSERT INTO chat_sessions (conversation_id, data, updated_at) VALUES (?, ?, ?)
+                   ON CONFLICT(conversation_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+                   WHERE excluded.updated_at >= chat_sessions.updated_at""",
+                (conversation_id, data, updated_at)
+            )
+            # Opportunistic cleanup of expired rows
+            conn.execute("DELETE FROM chat_sessions WHERE updated_at < ?", (time.time() - self.ttl_seconds,))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error saving chat session {conversation_id}: {e}")
+
+    def _remove(self, conversation_id: str):
+        """Delete a session from the SQLite tier"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            conn.execute("DELETE FROM chat_sessions WHERE conversation_id = ?", (conversation_id,))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error deleting chat session {conversation_id}: {e}")
+
+    def _live(self, conversation_id: str, session: Optional[ChatSession]) -> Optional[ChatSession]:
+        """Cache a loaded session, or drop it from memory when expired"""
+        if session is None:
+            return None
+        if self._expired(session):
+            self._sessions.pop(conversation_id, None)
+            return None
+        self._cache(session)
+        return session
+
+    def _touch(self, session: ChatSession) -> str:
+        """Refresh the TTL, cache the session and return its serialized form"""
+        session.updated_at = time.time()
+        self._cache(session)
+        return json.dumps(session.to_dict(), ensure_ascii=False)
+
+    def get(self, conversation_id: str) -> Optional[ChatSession]:
+        """Live session for an id, None if unknown or expired"""
+        session = self._sessions.get(conversation_id)
+        if session is None and self.db_path:
+            session = self._load(conversation_id)
+        live = self._live(conversation_id, session)
+        if session is not None and live is None and self.db_path:
+            self._remove(conversation_id)
+        return live
+
+    async def get_async(self, conversation_id: str) -> Optional[ChatSession]:
+        """`get` for async handlers: SQLite reads and deletes run in a worker thread"""
+        session = self._sessions.get(conversation_id)
+        if session is None and self.db_path:
+            session = await asyncio.to_thread(self._load, conversation_id)
+        live = self._live(conversation_id, session)
+        if session is not None and live is None and self.db_path:
+            await asyncio.to_thread(self._remove, conversation_id)
+        return live
+
+    def create(self, tool_id: Optional[str] = None) -> ChatSession:
+        """New empty session with a random id, stored on first save"""
+        return ChatSession(uuid.uuid4().hex, tool_id=tool_id)
+
+    def save(self, session: ChatSession):
+        """Refresh the TTL and write through to SQLite when enabled"""
+        data = self._touch(session)
+        if self.db_path:
+            self._write(session.conversation_id, data, session.updated_at)
+
+    async def save_async(self, session: ChatSession):
+        """`save` for async handlers: the session is serialized here, written in a worker thread"""
+        data = self._touch(session)
+        if self.db_path:
+            await asyncio.to_thread(self._write, session.conversation_id, data, session.updated_at)
+
+    def delete(self, conversation_id: str):
+        self._sessions.pop(conversation_id, None)
+        if self.db_path:
+            self._remove(conversation_id)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+# Shared store for the chat router
+session_store = SessionStore(
+    max_sessions=int(os.getenv("CHAT_SESSION_MAX", "10000")),
+    ttl_seconds=int(os.getenv("CHAT_SESSION_TTL_SECONDS", str(6 * 3600))),
+    db_path=os.getenv("CHAT_SESSION_DB") or None
+)
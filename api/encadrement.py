@@ -0,0 +1,349 @@
+"""
+Local rent-cap (encadrement des loyers) reference index
+
+Built once from the open-data CSV exports published by the cities
+(Paris, Lille, Lyon, Montpellier, Bordeaux...), stored as a sorted NumPy
+record array and memory-mapped at runtime: a lookup is a binary search over
+packed integer keys (zone, pièces, époque, meublé).
+
+Build the index from the api/ directory:
+    python encadrement.py build data/encadrement/*.csv --out encadrement
+"""
+import csv
+import json
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+import numpy as np
+
+import extraction
+from text_utils import normalize_text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_PATH = os.getenv("ENCADREMENT_INDEX_PATH", "encadrement")
+
+RECORD_DTYPE = np.dtype([
+    ("key", "<i8"),
+    ("reference", "<f4"),
+    ("majore", "<f4"),
+    ("minore", "<f4"),
+    ("annee", "<i2"),
+])
+
+EPOQUE_LABELS = ["Avant 1946", "1946-1970", "1971-1990", "Après 1990"]
+
+# Accepted header names in the open-data exports, in priority order
+COLUMN_ALIASES = {
+    "zone": ["zone", "nom_quartier", "quartier", "nom_zone", "commune", "nom_commune", "ville"],
+    "pieces": ["piece", "pieces", "nombre_pieces", "nb_pieces"],
+    "epoque": ["epoque", "epoque_construction", "periode_construction"],
+    "meuble": ["meuble_txt", "meuble", "type_location"],
+    "reference": ["ref", "reference", "loyer_reference", "loyer_de_reference"],
+    "majore": ["max", "ref_majore", "loyer_reference_majore", "loyer_de_reference_majore"],
+    "minore": ["min", "ref_minore", "loyer_reference_minore", "loyer_de_reference_minore"],
+    "annee": ["annee", "annee_application", "millesime"],
+}
+
+
+class RentCap(NamedTuple):
+    """Rent-cap values in €/m² for one (zone, pièces, époque, meublé) cell"""
+    zone: str
+    pieces: int
+    epoque: str
+    meuble: bool
+    reference: float
+    majore: float
+    minore: float
+    annee: int
+
+
+def parse_number(value: Any) -> Optional[float]:
+    """Parse a French-formatted number ("1 200,50 €"), None if impossible"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    cleaned = re.sub(r"[^0-9,.\-]", "", str(value))
+    try:
+        return extraction.parse_number(cleaned)
+    except ValueError:
+        return None
+
+
+def epoque_code(value: Any) -> Optional[int]:
+    """Map a construction period (label or year) to 0..3"""
+    if value is None or value == "":
+        return None
+    text = normalize_text(value)
+    if "avant" in text:
+        return 0
+    if "apres" in text:
+        return 3
+    years = [int(y) for y in re.findall(r"\d{4}", text)]
+    if not years:
+        return None
+    year = max(years) if len(years) > 1 else years[0]
+    if year < 1946:
+        return 0
+    if year <= 1970:
+        return 1
+    if year <= 1990:
+        return 2
+    return 3
+
+
+def meuble_code(value: Any) -> Optional[int]:
+    """Map a furnished flag (bool or "meublé"/"non meublé"/"oui"/"non") to 0/1"""
+    if isinstance(value, bool):
+        return int(value)
+    if value is None or value == "":
+        return None
+    text = normalize_text(value)
+    if text.startswith("non") or text in ("false", "0", "nu", "vide"):
+        return 0
+    if "meuble" in text or text in ("oui", "true", "1"):
+        return 1
+    return None
+
+
+def pieces_code(value: Any) -> Optional[int]:
+    """Room count, capped at 4 (the "4 pièces et plus" bucket)"""
+    number = parse_number(value)
+    if number is None or number < 1:
+        return None
+    return min(int(number), 4)
+
+
+def pack_key(zone_id: int, pieces: int, epoque: int, meuble: int) -> int:
+    """Pack a lookup tuple into one sortable integer"""
+    return ((zone_id * 8 + pieces) * 4 + epoque) * 2 + meuble
+
+
+class RentReferenceIndex:
+    """Sorted, memory-mapped rent-cap table"""
+
+    def __init__(self, records: np.ndarray, zones: Dict[str, int]):
+        self.records = records
+        self.keys = records["key"]
+        self.zones = zones
+        self.zone_names = {zone_id: name for name, zone_id in zones.items()}
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_INDEX_PATH) -> Optional["RentReferenceIndex"]:
+        """Memory-map a built index, None if it does not exist"""
+        records_path = Path(f"{path}.npy")
+        zones_path = Path(f"{path}.zones.json")
+        if not (records_path.exists() and zones_path.exists()):
+            return None
+        try:
+            records = np.load(records_path, mmap_mode="r")
+            with open(zones_path, "r", encoding="utf-8") as f:
+                zones = json.load(f)
+            logger.info(f"Loaded rent-cap index with {len(records)} entries and {len(zones)} zones")
+            return cls(records, zones)
+        except Exception as e:
+            logger.error(f"Error loading rent-cap index from {path}: {e}")
+            return None
+
+    @classmethod
+    def build(cls, csv_paths: Iterable[str], out_path: str = DEFAULT_INDEX_PATH) -> "RentReferenceIndex":
+        """Build the index from open-data CSV exports and write it to disk"""
+        zones: Dict[str, int] = {}
+        latest: Dict[int, tuple] = {}
+
+        for csv_path in csv_paths:
+            for row in _read_rows(csv_path):
+                zone = normalize_text(row["zone"])
+                pieces = pieces_code(row["pieces"])
+                epoque = epoque_code(row["epoque"])
+                meuble = meuble_code(row["meuble"])
+                reference = parse_number(row["reference"])
+                if not zone or None in (pieces, epoque, meuble, reference):
+                    continue
+
+                zone_id = zones.setdefault(zone, len(zones))
+                key = pack_key(zone_id, pieces, epoque, meuble)
+                majore = parse_number(row.get("majore")) or reference * 1.2
+                minore = parse_number(row.get("minore")) or reference * 0.7
+                annee = int(parse_number(row.get("annee")) or 0)
+
+                # Keep the most recent year when exports overlap
+                if key not in latest or annee >= latest[key][4]:
+                    latest[key] = (key, reference, majore, minore, annee)
+
+        records = np.array(sorted(latest.values()), dtype=RECORD_DTYPE)
+        np.save(f"{out_path}.npy", records)
+        with open(f"{out_path}.zones.json", "w", encoding="utf-8") as f:
+            json.dump(zones, f, ensure_ascii=False)
+
+        logger.info(f"Built rent-cap index with {len(records)} entries and {len(zones)} zones")
+        return cls.load(out_path)
+
+    def lookup(self, zone: str, pieces: Any, epoque: Any, meuble: Any) -> Optional[RentCap]:
+        """Exact lookup, None when any criterion is unknown or missing"""
+        zone_id = self.zones.get(normalize_text(zone))
+        pieces_value = pieces_code(pieces)
+        epoque_value = epoque_code(epoque)
+        meuble_value = meuble_code(meuble)
+        if zone_id is None or None in (pieces_value, epoque_value, meuble_value):
+            return None
+
+        key = pack_key(zone_id, pieces_value, epoque_value, meuble_value)
+        position = int(np.searchsorted(self.keys, key))
+        if position >= len(self.keys) or self.keys[position] != key:
+            return None
+
+        record = self.records[position]
+        return RentCap(
+            zone=self.zone_names[zone_id],
+            pieces=pieces_value,
+            epoque=EPOQUE_LABELS[epoque_value],
+            meuble=bool(meuble_value),
+            reference=round(float(record["reference"]), 2),
+            majore=round(float(record["majore"]), 2),
+            minore=round(float(record["minore"]), 2),
+            annee=int(record["annee"])
+        )
+
+    def resolve_zone(self, fields: Dict[str, Any]) -> Optional[str]:
+        """Find the zone from the explicit field, then the commune in the address"""
+        candidates = [fields.get("zone_encadrement")]
+
+        adresse = fields.get("adresse_logement") or ""
+        match = re.search(r"\b\d{5}\s+(.+)$", str(adresse))
+        if match:
+            commune = match.group(1)
+            candidates.extend([commune, commune.split()[0]])
+
+        for candidate in candidates:
+            if candidate and normalize_text(candidate) in self.zones:
+                return normalize_text(candidate)
+        return None
+
+    def lookup_fields(self, fields: Dict[str, Any]) -> Optional[RentCap]:
+        """Lookup from loyers form fields"""
+        zone = self.resolve_zone(fields)
+        if not zone:
+            return None
+        return self.lookup(zone, fields.get("nombre_pieces"), fields.get("epoque_construction"), fields.get("meuble"))
+
+
+def _read_rows(csv_path: str) -> Iterable[Dict[str, Any]]:
+    """Yield rows with canonical column names, whatever the export's header"""
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=";,\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.DictReader(f, dialect=dialect)
+
+        header = {normalize_text(name).replace(" ", "_"): name for name in (reader.fieldnames or [])}
+        mapping = {}
+        for canonical, aliases in COLUMN_ALIASES.items():
+            for alias in aliases:
+                if alias in header:
+                    mapping[canonical] = header[alias]
+                    break
+
+        missing = {"zone", "pieces", "epoque", "meuble", "reference"} - set(mapping)
+        if missing:
+            logger.warning(f"Skipping {csv_path}: missing columns {', '.join(sorted(missing))}")
+            return
+
+        for row in reader:
+            yield {canonical: row.get(source) for canonical, source in mapping.items()}
+
+
+_index: Optional[RentReferenceIndex] = None
+_index_loaded = False
+
+
+def get_reference_index() -> Optional[RentReferenceIndex]:
+    """Process-wide index, loaded lazily on first use"""
+    global _index, _index_loaded
+    if not _index_loaded:
+        _index = RentReferenceIndex.load(DEFAULT_INDEX_PATH)
+        _index_loaded = True
+    return _index
+
+
+def lookup_rent_cap(fields: Dict[str, Any]) -> Optional[RentCap]:
+    """Rent cap for loyers form fields, None without an index or a match"""
+    index = get_reference_index()
+    if index is None:
+        return None
+    try:
+        return index.lookup_fields(fields)
+    except Exception as e:
+        logger.warning(f"Rent-cap lookup failed: {e}")
+        return None
+
+
+def prefill_loyer_reference(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill loyer_reference (maximum monthly rent) from the index when left empty"""
+    if parse_number(fields.get("loyer_reference")):
+        return fields
+    cap = lookup_rent_cap(fields)
+    surface = parse_number(fields.get("surface_m2"))
+    if not cap or not surface:
+        return fields
+    prefilled = fields.copy()
+    prefilled["loyer_reference"] = round(cap.majore * surface, 2)
+    return prefilled
+
+
+def describe_rent_cap(cap: RentCap, fields: Dict[str, Any]) -> List[str]:
+    """Context lines with the exact figures, including the computed excess"""
+    meuble = "meublé" if cap.meuble else "non meublé"
+    pieces = f"{cap.pieces} pièce{'s' if cap.pieces > 1 else ''}" + (" et plus" if cap.pieces == 4 else "")
+    lines = [
+        f"Zone : {cap.zone} — {pieces}, construit {cap.epoque.lower()}, {meuble}" + (f" (arrêté {cap.annee})" if cap.annee else ""),
+        f"Loyer de référence : {cap.reference:.2f} €/m²",
+        f"Loyer de référence majoré (plafond) : {cap.majore:.2f} €/m²",
+        f"Loyer de référence minoré : {cap.minore:.2f} €/m²",
+    ]
+
+    surface = parse_number(fields.get("surface_m2"))
+    loyer = parse_number(fields.get("loyer_actuel"))
+    if surface and surface > 0:
+        plafond = cap.majore * surface
+        lines.append(f"Loyer maximum autorisé pour {surface:g} m² : {plafond:.2f} €")
+        if loyer:
+            depassement = loyer - plafond
+            lines.append(f"Loyer actuel : {loyer:.2f} € ({loyer / surface:.2f} €/m²)")
+            if depassement > 0:
+                lines.append(f"Dépassement du plafond : {depassement:.2f} € par mois")
+            else:
+                lines.append("Le loyer actuel respecte le plafond légal")
+    return lines
+
+
+def rent_cap_checklist(cap: RentCap, fields: Dict[str, Any]) -> List[str]:
+    """Checklist items carrying the exact figures"""
+    items = [f"Vérifier le plafond de {cap.majore:.2f} €/m² (loyer de référence majoré, {cap.zone})"]
+    surface = parse_number(fields.get("surface_m2"))
+    loyer = parse_number(fields.get("loyer_actuel"))
+    if surface and loyer and loyer > cap.majore * surface:
+        items.append(f"Réclamer la diminution du loyer et le remboursement du trop-perçu de {loyer - cap.majore * surface:.2f} € par mois")
+    return items
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build the rent-cap reference index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Build the index from open-data CSV files")
+    build_parser.add_argument("csv", nargs="+", help="Open-data CSV exports")
+    build_parser.add_argument("--out", default=DEFAULT_INDEX_PATH, help="Output path prefix")
+
+    args = parser.parse_args()
+    index = RentReferenceIndex.build(args.csv, args.out)
+    print(f"Rent-cap index written to {args.out}.npy ({len(index.records)} entries, {len(index.zones)} zones)")
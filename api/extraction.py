@@ -0,0 +1,434 @@
+"""
+Schema-driven field extraction from chat messages
+
+The tool schemas are compiled at startup into one extraction engine:
+
+- enum and boolean fields get synonym tables (the enum values themselves plus
+  the curated field_synonyms.json), matched on whole words in a single pass;
+- typed fields (dates, amounts, surfaces, rates, allocataire numbers,
+  addresses, cities...) are recognized from their name, title and description
+  and filled from one combined regex over the message. When several fields
+  could take a value, the words preceding it (cues, from the field texts and
+  the curated synonyms) pick the field.
+
+Only values valid for the schema are produced, so suggestions can be applied
+to the forms as they are. Nested objects (identite, employeur) are left out:
+the forms merge suggestions shallowly.
+"""
+import json
+import logging
+import os
+import re
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from keywords import KeywordMatcher
+from text_utils import normalize_text, tokenize
+
+logger = logging.getLogger(__name__)
+
+API_DIR = Path(__file__).resolve().parent
+SCHEMA_DIRS = [API_DIR.parent / "schemas", API_DIR.parent / "web" / "public" / "schemas"]
+FIELD_SYNONYMS_PATH = os.getenv("FIELD_SYNONYMS_PATH", str(API_DIR / "field_synonyms.json"))
+
+# {tool_id: {field: value}}
+Fields = Dict[str, Dict[str, Any]]
+
+# Enum values too generic to be recognized from their own name
+UNMATCHABLE_VALUES = {"autre", "oui", "non"}
+
+# Words of a field description that say nothing about which field a value belongs to
+CUE_STOPWORDS = {"votre", "vous", "dans", "pour", "avec", "selon", "montant", "adresse", "complete", "format"}
+
+# Longest text value accepted for a field
+MAX_TEXT_LENGTH = 2000
+
+# Characters of text before a typed value searched for field cues
+CUE_WINDOW = 60
+CUE_STEM_LENGTH = 6
+
+# Kinds too common across tools to be filled without a cue ("35 €" alone says nothing)
+CUED_KINDS = {"amount"}
+
+MONTHS = {
+    "janvier": 1, "fevrier": 2, "mars": 3, "avril": 4, "mai": 5, "juin": 6, "juillet": 7,
+    "aout": 8, "septembre": 9, "octobre": 10, "novembre": 11, "decembre": 12
+}
+
+_NUMBER = r"\d{1,3}(?:[ \u00a0\u202f.]\d{3})+(?:,\d{1,2})?|\d+(?:[.,]\d{1,2})?"
+_MONTH = r"janvier|f[ée]vrier|mars|avril|mai|juin|juillet|ao[uû]t|septembre|octobre|novembre|d[ée]cembre"
+# Capitalized commune name ("Paris", "Saint-Denis", "Boulogne-sur-Mer", "Aix en Provence")
+_COMMUNE = r"(?-i:[A-ZÀ-Ý][\w'’-]*(?:[ -](?:(?:sur|sous|en|le|la|les|de|du|d'|l')[ -])?[A-ZÀ-Ý][\w'’-]*)*)"
+_STREET = r"rue|avenue|av\.|boulevard|bd|place|all[ée]e|impasse|chemin|quai|cours|route|square"
+# Street name: capitalized words, possibly joined by articles ("de la Paix", "Victor Hugo")
+_STREET_NAME = r"(?:\s+(?:(?:de|du|des|la|le|les|l['’]|d['’])\s*)*(?-i:[A-ZÀ-Ý0-9][\w'’-]*))+"
+
+# All typed values in one alternation, scanned left to right in a single pass
+TYPED_PATTERN = re.compile("|".join([
+    r"(?P<date>\b\d{1,2}[/.-]\d{1,2}[/.-](?:\d{4}|\d{2})\b)",
+    rf"(?P<date_text>\b(?:1er|\d{{1,2}})\s+(?:{_MONTH})\s+\d{{4}}\b)",
+    r"(?P<allocataire>\ballocataire\D{0,25}?\d{5,10}\b)",
+    rf"(?P<address>(?:\b\d{{1,4}}(?:\s?(?:bis|ter))?,?\s+)?\b(?:{_STREET}){_STREET_NAME}(?:,?\s*\d{{5}}\s+{_COMMUNE})?)",
+    rf"(?P<postcode>\b\d{{5}}\s+{_COMMUNE})",
+    rf"(?P<city>\b(?:j['’]habite|je vis|je r[ée]side|domicili[ée]e?)\s+(?:à|a)\s+{_COMMUNE})",
+    rf"(?P<amount>(?:{_NUMBER})\s?(?:€|euros?\b))",
+    rf"(?P<surface>(?:{_NUMBER})\s?(?:m²|m2\b|m[èe]tres?\s+carr[ée]s?))",
+    rf"(?P<percent>(?:{_NUMBER})\s?%)",
+    r"(?P<rooms>\b(?:[TF][1-9]\b|\d{1,2}\s+pi[èe]ces?\b))",
+    r"(?P<age>\b(?:j['’]ai|[âa]g[ée]e? de)\s+\d{1,3}\s+ans\b)",
+    r"(?P<persons>\b\d{1,2}\s+personnes\b)",
+    r"(?P<year>\b(?:construite?|construction|datant|b[âa]tie?|immeuble)\s+(?:en|de|du)\s+\d{4}\b)",
+]), re.IGNORECASE)
+
+POSTCODE_PATTERN = re.compile(rf"\b\d{{5}}\s+({_COMMUNE})", re.IGNORECASE)
+CITY_PATTERN = re.compile(rf"\s(?:à|a)\s+({_COMMUNE})$", re.IGNORECASE)
+
+# Match kinds each typed field accepts
+ACCEPTED_MATCHES = {
+    "date": ("date", "date_text"),
+    "amount": ("amount",),
+    "surface": ("surface",),
+    "percent": ("percent",),
+    "rooms": ("rooms",),
+    "age": ("age",),
+    "persons": ("persons",),
+    "period": ("year",),
+    "allocataire": ("allocataire",),
+    "address": ("address",),
+    "city": ("city", "postcode", "address"),
+}
+
+
+class FieldSpec(NamedTuple):
+    """How one schema field is recognized"""
+    kind: str
+    type: str
+    enum: Optional[List[Any]]
+    cues: List[str]
+    distinctive_cues: List[str]
+
+
+class TypedMatch(NamedTuple):
+    """A typed value found in a message"""
+    kind: str
+    value: Any
+    start: int
+    end: int
+
+
+def load_schemas(schema_dirs: List[Path] = SCHEMA_DIRS) -> Dict[str, Dict[str, Any]]:
+    """Tool schemas by tool id (first directory wins)"""
+    schemas: Dict[str, Dict[str, Any]] = {}
+    for directory in schema_dirs:
+        if not directory.is_dir():
+            continue
+        for path in sorted(directory.glob("*.json")):
+            with open(path, "r", encoding="utf-8") as f:
+                schemas.setdefault(path.stem, json.load(f))
+    return schemas
+
+
+def load_synonyms(path: str = FIELD_SYNONYMS_PATH) -> Dict[str, Dict[str, Any]]:
+    """Curated synonyms: {tool_id: {field: {value: [synonyms]}}} for enums, {tool_id: {field: [cues]}} for typed fields"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def field_kind(name: str, spec: Dict[str, Any]) -> Optional[str]:
+    """Kind of value a schema field holds, None for free text"""
+    title = spec.get("title", "")
+    description = spec.get("description", "").lower()
+    if spec.get("enum") and all(re.search(r"\d{4}", str(value)) for value in spec["enum"]):
+        return "period"
+    if spec.get("enum") or spec.get("type") == "boolean":
+        return "enum"
+    if name.startswith("date_"):
+        return "date"
+    if "allocataire" in name:
+        return "allocataire"
+    if "m²" in title:
+        return "surface"
+    if "%" in title:
+        return "percent"
+    if "€" in title or "euros" in description:
+        return "amount"
+    if spec.get("type") == "integer":
+        lowered = title.lower()
+        if "pièces" in lowered:
+            return "rooms"
+        if "âge" in lowered:
+            return "age"
+        if "personnes" in lowered:
+            return "persons"
+        return None
+    if "adresse" in name or description.startswith("adresse"):
+        return "address"
+    if name == "ville":
+        return "city"
+    return None
+
+
+def parse_number(text: str) -> float:
+    """French-formatted number ("1 200,50") as a float"""
+    digits = re.sub(r"[ \u00a0\u202f]", "", text)
+    if "," in digits:
+        digits = digits.replace(".", "").replace(",", ".")
+    elif re.fullmatch(r"\d{1,3}(?:\.\d{3})+", digits):
+        digits = digits.replace(".", "")
+    return float(digits)
+
+
+def parse_date(text: str) -> Optional[str]:
+    """Date as JJ/MM/AAAA, None if it is not a date or does not exist"""
+    normalized = normalize_text(text)
+    iso = re.fullmatch(r"(\d{4})-(\d{1,2})-(\d{1,2})", normalized)
+    numeric = re.fullmatch(r"(\d{1,2})[/.-](\d{1,2})[/.-](\d{2,4})", normalized)
+    written = re.fullmatch(r"(1er|\d{1,2}) (\w+) (\d{4})", normalized)
+    if iso:
+        year, month, day = (int(part) for part in iso.groups())
+    elif numeric:
+        day, month, year = (int(part) for part in numeric.groups())
+    elif written and written.group(2) in MONTHS:
+        day_text, month_name, year_text = written.groups()
+        day, month, year = 1 if day_text == "1er" else int(day_text), MONTHS[month_name], int(year_text)
+    else:
+        return None
+    if year < 100:
+        year += 2000
+    try:
+        return date(year, month, day).strftime("%d/%m/%Y")
+    except ValueError:
+        return None
+
+
+def _leading_number(text: str) -> float:
+    return parse_number(re.search(_NUMBER, text).group(0))
+
+
+def match_value(kind: str, text: str) -> Any:
+    """Value carried by a typed match"""
+    if kind in ("date", "date_text"):
+        return parse_date(text)
+    if kind in ("amount", "surface", "percent"):
+        return _leading_number(text)
+    if kind in ("age", "persons", "year", "allocataire"):
+        digits = re.findall(r"\d+", text)[-1]
+        return digits if kind == "allocataire" else int(digits)
+    if kind == "rooms":
+        return int(re.search(r"\d", text).group(0))
+    if kind == "postcode":
+        return POSTCODE_PATTERN.match(text).group(1)
+    if kind == "city":
+        return CITY_PATTERN.search(text).group(1)
+    return text.strip()
+
+
+def find_typed_values(text: str) -> List[TypedMatch]:
+    """Typed values of a message, in order of appearance"""
+    found = []
+    for match in TYPED_PATTERN.finditer(text):
+        kind = match.lastgroup
+        value = match_value(kind, match.group(0))
+        if value is not None:
+            found.append(TypedMatch(kind, value, match.start(), match.end()))
+    return found
+
+
+def period_value(year: int, options: List[str]) -> Optional[str]:
+    """Enum option ("Avant 1946", "1946-1970", "Après 1990") covering a year"""
+    for option in options:
+        bounds = [int(y) for y in re.findall(r"\d{4}", option)]
+        lowered = normalize_text(option)
+        if lowered.startswith("avant") and year < bounds[0]:
+            return option
+        if lowered.startswith("apres") and year > bounds[0]:
+            return option
+        if len(bounds) == 2 and bounds[0] <= year <= bounds[1]:
+            return option
+    return None
+
+
+def format_amount(value: float) -> str:
+    """Amount for a text field ("1200 €", "35,50 €")"""
+    number = f"{value:.0f}" if value.is_integer() else f"{value:.2f}".replace(".", ",")
+    return f"{number} €"
+
+
+def field_cues(name: str, spec: Dict[str, Any], curated: List[str]) -> List[str]:
+    """Word stems announcing a field: its name, title and description, plus curated cues"""
+    words = tokenize(" ".join([name.replace("_", " "), spec.get("title", ""), spec.get("description", "")]), min_length=4)
+    stems = [word[:CUE_STEM_LENGTH] for word in words if word not in CUE_STOPWORDS]
+    return list(dict.fromkeys(stems + [normalize_text(cue) for cue in curated]))
+
+
+class FieldExtractor:
+    """Extraction engine compiled from the tool schemas"""
+
+    def __init__(self, schemas: Dict[str, Dict[str, Any]], synonyms: Optional[Dict[str, Any]] = None):
+        synonyms = synonyms or {}
+        self.fields: Dict[str, Dict[str, FieldSpec]] = {}
+        tables: Dict[str, Dict[str, List[str]]] = {}
+        for tool_id, schema in schemas.items():
+            kinds = {name: field_kind(name, spec) for name, spec in schema.get("properties", {}).items()}
+            cues = {}
+            for name, spec in schema.get("properties", {}).items():
+                curated = synonyms.get(tool_id, {}).get(name, {})
+                if kinds[name] == "enum":
+                    enum = spec.get("enum") or [True, False]
+                    tables[f"{tool_id}.{name}"] = self._synonym_table(tool_id, name, enum, curated)
+                elif kinds[name]:
+                    cues[name] = field_cues(name, spec, curated)
+
+            specs: Dict[str, FieldSpec] = {}
+            for name, spec in schema.get("properties", {}).items():
+                if kinds[name] is None:
+                    continue
+                # Cues only tell fields of the same kind apart: drop the ones they share
+                shared = {cue for other, other_cues in cues.items() if other != name and kinds[other] == kinds[name] for cue in other_cues}
+                enum = spec.get("enum") or ([True, False] if spec.get("type") == "boolean" else None)
+                specs[name] = FieldSpec(
+                    kinds[name], spec.get("type", "string"), enum,
+                    cues.get(name, []), [cue for cue in cues.get(name, []) if cue not in shared]
+                )
+            self.fields[tool_id] = specs
+        self.matcher = KeywordMatcher(tables, whole_words=True)
+
+    @staticmethod
+    def _synonym_table(tool_id: str, field: str, enum: List[Any], curated: Dict[str, List[str]]) -> Dict[str, List[str]]:
+        """Synonyms per enum value: curated ones first (their order sets priorities), then the values' own names"""
+        labels = {json.dumps(value) if isinstance(value, bool) else str(value): value for value in enum}
+        table: Dict[str, List[str]] = {}
+        for label, keywords in curated.items():
+            if label not in labels:
+                logger.warning(f"Synonyms for unknown value {tool_id}.{field}={label} ignored")
+                continue
+            table[label] = keywords
+        for label, value in labels.items():
+            if label not in table and not isinstance(value, bool) and label.lower() not in UNMATCHABLE_VALUES:
+                table[label] = [label.replace("_", " ")]
+        return table
+
+    @property
+    def tools(self) -> List[str]:
+        return list(self.fields)
+
+    def extract(self, text: str) -> Fields:
+        """Schema-valid field values found in one message, per tool"""
+        matches = self.matcher.scan(text)
+        typed = find_typed_values(text)
+
+        extracted: Fields = {}
+        for tool_id, specs in self.fields.items():
+            values: Dict[str, Any] = {}
+            for name, spec in specs.items():
+                if spec.kind == "enum":
+                    label = self.matcher.first_label(matches, f"{tool_id}.{name}")
+                    if label is not None:
+                        values[name] = json.loads(label) if spec.type == "boolean" else label
+            self._assign_typed(specs, text, typed, values)
+            if values:
+                extracted[tool_id] = values
+        return extracted
+
+    def _assign_typed(self, specs: Dict[str, FieldSpec], text: str, typed: List[TypedMatch], values: Dict[str, Any]):
+        """Give each typed value to the field of its kind whose cues precede it, else to the first free one"""
+        previous_end = 0
+        for match in typed:
+            window = normalize_text(text[max(0, match.start - CUE_WINDOW):match.start])
+            # Cues telling fields apart are looked for since the previous value only, so they are not credited twice
+            recent = normalize_text(text[max(previous_end, match.start - CUE_WINDOW):match.start])
+            candidates = [
+                name for name, spec in specs.items()
+                if match.kind in ACCEPTED_MATCHES.get(spec.kind, ()) and name not in values
+                and (spec.kind not in CUED_KINDS or self._announced(spec.cues, window))
+            ]
+            cued = [name for name in candidates if self._announced(specs[name].distinctive_cues, recent)]
+            for name in cued or candidates:
+                value = self._field_value(specs[name], match)
+                if value is not None:
+                    values[name] = value
+                    break
+            previous_end = match.end
+
+    @staticmethod
+    def _announced(cues: List[str], window: str) -> bool:
+        return any(re.search(rf"\b{re.escape(cue)}", window) for cue in cues)
+
+    @staticmethod
+    def _field_value(spec: FieldSpec, match: TypedMatch) -> Any:
+        """Typed value converted to the field's schema type, None if it does not fit"""
+        value = match.value
+        if spec.kind == "city" and match.kind == "address":
+            postcode = POSTCODE_PATTERN.search(value)
+            return postcode.group(1) if postcode else None
+        if spec.kind == "period":
+            return period_value(value, spec.enum)
+        if spec.type == "integer":
+            return int(value)
+        if spec.type == "number":
+            return int(value) if float(value).is_integer() else value
+        if spec.kind == "amount":
+            return format_amount(value)
+        return str(value)
+
+
+def form_properties(schema: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Top-level fields a chat suggestion may fill"""
+    return {name: spec for name, spec in schema.get("properties", {}).items() if spec.get("type") != "object"}
+
+
+def coerce_value(name: str, spec: Dict[str, Any], value: Any) -> Any:
+    """Value converted to the field's schema type, None if it is not valid for the field"""
+    if value is None or value == "" or isinstance(value, (dict, list)):
+        return None
+    field_type = spec.get("type", "string")
+    if spec.get("enum"):
+        options = {normalize_text(option): option for option in spec["enum"]}
+        return options.get(normalize_text(value))
+    if field_type == "boolean":
+        if isinstance(value, bool):
+            return value
+        return {"true": True, "oui": True, "false": False, "non": False}.get(normalize_text(value))
+    if field_type in ("number", "integer"):
+        if isinstance(value, bool):
+            return None
+        try:
+            number = float(value) if isinstance(value, (int, float)) else parse_number(re.sub(r"[^\d,. ]", "", str(value)).strip())
+        except ValueError:
+            return None
+        if field_type == "integer" and not number.is_integer():
+            return None
+        return int(number) if number.is_integer() else number
+    text = str(value).strip()[:MAX_TEXT_LENGTH]
+    if name.startswith("date_"):
+        # Free periods ("depuis septembre") are kept as written
+        return parse_date(text) or text or None
+    return text or None
+
+
+def validate_values(schema: Dict[str, Any], values: Dict[str, Any]) -> Dict[str, Any]:
+    """Values valid for a tool's form; unknown fields and invalid values are dropped"""
+    properties = form_properties(schema)
+    valid = {}
+    for name, value in values.items():
+        if name in properties:
+            coerced = coerce_value(name, properties[name], value)
+            if coerced is not None:
+                valid[name] = coerced
+    return valid
+
+
+def merge_fields(fields: Optional[Fields], update: Fields) -> Fields:
+    """Fold the values of a new message into the accumulated ones (newer values win)"""
+    merged = {tool_id: dict(values) for tool_id, values in (fields or {}).items()}
+    for tool_id, values in update.items():
+        merged.setdefault(tool_id, {}).update(values)
+    return merged
+
+
+# Tool schemas and shared engine for the chat router
+form_schemas = load_schemas()
+field_extractor = FieldExtractor(form_schemas, load_synonyms())
@@ -0,0 +1,129 @@
+"""
+Idempotency-Key support for POST endpoints
+
+Retries sent with the same ``Idempotency-Key`` header attach to the original
+execution instead of triggering a new (billed) generation: in-flight requests
+are awaited, completed responses are replayed from a TTL store.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAY_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyConflict(Exception):
+    """Raised when a key is reused with a different request payload"""
+    pass
+
+
+class _Entry:
+    """Stored execution: a future shared by the original call and its retries"""
+
+    def __init__(self, fingerprint: str, expires_at: float):
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+def fingerprint_payload(payload: Any) -> str:
+    """Stable hash of a request payload, used to detect key reuse"""
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    """In-process TTL store of in-progress and completed responses"""
+
+    def __init__(self, ttl_seconds: int = 24 * 3600, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+
+    def _evict(self, now: float):
+        """Drop expired entries, then the oldest ones if over capacity"""
+        expired = [key for key, entry in self._entries.items() if entry.expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+
+        while len(self._entries) > self.max_entries:
+            key, entry = next(iter(self._entries.items()))
+            if not entry.future.done():
+                # Never evict in-flight executions, retries must still attach
+                self._entries.move_to_end(key)
+                break
+            del self._entries[key]
+
+    async def run(
+        self,
+        key: str,
+        fingerprint: str,
+        func: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """
+        Execute func once per key
+
+        Returns:
+            (result, replayed) where replayed is True when the result comes
+            from a previous or concurrent execution of the same key
+        """
+        now = time.monotonic()
+        self._evict(now)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                raise IdempotencyConflict(key)
+            # Shield so a disconnecting retry does not cancel the original run
+            result = await asyncio.shield(entry.future)
+            logger.info(f"Replaying idempotent response for key {key}")
+            return result, True
+
+        entry = _Entry(fingerprint, now + self.ttl_seconds)
+        self._entries[key] = entry
+
+        try:
+            result = await func()
+        except BaseException as e:
+            # Failures are not cached: waiters get the error, the next retry re-executes
+            self._entries.pop(key, None)
+            if not entry.future.done():
+                if isinstance(e, asyncio.CancelledError):
+                    entry.future.cancel()
+                else:
+                    entry.future.set_exception(e)
+                    # Mark retrieved so asyncio does not warn when nobody was waiting
+                    entry.future.exception()
+            raise
+
+        entry.future.set_result(result)
+        return result, False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def scoped_key(scope: str, client_id: str, key: Optional[str]) -> Optional[str]:
+    """Namespace a client-supplied key by endpoint and caller, None if absent"""
+    if not key or not key.strip():
+        return None
+    key = key.strip()
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"{IDEMPOTENCY_HEADER} too long (max {MAX_KEY_LENGTH} characters)")
+    return f"{scope}:{client_id}:{key}"
+
+
+# Shared store for the API process
+idempotency_store = IdempotencyStore(
+    ttl_seconds=int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600))),
+    max_entries=int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+)
@@ -0,0 +1,232 @@
+"""
+Local intent classifier routing user messages to the 12 tools
+
+Hashed word n-grams weighted by TF-IDF, scored against one L2-normalized
+centroid per tool (a linear model W of shape tools x features). Training
+data comes from the tool schemas, templates.json, the few-shot files and the
+chat topic keywords. Scoring a message is a gather over a few dozen hashed
+features, and a batch of messages is one matrix product.
+
+Train the model offline from the api/ directory:
+    python intent.py build --out intent_model
+Without a trained file the model is built from the sources at first use.
+"""
+import json
+import logging
+import os
+import re
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from keywords import load_tables
+from text_utils import tokenize
+
+logger = logging.getLogger(__name__)
+
+API_DIR = Path(__file__).resolve().parent
+DEFAULT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", "intent_model")
+# Cosine score a tool needs before it is suggested
+INTENT_MIN_SCORE = float(os.getenv("INTENT_MIN_SCORE", "0.03"))
+
+FEATURE_BITS = 14
+STEM_LENGTH = 6
+# Schema and tool titles describe the intent best
+TITLE_WEIGHT = 3
+
+
+def hash_features(text: str, bits: int = FEATURE_BITS, min_length: int = 3) -> Dict[int, float]:
+    """Hashed counts of word unigrams, word stems and word bigrams"""
+    words = tokenize(text, min_length=min_length)
+    features = words + [f"~{w[:STEM_LENGTH]}" for w in words if len(w) > STEM_LENGTH]
+    features += [f"{a} {b}" for a, b in zip(words, words[1:])]
+    mask = (1 << bits) - 1
+    counts: Dict[int, float] = {}
+    for feature in features:
+        index = zlib.crc32(feature.encode("utf-8")) & mask
+        counts[index] = counts.get(index, 0.0) + 1.0
+    return counts
+
+
+def _schema_texts(schema: Dict[str, Any]) -> Tuple[List[str], List[str]]:
+    """(titles, other texts) found in a JSON schema"""
+    titles, texts = [], []
+    for key in ("title", "description"):
+        if schema.get(key):
+            titles.append(str(schema[key]))
+    for name, spec in schema.get("properties", {}).items():
+        if name == "identite" or not isinstance(spec, dict):
+            continue
+        texts.append(name.replace("_", " "))
+        texts.extend(str(spec[key]) for key in ("title", "description") if spec.get(key))
+        texts.extend(str(value).replace("_", " ") for value in spec.get("enum", []))
+        if spec.get("type") == "object":
+            _, nested = _schema_texts(spec)
+            texts.extend(nested)
+    return titles, texts
+
+
+def _fewshot_texts(text: str) -> List[str]:
+    """Example titles and input values of a few-shot file (outputs are mostly boilerplate)"""
+    texts = re.findall(r"^## (.+)$", text, flags=re.M)
+    for block in re.findall(r"```json\s*\n(.*?)```", text, re.S)[::2]:
+        try:
+            fields = json.loads(block)
+        except json.JSONDecodeError:
+            continue
+        fields.pop("identite", None)
+        texts.extend(str(value) for value in fields.values() if isinstance(value, (str, int, float)))
+    return texts
+
+
+def training_documents(api_dir: Path = API_DIR) -> Dict[str, List[Tuple[str, int]]]:
+    """Weighted training texts per tool, from schemas, templates.json, few-shots and topic keywords"""
+    with open(api_dir / "templates.json", "r", encoding="utf-8") as f:
+        templates = json.load(f)
+    topics = load_tables().get("topics", {})
+
+    schema_dirs = [api_dir.parent / "schemas", api_dir.parent / "web" / "public" / "schemas"]
+    documents: Dict[str, List[Tuple[str, int]]] = {}
+    for tool_id, template in templates.items():
+        texts = [(template.split("Données reçues")[0], 1)]
+        schema_path = next((d / f"{tool_id}.json" for d in schema_dirs if (d / f"{tool_id}.json").exists()), None)
+        if schema_path:
+            with open(schema_path, "r", encoding="utf-8") as f:
+                titles, others = _schema_texts(json.load(f))
+            texts += [(title, TITLE_WEIGHT) for title in titles] + [(text, 1) for text in others]
+        fewshot_path = api_dir / "fewshots" / f"{tool_id}.md"
+        if fewshot_path.exists():
+            texts += [(text, 1) for text in _fewshot_texts(fewshot_path.read_text(encoding="utf-8"))]
+        texts += [(keyword, TITLE_WEIGHT) for keyword in topics.get(tool_id, [])]
+        documents[tool_id] = texts
+    return documents
+
+
+class IntentClassifier:
+    """Linear TF-IDF centroid model over hashed features"""
+
+    def __init__(self, tools: List[str], weights: np.ndarray, idf: np.ndarray):
+        self.tools = list(tools)
+        self.weights = weights  # (tools, features), rows L2-normalized
+        self.idf = idf          # (features,)
+        self.bits = int(np.log2(weights.shape[1]))
+
+    @classmethod
+    def train(cls, documents: Dict[str, List[Tuple[str, int]]], bits: int = FEATURE_BITS) -> "IntentClassifier":
+        """Fit one TF-IDF centroid per tool"""
+        tools = sorted(documents)
+        counts = np.zeros((len(tools), 1 << bits), dtype=np.float32)
+        for row, tool_id in enumerate(tools):
+            for text, weight in documents[tool_id]:
+                for index, count in hash_features(text, bits).items():
+                    counts[row, index] += weight * count
+
+        # Smoothed IDF over tools: features shared by every tool weigh almost nothing
+        df = (counts > 0).sum(axis=0)
+        idf = np.log((len(tools) + 1) / (df + 0.5)).clip(min=0).astype(np.float32)
+        weights = np.log1p(counts) * idf
+        norms = np.linalg.norm(weights, axis=1, keepdims=True)
+        weights /= np.where(norms > 0, norms, 1)
+        return cls(tools, weights.astype(np.float32), idf)
+
+    def vectorize(self, texts: Iterable[str]) -> np.ndarray:
+        """L2-normalized TF-IDF rows for a batch of texts"""
+        texts = list(texts)
+        matrix = np.zeros((len(texts), self.weights.shape[1]), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for index, count in hash_features(text, self.bits).items():
+                matrix[row, index] = np.log1p(count)
+        matrix *= self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms > 0, norms, 1)
+
+    def score(self, text: str) -> np.ndarray:
+        """Cosine score of each tool for one text, without building a dense vector"""
+        features = hash_features(text, self.bits)
+        if not features:
+            return np.zeros(len(self.tools), dtype=np.float32)
+        indexes = np.fromiter(features.keys(), dtype=np.int64)
+        values = np.log1p(np.fromiter(features.values(), dtype=np.float32)) * self.idf[indexes]
+        norm = np.linalg.norm(values)
+        if norm == 0:
+            return np.zeros(len(self.tools), dtype=np.float32)
+        return self.weights[:, indexes] @ (values / norm)
+
+    def score_batch(self, texts: Iterable[str]) -> np.ndarray:
+        """(texts, tools) cosine scores in one matrix product"""
+        return self.vectorize(texts) @ self.weights.T
+
+    def ranking(self, scores: np.ndarray) -> List[Tuple[str, float]]:
+        """(tool_id, score) pairs, best first"""
+        order = np.argsort(-scores)
+        return [(self.tools[i], float(scores[i])) for i in order]
+
+    def predict(self, text: str, min_score: float = INTENT_MIN_SCORE) -> Optional[str]:
+        """Best tool for a text, None below the confidence threshold"""
+        scores = self.score(text)
+        best = int(np.argmax(scores))
+        return self.tools[best] if scores[best] >= min_score else None
+
+    def save(self, path: str):
+        """Write the model to {path}.npz"""
+        np.savez(f"{path}.npz", tools=np.array(self.tools), weights=self.weights, idf=self.idf)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["IntentClassifier"]:
+        """Load {path}.npz, None if it does not exist"""
+        model_path = f"{path}.npz"
+        if not os.path.exists(model_path):
+            return None
+        data = np.load(model_path)
+        return cls([str(tool) for tool in data["tools"]], data["weights"], data["idf"])
+
+
+_model: Optional[IntentClassifier] = None
+
+
+def get_intent_model() -> Optional[IntentClassifier]:
+    """Process-wide model: the trained file if present, otherwise trained from the sources"""
+    global _model
+    if _model is None:
+        try:
+            _model = IntentClassifier.load(DEFAULT_MODEL_PATH)
+            if _model is None:
+                _model = IntentClassifier.train(training_documents())
+                logger.info(f"Intent model trained from sources ({len(_model.tools)} tools)")
+        except Exception as e:
+            logger.warning(f"Intent model unavailable: {e}")
+            return None
+    return _model
+
+
+def merge_intent(previous: Optional[List[float]], scores: np.ndarray, decay: float = 0.5) -> List[float]:
+    """Rolling tool scores of a conversation, recent messages weighing more"""
+    if previous is None:
+        return [float(s) for s in scores]
+    return [decay * p + float(s) for p, s in zip(previous, scores)]
+
+
+def suggest_tool(intent: Optional[List[float]], min_score: float = INTENT_MIN_SCORE) -> Optional[str]:
+    """Tool suggested by rolling scores, None below the threshold"""
+    model = get_intent_model()
+    if model is None or not intent:
+        return None
+    best = int(np.argmax(intent))
+    return model.tools[best] if intent[best] >= min_score else None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Train the tool intent classifier")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Train from schemas, templates.json, few-shots and topic keywords")
+    build_parser.add_argument("--out", default=DEFAULT_MODEL_PATH, help="Output path prefix")
+
+    args = parser.parse_args()
+    model = IntentClassifier.train(training_documents())
+    model.save(args.out)
+    print(f"Intent model written to {args.out}.npz ({len(model.tools)} tools, {model.weights.shape[1]} features)")
@@ -0,0 +1,123 @@
+"""
+Compiled multi-pattern keyword matching for conversation analysis
+
+Keyword tables (emotions, topics, urgency, legal questions) are folded into a
+single compiled regex. A message is normalized once (accents, case) and
+scanned in one pass, whatever the number of keywords. Matches keep plain
+substring semantics by default: every keyword contained in the text is
+reported, including keywords nested in a longer one ("cher" inside "trop
+cher"). With whole_words, keywords only match on word boundaries.
+"""
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from text_utils import normalize_text
+
+logger = logging.getLogger(__name__)
+
+CHAT_KEYWORDS_PATH = os.getenv(
+    "CHAT_KEYWORDS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat_keywords.json")
+)
+
+# {category: {label: [keywords found]}}
+Matches = Dict[str, Dict[str, List[str]]]
+
+
+def flatten_tables(tables: Dict[str, Any], prefix: str = "") -> Dict[str, Dict[str, List[str]]]:
+    """Flatten nested tables into {category: {label: keywords}}, with dotted category names"""
+    flat: Dict[str, Dict[str, List[str]]] = {}
+    for name, value in tables.items():
+        path = f"{prefix}{name}"
+        if all(isinstance(v, list) for v in value.values()):
+            flat[path] = value
+        else:
+            flat.update(flatten_tables(value, f"{path}."))
+    return flat
+
+
+def load_tables(path: str = CHAT_KEYWORDS_PATH) -> Dict[str, Dict[str, List[str]]]:
+    """Read keyword tables from JSON"""
+    with open(path, "r", encoding="utf-8") as f:
+        return flatten_tables(json.load(f))
+
+
+class KeywordMatcher:
+    """Single-pass matcher over all keyword tables"""
+
+    def __init__(self, tables: Dict[str, Dict[str, List[str]]], whole_words: bool = False):
+        # Label order is kept: it breaks ties and encodes priorities
+        self.categories: Dict[str, List[str]] = {category: list(labels) for category, labels in tables.items()}
+        self._owners: Dict[str, List[Tuple[str, str]]] = {}
+        for category, labels in tables.items():
+            for label, keywords in labels.items():
+                for keyword in keywords:
+                    normalized = normalize_text(keyword)
+                    if normalized:
+                        self._owners.setdefault(normalized, []).append((category, label))
+
+        # Longest first, so each position reports its longest keyword;
+        # shorter keywords nested in it are credited through _nested
+        keywords = sorted(self._owners, key=len, reverse=True)
+        boundary = r"\b" if whole_words else ""
+        self._nested = {
+            k: [other for other in keywords if other != k and re.search(f"{boundary}{re.escape(other)}{boundary}", k)]
+            for k in keywords
+        }
+        self._pattern = None
+        if keywords:
+            # Zero-width lookahead: matches may overlap
+            alternatives = "|".join(re.escape(k) for k in keywords)
+            self._pattern = re.compile(f"(?={boundary}({alternatives}){boundary})")
+
+    def scan(self, text: str) -> Matches:
+        """Keywords found in a text, grouped by category and label"""
+        if self._pattern is None:
+            return {}
+        found = set()
+        for match in self._pattern.finditer(normalize_text(text)):
+            keyword = match.group(1)
+            found.add(keyword)
+            found.update(self._nested[keyword])
+
+        matches: Dict[str, Dict[str, set]] = {}
+        for keyword in found:
+            for category, label in self._owners[keyword]:
+                matches.setdefault(category, {}).setdefault(label, set()).add(keyword)
+        return {
+            category: {label: sorted(keywords) for label, keywords in labels.items()}
+            for category, labels in matches.items()
+        }
+
+    def labels(self, category: str) -> List[str]:
+        """Labels of a category, in table order"""
+        return self.categories.get(category, [])
+
+    def first_label(self, matches: Matches, category: str) -> Optional[str]:
+        """Highest-priority label of a category present in the matches"""
+        found = matches.get(category, {})
+        return next((label for label in self.labels(category) if found.get(label)), None)
+
+
+def merge_matches(matches: Optional[Matches], update: Matches) -> Matches:
+    """Fold the matches of a new message into the accumulated ones"""
+    if not matches:
+        return update
+    merged = {category: dict(labels) for category, labels in matches.items()}
+    for category, labels in update.items():
+        target = merged.setdefault(category, {})
+        for label, keywords in labels.items():
+            target[label] = sorted(set(target.get(label, [])) | set(keywords))
+    return merged
+
+
+_tables = load_tables()
+
+# Shared matcher for the chat router
+chat_matcher = KeywordMatcher({category: labels for category, labels in _tables.items() if category != "legal"})
+
+# Legal keywords start a search, so they must be whole words ("emploi" contains "loi")
+legal_matcher = KeywordMatcher({"legal": _tables.get("legal", {})}, whole_words=True)
@@ -0,0 +1,286 @@
+"""
+Embedding backends for the legal stores
+
+The OpenAI backend is the default when a key is configured. Without one the
+local backend (local_embeddings.py) embeds offline. A store records the
+backend that built its vectors and keeps using it, so query and document
+vectors always come from the same embedder.
+
+OpenAI ingestion is batched: chunks are embedded many per request, with a
+bounded number of requests in flight. Transient failures (rate limits,
+timeouts, server errors) are retried with exponential backoff. Embeddings are
+cached by content, so re-ingesting unchanged text costs nothing, and query
+embeddings are kept in memory for repeated questions.
+"""
+import os
+import asyncio
+import hashlib
+import logging
+import random
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from openai import APIConnectionError, InternalServerError, OpenAI, RateLimitError
+
+from text_utils import normalize_text
+from .local_embeddings import LOCAL_BACKEND_NAME, LOCAL_EMBEDDING_DIM, LocalEmbeddings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIM = 1536
+OPENAI_BACKEND_NAME = f"openai:{EMBEDDING_MODEL}"
+
+# openai | local | auto (OpenAI when OPENAI_API_KEY is set, local otherwise)
+EMBEDDING_BACKEND = os.getenv("LEGAL_EMBEDDING_BACKEND", "auto")
+
+# Characters of a chunk sent for embedding
+INPUT_CHARS = 8000
+
+# Per request: inputs, and characters (keeps well under the provider's token limit per request)
+EMBEDDING_BATCH_SIZE = int(os.getenv("LEGAL_EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_BATCH_CHARS = 400_000
+
+# Requests in flight during an ingestion run
+EMBEDDING_CONCURRENCY = int(os.getenv("LEGAL_EMBEDDING_CONCURRENCY", "4"))
+
+# Bound on SQL parameters per IN (...) query
+SQLITE_BATCH = 500
+
+# Query embeddings kept in memory
+QUERY_CACHE_SIZE = int(os.getenv("LEGAL_QUERY_CACHE_SIZE", "1000"))
+QUERY_CACHE_TTL_SECONDS = int(os.getenv("LEGAL_QUERY_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+# Attempts per batch, and first backoff delay in seconds (doubled each retry, with jitter)
+EMBEDDING_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1.0
+
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+Progress = Callable[[int, int], None]
+
+
+def content_key(text: str, model: str = EMBEDDING_MODEL, dimensions: int = EMBEDDING_DIM) -> str:
+    """Cache key of the embedded text: Unicode and whitespace variants share one key"""
+    normalized = " ".join(unicodedata.normalize("NFC", text[:INPUT_CHARS]).split())
+    return f"{model}:{dimensions}:{hashlib.sha256(normalized.encode()).hexdigest()}"
+
+
+class EmbeddingCache:
+    """Embeddings already computed, persisted in SQLite by content key"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                key TEXT PRIMARY KEY,
+                embedding BLOB NOT NULL
+            )
+        """)
+        conn.commit()
+        conn.close()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        keys = list(keys)
+        found = {}
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for start in range(0, len(keys), SQLITE_BATCH):
+                batch = keys[start:start + SQLITE_BATCH]
+                rows = conn.execute(
+                    f"SELECT key, embedding FROM embedding_cache WHERE key IN ({','.join('?' * len(batch))})", batch
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype="<f4").tolist()
+        finally:
+            conn.close()
+        return found
+
+    def put_many(self, embeddings: Dict[str, List[float]]):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (key, embedding) VALUES (?, ?)",
+                [(key, np.asarray(embedding, dtype="<f4").tobytes()) for key, embedding in embeddings.items()]
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+
+class QueryEmbeddingCache:
+    """LRU + TTL cache of query embeddings, keyed on the normalized question"""
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: int = 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()
+        # Searches run from worker threads as well as from the event loop
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(query: str, model: str = EMBEDDING_MODEL) -> str:
+        return f"{model}:{normalize_text(query)}"
+
+    def get(self, query: str, model: str = EMBEDDING_MODEL) -> Optional[List[float]]:
+        key = self.key(query, model)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, query: str, embedding: List[float], model: str = EMBEDDING_MODEL):
+        key = self.key(query, model)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def make_batches(texts: Sequence[str], max_inputs: int = EMBEDDING_BATCH_SIZE,
+                 max_chars: int = EMBEDDING_BATCH_CHARS) -> List[List[int]]:
+    """Positions of the texts grouped into batches within both limits"""
+    batches: List[List[int]] = []
+    current: List[int] = []
+    chars = 0
+    for position, text in enumerate(texts):
+        size = min(len(text), INPUT_CHARS)
+        if current and (len(current) >= max_inputs or chars + size > max_chars):
+            batches.append(current)
+            current, chars = [], 0
+        current.append(position)
+        chars += size
+    if current:
+        batches.append(current)
+    return batches
+
+
+def log_progress(done: int, total: int):
+    logger.info(f"Embedded {done}/{total} chunks")
+
+
+async def embed_batch(client, inputs: List[str]) -> List[List[float]]:
+    """One embeddings request, retried on transient errors"""
+    for attempt in range(EMBEDDING_MAX_ATTEMPTS):
+        try:
+            response = await asyncio.to_thread(client.embeddings.create, model=EMBEDDING_MODEL, input=inputs)
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        except RETRYABLE_ERRORS as e:
+            if attempt == EMBEDDING_MAX_ATTEMPTS - 1:
+                raise
+            delay = RETRY_BASE_DELAY * 2 ** attempt * (1 + random.random())
+            logger.warning(f"Embedding request failed ({e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def embed_texts(client, texts: Sequence[str], progress: Optional[Progress] = None,
+                      cache: Optional[EmbeddingCache] = None) -> List[Optional[List[float]]]:
+    """Embeddings in input order; None for the texts of a batch that kept failing
+
+    With a cache, only texts never embedded before are sent, each distinct text once.
+    """
+    progress = progress or log_progress
+    keys = [content_key(text) for text in texts]
+    known = cache.get_many(set(keys)) if cache else {}
+
+    # Distinct texts still to embed, by key
+    pending: Dict[str, str] = {}
+    for key, text in zip(keys, texts):
+        if key not in known:
+            pending.setdefault(key, text)
+    if known:
+        logger.info(f"Reusing {sum(key in known for key in keys)} cached embeddings")
+    pending_keys = list(pending)
+    pending_texts = list(pending.values())
+
+    semaphore = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+    done = 0
+
+    async def run(batch: List[int]):
+        nonlocal done
+        async with semaphore:
+            try:
+                vectors = await embed_batch(client, [pending_texts[position][:INPUT_CHARS] for position in batch])
+            except Exception as e:
+                logger.error(f"Error getting embeddings for {len(batch)} chunks: {e}")
+                return
+            finally:
+                done += len(batch)
+                progress(done, len(pending_texts))
+        computed = {pending_keys[position]: vector for position, vector in zip(batch, vectors)}
+        known.update(computed)
+        if cache:
+            # Saved per batch, so an interrupted run keeps what it paid for
+            cache.put_many(computed)
+
+    await asyncio.gather(*(run(batch) for batch in make_batches(pending_texts)))
+    return [known.get(key) for key in keys]
+
+
+class OpenAIEmbeddings:
+    """OpenAI embedding backend: cached query embeddings, batched document embeddings"""
+
+    def __init__(self, client, cache: Optional[EmbeddingCache] = None):
+        self.name = OPENAI_BACKEND_NAME
+        self.dimensions = EMBEDDING_DIM
+        self.client = client
+        self.cache = cache
+
+    def embed_query(self, text: str) -> Optional[List[float]]:
+        """Query embedding (repeated questions are served from memory)"""
+        cached = query_embedding_cache.get(text)
+        if cached is not None:
+            return cached
+        try:
+            response = self.client.embeddings.create(model=EMBEDDING_MODEL, input=text[:INPUT_CHARS])
+            embedding = response.data[0].embedding
+            query_embedding_cache.put(text, embedding)
+            return embedding
+        except Exception as e:
+            logger.error(f"Error getting embedding: {e}")
+            return None
+
+    async def embed_documents(self, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        return await embed_texts(self.client, texts, cache=self.cache)
+
+
+def configured_backend() -> str:
+    """Backend name for new stores, from LEGAL_EMBEDDING_BACKEND"""
+    choice = EMBEDDING_BACKEND.lower()
+    if choice == "auto":
+        choice = "openai" if os.getenv("OPENAI_API_KEY") else "local"
+    if choice == "local":
+        return LOCAL_BACKEND_NAME
+    return OPENAI_BACKEND_NAME
+
+
+def create_backend(name: str, dimensions: Optional[int] = None, cache: Optional[EmbeddingCache] = None):
+    """Backend able to produce vectors comparable to those recorded as `name`; None if unavailable here"""
+    if name == OPENAI_BACKEND_NAME:
+        api_key = os.getenv("OPENAI_API_KEY")
+        return OpenAIEmbeddings(OpenAI(api_key=api_key), cache) if api_key else None
+    if name == LOCAL_BACKEND_NAME:
+        return LocalEmbeddings(dimensions or LOCAL_EMBEDDING_DIM)
+    logger.error(f"Unknown embedding backend {name}")
+    return None
+
+
+query_embedding_cache = QueryEmbeddingCache(max_entries=QUERY_CACHE_SIZE, ttl_seconds=QUERY_CACHE_TTL_SECONDS)
@@ -3,19 +3,92 @@ Vector store abstraction for legal document search
 Supports pgvector (via Supabase) with local SQLite+faiss fallback
 """
 import os
+import asyncio
+import hashlib
 import logging
-import json
 import sqlite3
+import threading
 import numpy as np
 from abc import ABC, abstractmethod
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
+from typing import List, Optional, Dict, Any, Tuple
+from datetime import date, datetime, timedelta
 from openai import OpenAI
 
 from .models import LegalDoc, VectorSearchResult
+from .embeddings import (
+    EMBEDDING_DIM, OPENAI_BACKEND_NAME, EmbeddingCache, OpenAIEmbeddings, configured_backend, create_backend
+)
+from .vectors import EmbeddingMatrix, decode_embedding, encode_embedding, file_signature
+from .lexical import create_fts, fuse_rankings, lexical_search
 
 logger = logging.getLogger(__name__)
 
+LEGAL_DB_PATH = os.getenv("LEGAL_DB_PATH", "legal_docs.db")
+LEGAL_INDEX_PATH = os.getenv("LEGAL_INDEX_PATH", "legal_docs.index")
+LEGAL_MATRIX_PATH = os.getenv("LEGAL_MATRIX_PATH", "legal_docs.vectors.npy")
+
+# HNSW graph: neighbours per node, and minimum candidate list explored per query
+HNSW_M = int(os.getenv("LEGAL_HNSW_M", "32"))
+HNSW_EF_SEARCH = int(os.getenv("LEGAL_HNSW_EF_SEARCH", "64"))
+
+# Neighbours fetched per wanted result before the date filter; grown when too few pass
+SEARCH_OVERFETCH = 4
+
+# Rebuild once the index holds this many vectors per live row (HNSW cannot drop replaced rows)
+STALE_REBUILD_RATIO = 1.5
+
+# Freshness boost: decays linearly to its floor over two years
+FRESHNESS_DECAY_DAYS = 730
+FRESHNESS_FLOOR = 0.1
+FRESHNESS_WEIGHT = 0.2
+
+# One row per chunk, identified by its document and position; the content
+# hash tells unchanged chunks apart on re-ingestion
+DOCUMENTS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        doc_id TEXT NOT NULL,
+        chunk_index INTEGER NOT NULL DEFAULT 0,
+        content_hash TEXT NOT NULL,
+        title TEXT NOT NULL,
+        url TEXT NOT NULL,
+        source TEXT NOT NULL,
+        date TEXT NOT NULL,
+        type TEXT NOT NULL,
+        jurisdiction TEXT,
+        text TEXT NOT NULL,
+        embedding BLOB,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (doc_id, chunk_index)
+    )
+"""
+
+# Bound on SQL parameters per IN (...) query, and on rows converted or indexed per step
+SQLITE_BATCH = 500
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Unit-length rows, so inner product is cosine similarity"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def chunk_hash(title: str, source: str, date_str: str, type_: str, jurisdiction: Optional[str], text: str) -> str:
+    """Hash of everything stored for a chunk"""
+    content = "\x1f".join([title, source, date_str, type_, jurisdiction or "", text])
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def freshness(days_old):
+    """Freshness factor for an age in days (scalar or array)"""
+    return np.maximum(FRESHNESS_FLOOR, 1.0 - days_old / FRESHNESS_DECAY_DAYS)
+
+
+def relevance(score, days_old):
+    """Similarity blended with freshness (scalar or array)"""
+    return score * (1 - FRESHNESS_WEIGHT) + freshness(days_old) * FRESHNESS_WEIGHT
+
 
 class VectorStore(ABC):
     """Abstract vector store interface"""
@@ -26,29 +99,48 @@ class VectorStore(ABC):
         pass
     
     @abstractmethod
-    async def search(
+    def search_sync(
         self, 
         query: str, 
         k: int = 10, 
         since_date: Optional[datetime] = None
     ) -> List[VectorSearchResult]:
-        """Search documents by query with optional date filter"""
+        """Search documents by query with optional date filter (blocking: embeds the query)"""
         pass
+    
+    async def search(
+        self, 
+        query: str, 
+        k: int = 10, 
+        since_date: Optional[datetime] = None
+    ) -> List[VectorSearchResult]:
+        """Search documents from a worker thread, off the event loop"""
+        return await asyncio.to_thread(self.search_sync, query, k, since_date)
+    
+    def status(self) -> Dict[str, Any]:
+        """Readiness from local state only, without calling upstream services"""
+        return {"ready": True}
 
 
 class LocalVectorStore(VectorStore):
     """Local SQLite + FAISS fallback implementation"""
     
-    def __init__(self):
-        self.db_path = "legal_docs.db"
-        self.openai_client = None
-        
-        # Initialize OpenAI client if available
-        api_key = os.getenv("OPENAI_API_KEY")
-        if api_key:
-            self.openai_client = OpenAI(api_key=api_key)
+    def __init__(self, db_path: Optional[str] = None, index_path: Optional[str] = None,
+                 matrix_path: Optional[str] = None, backend=None):
+        self.db_path = db_path or LEGAL_DB_PATH
+        self.index_path = index_path or LEGAL_INDEX_PATH
+        self.matrix = EmbeddingMatrix(matrix_path or LEGAL_MATRIX_PATH)
+        # (mtime, size) of the index file last loaded or written by this process
+        self._index_signature = None
+        # Held while the index is searched, grown or replaced: FAISS indexes are not safe
+        # to search while vectors are added (reentrant: reloads may rebuild)
+        self._index_lock = threading.RLock()
         
         self._init_db()
+        self.embedding_cache = EmbeddingCache(self.db_path)
+        self.dimensions = EMBEDDING_DIM
+        self.backend = self._resolve_backend(backend)
+        self._load_matrix()
         
         # Try to import faiss for vector similarity
         try:
@@ -63,72 +155,293 @@ class LocalVectorStore(VectorStore):
     def _init_db(self):
         """Initialize SQLite database"""
         conn = sqlite3.connect(self.db_path)
+        conn.execute(DOCUMENTS_SCHEMA.format(table="legal_documents"))
+        self._migrate_chunk_identity(conn)
         conn.execute("""
-            CREATE TABLE IF NOT EXISTS legal_documents (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                url TEXT UNIQUE NOT NULL,
-                source TEXT NOT NULL,
-                date TEXT NOT NULL,
-                type TEXT NOT NULL,
-                jurisdiction TEXT,
-                text TEXT NOT NULL,
-                embedding TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            CREATE TABLE IF NOT EXISTS legal_store_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
             )
         """)
+        self._migrate_json_embeddings(conn)
+        self.fts = create_fts(conn)
         conn.commit()
         conn.close()
     
+    @staticmethod
+    def _migrate_chunk_identity(conn: sqlite3.Connection):
+        """Rebuild tables from before chunk identity, where url was UNIQUE (one chunk per URL)"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(legal_documents)")}
+        if "doc_id" in columns:
+            return
+        conn.execute(DOCUMENTS_SCHEMA.format(table="legal_documents_chunks"))
+        rows = conn.execute("""
+            SELECT id, title, url, source, date, type, jurisdiction, text, embedding, created_at
+            FROM legal_documents
+        """)
+        # Row ids are kept: the FTS index, the matrix and the FAISS index stay valid
+        conn.executemany("""
+            INSERT INTO legal_documents_chunks
+            (id, doc_id, chunk_index, content_hash, title, url, source, date, type, jurisdiction, text, embedding, created_at)
+            VALUES (?, ?, 0, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            (row_id, url, chunk_hash(title, source, date_str, type_, jurisdiction, text),
+             title, url, source, date_str, type_, jurisdiction, text, embedding, created_at)
+            for row_id, title, url, source, date_str, type_, jurisdiction, text, embedding, created_at in rows
+        ))
+        conn.execute("DROP TABLE legal_documents")
+        conn.execute("ALTER TABLE legal_documents_chunks RENAME TO legal_documents")
+        logger.info("Legal documents table migrated to chunk identity")
+    
+    @staticmethod
+    def _migrate_json_embeddings(conn: sqlite3.Connection):
+        """Convert embeddings stored as JSON text by earlier versions to binary blobs"""
+        converted = 0
+        while True:
+            rows = conn.execute(
+                "SELECT id, embedding FROM legal_documents WHERE typeof(embedding) = 'text' LIMIT ?",
+                (SQLITE_BATCH,)
+            ).fetchall()
+            if not rows:
+                break
+            conn.executemany(
+                "UPDATE legal_documents SET embedding = ? WHERE id = ?",
+                [(encode_embedding(decode_embedding(embedding, EMBEDDING_DIM)), row_id) for row_id, embedding in rows]
+            )
+            converted += len(rows)
+        if converted:
+            logger.info(f"Converted {converted} JSON embeddings to binary")
+    
+    def _resolve_backend(self, backend=None):
+        """Embedding backend compatible with the stored vectors, recorded in the store
+
+        An empty store adopts the given or configured backend. A store holding
+        vectors keeps the backend that built them, whatever the configuration;
+        if it cannot run here, semantic search is disabled (keyword search only).
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM legal_store_meta"))
+            embedded = conn.execute("SELECT COUNT(*) FROM legal_documents WHERE embedding IS NOT NULL").fetchone()[0]
+            
+            if not embedded:
+                backend = backend or create_backend(configured_backend(), cache=self.embedding_cache)
+                if backend:
+                    self._write_meta(conn, backend.name, backend.dimensions)
+                    self.dimensions = backend.dimensions
+                return backend
+            
+            recorded = meta.get("embedding_backend")
+            if recorded is None:
+                # Vectors stored before backends were recorded come from OpenAI
+                recorded = OPENAI_BACKEND_NAME
+                self._write_meta(conn, recorded, EMBEDDING_DIM)
+                meta["embedding_dim"] = str(EMBEDDING_DIM)
+            self.dimensions = int(meta["embedding_dim"])
+        finally:
+            conn.close()
+        
+        if backend is None:
+            if configured_backend() != recorded:
+                logger.warning(f"Legal store was embedded with {recorded}, keeping it over the configured backend")
+            backend = create_backend(recorded, self.dimensions, self.embedding_cache)
+        if backend is None or (backend.name, backend.dimensions) != (recorded, self.dimensions):
+            logger.warning(f"Embedding backend {recorded} ({self.dimensions}) unavailable, semantic search disabled")
+            return None
+        return backend
+    
+    @staticmethod
+    def _write_meta(conn: sqlite3.Connection, backend_name: str, dimensions: int):
+        conn.executemany(
+            "INSERT OR REPLACE INTO legal_store_meta (key, value) VALUES (?, ?)",
+            [("embedding_backend", backend_name), ("embedding_dim", str(dimensions))]
+        )
+        conn.commit()
+    
+    def _load_matrix(self):
+        """Map the embedding matrix, writing it if missing or out of step with SQLite"""
+        self.matrix.refresh()
+        conn = sqlite3.connect(self.db_path)
+        live = conn.execute("SELECT COUNT(*) FROM legal_documents WHERE embedding IS NOT NULL").fetchone()[0]
+        conn.close()
+        if live != self.matrix.live_count:
+            self.write_matrix()
+    
+    def _update_matrix(self, stale: List[int], added: List[Tuple[int, int, np.ndarray]]):
+        """Mark replaced rows as removed and append new ones, rewriting the file only if it cannot be appended to"""
+        self.matrix.refresh()
+        self.matrix.tombstone(stale)
+        if not self.matrix.append(added, self.dimensions):
+            self.write_matrix()
+    
+    def write_matrix(self):
+        """Rewrite the embedding matrix from the blobs stored in SQLite, in row id order"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            # One read transaction: the count and the rows come from the same snapshot
+            conn.execute("BEGIN")
+            count = conn.execute("SELECT COUNT(*) FROM legal_documents WHERE embedding IS NOT NULL").fetchone()[0]
+            rows = conn.execute("SELECT id, date, embedding FROM legal_documents WHERE embedding IS NOT NULL ORDER BY id")
+            self.matrix.write(
+                (
+                    (row_id, datetime.fromisoformat(date_str).toordinal(), decode_embedding(embedding, self.dimensions))
+                    for row_id, date_str, embedding in rows
+                ),
+                count, self.dimensions
+            )
+        finally:
+            conn.close()
+    
+    def status(self) -> Dict[str, Any]:
+        """Row count, index state and last ingestion time, without embedding or searching"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            documents, last_ingest = conn.execute(
+                "SELECT COUNT(*), MAX(created_at) FROM legal_documents"
+            ).fetchone()
+        finally:
+            conn.close()
+        index = getattr(self, "index", None)
+        return {
+            "ready": documents > 0,
+            "documents": documents,
+            "embedded_documents": self.matrix.live_count,
+            "removed_vectors": len(self.matrix) - self.matrix.live_count,
+            "index_loaded": index is not None,
+            "index_vectors": index.ntotal if index is not None else 0,
+            "last_ingest": last_ingest,
+            "embedding_backend": self.backend.name if self.backend else None,
+            "embedding_dim": self.dimensions
+        }
+    
+    def _new_index(self):
+        """Empty HNSW graph (inner product over normalized vectors), keyed by SQLite row id"""
+        graph = self.faiss.IndexHNSWFlat(self.dimensions, HNSW_M, self.faiss.METRIC_INNER_PRODUCT)
+        return self.faiss.IndexIDMap2(graph)
+    
     def _load_index(self):
         """Load FAISS index if exists"""
         if not self.faiss:
             return
         
         try:
-            if os.path.exists("legal_docs.index"):
-                self.index = self.faiss.read_index("legal_docs.index")
+            signature = file_signature(self.index_path)
+            if signature:
+                index = self.faiss.read_index(self.index_path)
+                if not hasattr(index, "id_map"):
+                    # Index from before row-id mapping: positions cannot be traced back to rows
+                    logger.info("FAISS index has no row ids, rebuilding it")
+                    self.rebuild_index()
+                    return
+                self.index = index
+                self._index_signature = signature
                 logger.info(f"Loaded FAISS index with {self.index.ntotal} vectors")
             else:
-                # Create empty index (will be populated on first upsert)
-                self.index = self.faiss.IndexFlatIP(1536)  # OpenAI embedding size
-                logger.info("Created new FAISS index")
+                # Documents may already be stored without an index file
+                self.rebuild_index()
+                logger.info(f"Created new FAISS index with {self.index.ntotal} vectors")
         except Exception as e:
             logger.error(f"Error loading FAISS index: {e}")
             self.index = None
     
+    def _save_index(self, index):
+        with self._index_lock:
+            self.index = index
+            if index.ntotal:
+                self.faiss.write_index(index, self.index_path)
+                self._index_signature = file_signature(self.index_path)
+    
+    def rebuild_index(self):
+        """Build the index from the live rows of the embedding matrix (vectors already normalized)
+
+        The new index is filled aside, searches keep using the current one until it is swapped in.
+        """
+        index = self._new_index()
+        live = self.matrix.live
+        for start in range(0, len(self.matrix), SQLITE_BATCH):
+            records = self.matrix.records[start:start + SQLITE_BATCH][live[start:start + SQLITE_BATCH]]
+            if len(records):
+                index.add_with_ids(np.ascontiguousarray(records["vector"]), np.ascontiguousarray(records["id"]))
+        self._save_index(index)
+    
+    def compact(self) -> int:
+        """Drop removed rows from the embedding matrix and their vectors from the FAISS index
+
+        Ingestion only appends and marks rows as removed; run this on demand
+        (python -m legal.ingest --compact) once many rows were replaced.
+        """
+        dropped = self.matrix.compact()
+        if self.faiss and self.index is not None:
+            self.rebuild_index()
+        logger.info(f"Compacted legal store: {dropped} removed rows dropped")
+        return dropped
+    
+    def refresh(self) -> bool:
+        """Reload the matrix and the FAISS index if their files changed on disk (e.g. after an ingestion run)"""
+        changed = self.matrix.refresh()
+        if not self.faiss:
+            return changed
+        signature = file_signature(self.index_path)
+        if signature is None or signature == self._index_signature:
+            return changed
+        with self._index_lock:
+            if signature != self._index_signature:
+                logger.info("FAISS index changed on disk, reloading")
+                self._load_index()
+        return True
+    
     def _get_embedding(self, text: str) -> Optional[List[float]]:
-        """Get OpenAI embedding for text"""
-        if not self.openai_client:
-            return None
-        
-        try:
-            response = self.openai_client.embeddings.create(
-                model="text-embedding-3-small",
-                input=text[:8000]  # Limit input size
-            )
-            return response.data[0].embedding
-        except Exception as e:
-            logger.error(f"Error getting embedding: {e}")
-            return None
+        """Query embedding from the store's backend"""
+        return self.backend.embed_query(text) if self.backend else None
+    
+    async def _get_embeddings(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Document embeddings from the store's backend, batched"""
+        if not self.backend:
+            return [None] * len(texts)
+        return await self.backend.embed_documents(texts)
     
     async def upsert(self, docs: List[LegalDoc]) -> bool:
-        """Insert or update documents"""
+        """Store chunks by (document id, chunk index): new or changed ones are embedded and written,
+        unchanged ones are skipped, and chunks a document no longer has are deleted"""
         try:
+            # The last occurrence of a chunk key wins
+            chunks = {(doc.doc_id or doc.url, doc.chunk_index): doc for doc in docs}
+            hashes = {key: chunk_hash(doc.title, doc.source, doc.date.isoformat(), doc.type, doc.jurisdiction, doc.text)
+                      for key, doc in chunks.items()}
+            existing = self._existing_chunks(sorted({doc_id for doc_id, _ in chunks}))
+            
+            changed = [key for key in chunks if key not in existing or existing[key][1] != hashes[key]]
+            stale = [row_id for key, (row_id, content_hash) in existing.items()
+                     if key not in chunks or content_hash != hashes[key]]
+            removed = sum(key not in chunks for key in existing)
+            if not changed and not stale:
+                logger.info(f"All {len(chunks)} chunks unchanged")
+                return True
+            
+            doc_embeddings = await self._get_embeddings([chunks[key].text for key in changed])
+            
             conn = sqlite3.connect(self.db_path)
+            row_ids = []
             embeddings = []
+            days = []
             
-            for doc in docs:
-                # Get embedding
-                embedding = self._get_embedding(doc.text)
-                embedding_json = json.dumps(embedding) if embedding else None
+            for start in range(0, len(stale), SQLITE_BATCH):
+                batch = stale[start:start + SQLITE_BATCH]
+                conn.execute(f"DELETE FROM legal_documents WHERE id IN ({','.join('?' * len(batch))})", batch)
+            
+            for key, embedding in zip(changed, doc_embeddings):
+                doc = chunks[key]
+                embedding_blob = encode_embedding(embedding) if embedding else None
                 
-                # Store in SQLite
-                conn.execute("""
-                    INSERT OR REPLACE INTO legal_documents 
-                    (title, url, source, date, type, jurisdiction, text, embedding)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                # Store in SQLite (a changed chunk gets a new id)
+                cursor = conn.execute("""
+                    INSERT INTO legal_documents 
+                    (doc_id, chunk_index, content_hash, title, url, source, date, type, jurisdiction, text, embedding)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """, (
+                    key[0],
+                    key[1],
+                    hashes[key],
                     doc.title,
                     doc.url,
                     doc.source,
@@ -136,20 +449,41 @@ class LocalVectorStore(VectorStore):
                     doc.type,
                     doc.jurisdiction,
                     doc.text,
-                    embedding_json
+                    embedding_blob
                 ))
                 
                 if embedding:
+                    row_ids.append(cursor.lastrowid)
                     embeddings.append(embedding)
+                    days.append(doc.date.toordinal())
             
             conn.commit()
+            live = conn.execute("SELECT COUNT(*) FROM legal_documents WHERE embedding IS NOT NULL").fetchone()[0]
             conn.close()
+            logger.info(
+                f"Stored {len(changed)} new or changed chunks, skipped {len(chunks) - len(changed)} unchanged, "
+                f"deleted {removed} stale"
+            )
+            
+            self._update_matrix(stale, [
+                (row_id, day, np.asarray(embedding, dtype=np.float32))
+                for row_id, day, embedding in zip(row_ids, days, embeddings)
+            ])
             
             # Update FAISS index if available
-            if self.faiss and self.index is not None and embeddings:
-                embeddings_array = np.array(embeddings, dtype=np.float32)
-                self.index.add(embeddings_array)
-                self.faiss.write_index(self.index, "legal_docs.index")
+            if self.faiss and self.index is not None:
+                with self._index_lock:
+                    if embeddings:
+                        self.index.add_with_ids(
+                            normalize_rows(np.array(embeddings, dtype=np.float32)),
+                            np.array(row_ids, dtype=np.int64)
+                        )
+                    # HNSW graphs cannot drop vectors: deleted rows are skipped at lookup until the next rebuild
+                    rebuild = self.index.ntotal > live * STALE_REBUILD_RATIO
+                    if embeddings and not rebuild:
+                        self._save_index(self.index)
+                if rebuild:
+                    self.rebuild_index()
                 logger.info(f"Added {len(embeddings)} vectors to FAISS index")
             
             return True
@@ -158,7 +492,24 @@ class LocalVectorStore(VectorStore):
             logger.error(f"Error upserting documents: {e}")
             return False
     
-    async def search(
+    def _existing_chunks(self, doc_ids: List[str]) -> Dict[Tuple[str, int], Tuple[int, str]]:
+        """(row id, content hash) of the stored chunks of these documents, by chunk key"""
+        existing = {}
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for start in range(0, len(doc_ids), SQLITE_BATCH):
+                batch = doc_ids[start:start + SQLITE_BATCH]
+                rows = conn.execute(f"""
+                    SELECT doc_id, chunk_index, id, content_hash FROM legal_documents
+                    WHERE doc_id IN ({",".join("?" * len(batch))})
+                """, batch)
+                for doc_id, chunk_index, row_id, content_hash in rows:
+                    existing[(doc_id, chunk_index)] = (row_id, content_hash)
+        finally:
+            conn.close()
+        return existing
+    
+    def search_sync(
         self, 
         query: str, 
         k: int = 10, 
@@ -166,75 +517,197 @@ class LocalVectorStore(VectorStore):
     ) -> List[VectorSearchResult]:
         """Search documents"""
         try:
+            self.refresh()
+            
             # Get query embedding
             query_embedding = self._get_embedding(query)
+            lexical = self._lexical_search(query, k * 2, since_date)
             
-            conn = sqlite3.connect(self.db_path)
-            
-            # Build SQL query with date filter
-            sql = """
-                SELECT title, url, source, date, type, jurisdiction, text, embedding
-                FROM legal_documents
-            """
-            params = []
-            
-            if since_date:
-                sql += " WHERE date >= ?"
-                params.append(since_date.isoformat())
-            
-            sql += " ORDER BY date DESC LIMIT ?"
-            params.append(k * 2)  # Get more docs for reranking
-            
-            cursor = conn.execute(sql, params)
-            rows = cursor.fetchall()
-            conn.close()
-            
-            results = []
-            for row in rows:
-                title, url, source, date_str, type_, jurisdiction, text, embedding_json = row
-                
-                # Create LegalDoc
-                doc = LegalDoc(
-                    title=title,
-                    url=url,
-                    source=source,
-                    date=datetime.fromisoformat(date_str),
-                    type=type_,
-                    jurisdiction=jurisdiction,
-                    text=text
-                )
-                
-                # Calculate relevance score
-                score = 0.5  # Default text similarity
-                if query_embedding and embedding_json:
-                    try:
-                        doc_embedding = json.loads(embedding_json)
-                        # Simple cosine similarity
-                        dot_product = np.dot(query_embedding, doc_embedding)
-                        norm_query = np.linalg.norm(query_embedding)
-                        norm_doc = np.linalg.norm(doc_embedding)
-                        score = dot_product / (norm_query * norm_doc)
-                    except:
-                        pass
-                
-                # Add freshness boost (more recent = higher score)
-                days_old = (datetime.now() - doc.date).days
-                freshness_factor = max(0.1, 1.0 - (days_old / 730))  # 2 years decay
-                relevance = score * 0.8 + freshness_factor * 0.2
-                
-                results.append(VectorSearchResult(
-                    doc=doc,
-                    score=score,
-                    relevance=relevance
-                ))
-            
-            # Sort by relevance and return top k
-            results.sort(key=lambda x: x.relevance, reverse=True)
-            return results[:k]
+            if query_embedding and self._index_size():
+                semantic = self._ann_search(query_embedding, k * 2, since_date)
+            elif query_embedding and self.matrix.live_count:
+                semantic = self._exact_search(query_embedding, k * 2, since_date)
+            elif not lexical:
+                return self._recent_search(query_embedding, k, since_date)
+            else:
+                semantic = []
+            return self._fuse(query_embedding, semantic, lexical, k)
             
         except Exception as e:
             logger.error(f"Error searching documents: {e}")
             return []
+    
+    def _index_size(self) -> int:
+        """Vectors in the FAISS index, 0 without one"""
+        if not self.faiss:
+            return 0
+        with self._index_lock:
+            return self.index.ntotal if self.index is not None else 0
+    
+    def _ann_search(self, query_embedding: List[float], k: int, since_date: Optional[datetime]) -> List[Tuple[int, VectorSearchResult]]:
+        """Nearest neighbours over the whole corpus, over-fetching until the date filter leaves enough"""
+        query_vector = normalize_rows(np.array([query_embedding], dtype=np.float32))
+        wanted = k * 2  # Extra candidates for the freshness rerank
+        fetch = wanted * SEARCH_OVERFETCH
+        while True:
+            # Only the FAISS call holds the lock, not the SQLite lookups
+            with self._index_lock:
+                total = self.index.ntotal
+                fetch = min(fetch, total)
+                params = self.faiss.SearchParametersHNSW(efSearch=max(HNSW_EF_SEARCH, fetch))
+                scores, ids = self.index.search(query_vector, fetch, params=params)
+            hits = {int(row_id): float(score) for row_id, score in zip(ids[0], scores[0]) if row_id != -1}
+            rows = self._rows_by_id(list(hits), since_date)
+            if len(rows) >= wanted or fetch >= total:
+                break
+            # Grow by the observed pass rate of the date filter (at least double)
+            fetch = max(fetch * 2, int(fetch * wanted / max(len(rows), 1) * 1.5))
+        
+        results = [(row_id, self._make_result(row, hits[row_id])) for row_id, row in rows.items()]
+        results.sort(key=lambda x: x[1].relevance, reverse=True)
+        return results[:k]
+    
+    def _exact_search(self, query_embedding: List[float], k: int, since_date: Optional[datetime]) -> List[Tuple[int, VectorSearchResult]]:
+        """Brute-force search over the whole matrix: one product, date mask and freshness as array operations"""
+        query_vector = normalize_rows(np.array([query_embedding], dtype=np.float32))[0]
+        scores = self.matrix.vectors @ query_vector
+        days = self.matrix.days
+        ranks = relevance(scores, date.today().toordinal() - days)
+        ranks[~self.matrix.live] = -np.inf
+        if since_date:
+            ranks[days < since_date.toordinal()] = -np.inf
+        
+        count = min(k, int(np.isfinite(ranks).sum()))
+        if not count:
+            return []
+        top = np.argpartition(-ranks, count - 1)[:count]
+        top = top[np.argsort(-ranks[top])]
+        
+        ids = self.matrix.ids[top]
+        # The date filter already applied, at day granularity
+        rows = self._rows_by_id([int(row_id) for row_id in ids], None)
+        return [
+            (row_id, self._make_result(rows[row_id], float(scores[position]), float(ranks[position])))
+            for row_id, position in zip(ids.tolist(), top)
+            if row_id in rows
+        ]
+    
+    def _rows_by_id(self, row_ids: List[int], since_date: Optional[datetime]) -> Dict[int, tuple]:
+        """Document rows for index hits, date filter applied (rows replaced since indexing are skipped)"""
+        rows = {}
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for start in range(0, len(row_ids), SQLITE_BATCH):
+                batch = row_ids[start:start + SQLITE_BATCH]
+                sql = f"""
+                    SELECT id, title, url, source, date, type, jurisdiction, text
+                    FROM legal_documents WHERE id IN ({",".join("?" * len(batch))})
+                """
+                params: List[Any] = list(batch)
+                if since_date:
+                    sql += " AND date >= ?"
+                    params.append(since_date.isoformat())
+                for row in conn.execute(sql, params):
+                    rows[row[0]] = row[1:]
+        finally:
+            conn.close()
+        return rows
+    
+    def _recent_search(self, query_embedding: Optional[List[float]], k: int, since_date: Optional[datetime]) -> List[VectorSearchResult]:
+        """Most recent documents, scored against the embedding matrix (no index or no query embedding)"""
+        conn = sqlite3.connect(self.db_path)
+        
+        # Build SQL query with date filter
+        sql = """
+            SELECT id, title, url, source, date, type, jurisdiction, text
+            FROM legal_documents
+        """
+        params = []
+        
+        if since_date:
+            sql += " WHERE date >= ?"
+            params.append(since_date.isoformat())
+        
+        sql += " ORDER BY date DESC LIMIT ?"
+        params.append(k * 2)  # Get more docs for reranking
+        
+        cursor = conn.execute(sql, params)
+        rows = cursor.fetchall()
+        conn.close()
+        
+        scores = self._similarities(query_embedding, [row[0] for row in rows])
+        results = [self._make_result(row[1:], float(score)) for row, score in zip(rows, scores)]
+        
+        # Sort by relevance and return top k
+        results.sort(key=lambda x: x.relevance, reverse=True)
+        return results[:k]
+    
+    def _similarities(self, query_embedding: Optional[List[float]], row_ids: List[int]) -> np.ndarray:
+        """Cosine similarity of rows from the embedding matrix; 0.5 (neutral) for rows without embedding"""
+        scores = np.full(len(row_ids), 0.5, dtype=np.float32)
+        if query_embedding and row_ids:
+            positions = self.matrix.positions(row_ids)
+            found = positions >= 0
+            if found.any():
+                query_vector = normalize_rows(np.array([query_embedding], dtype=np.float32))[0]
+                scores[found] = self.matrix.vectors[positions[found]] @ query_vector
+        return scores
+    
+    def _lexical_search(self, query: str, limit: int, since_date: Optional[datetime]) -> List[int]:
+        """Row ids ranked by BM25 over titles and texts"""
+        if not self.fts:
+            return []
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return lexical_search(conn, query, limit, since_date)
+        except sqlite3.OperationalError as e:
+            logger.error(f"Error in keyword search: {e}")
+            return []
+        finally:
+            conn.close()
+    
+    def _fuse(self, query_embedding: Optional[List[float]], semantic: List[Tuple[int, VectorSearchResult]],
+              lexical: List[int], k: int) -> List[VectorSearchResult]:
+        """Reciprocal rank fusion of the semantic and keyword rankings; relevance is the fused score"""
+        fused = fuse_rankings([[row_id for row_id, _ in semantic], lexical])
+        results = dict(semantic)
+        
+        # Keyword-only hits: read their rows and score them against the matrix
+        missing = [row_id for row_id in lexical if row_id not in results]
+        if missing:
+            rows = self._rows_by_id(missing, None)
+            scores = self._similarities(query_embedding, list(rows))
+            for (row_id, row), score in zip(rows.items(), scores):
+                results[row_id] = self._make_result(row, float(score))
+        
+        ranked = sorted((row_id for row_id in fused if row_id in results), key=lambda row_id: -fused[row_id])[:k]
+        for row_id in ranked:
+            results[row_id].relevance = fused[row_id]
+        return [results[row_id] for row_id in ranked]
+    
+    @staticmethod
+    def _make_result(row: tuple, score: float, rank: Optional[float] = None) -> VectorSearchResult:
+        """Search result for a (title, url, source, date, type, jurisdiction, text) row, ranked by freshness unless given"""
+        title, url, source, date_str, type_, jurisdiction, text = row
+        doc = LegalDoc(
+            title=title,
+            url=url,
+            source=source,
+            date=datetime.fromisoformat(date_str),
+            type=type_,
+            jurisdiction=jurisdiction,
+            text=text
+        )
+        
+        # Add freshness boost (more recent = higher score)
+        if rank is None:
+            rank = float(relevance(score, (datetime.now() - doc.date).days))
+        
+        return VectorSearchResult(
+            doc=doc,
+            score=score,
+            relevance=rank
+        )
 
 
 class SupabaseVectorStore(VectorStore):
@@ -243,15 +716,16 @@ class SupabaseVectorStore(VectorStore):
     def __init__(self):
         self.url = os.getenv("SUPABASE_URL")
         self.key = os.getenv("SUPABASE_ANON_KEY")
-        self.openai_client = None
+        self.backend = None
         
         if not (self.url and self.key):
             raise ValueError("SUPABASE_URL and SUPABASE_ANON_KEY required")
         
-        # Initialize OpenAI client
+        # pgvector columns hold OpenAI vectors; embeddings are cached locally,
+        # next to where the local store would be
         api_key = os.getenv("OPENAI_API_KEY")
         if api_key:
-            self.openai_client = OpenAI(api_key=api_key)
+            self.backend = OpenAIEmbeddings(OpenAI(api_key=api_key), EmbeddingCache(LEGAL_DB_PATH))
         
         # Try to import supabase
         try:
@@ -261,27 +735,21 @@ class SupabaseVectorStore(VectorStore):
             raise ImportError("supabase-py package required for SupabaseVectorStore")
     
     def _get_embedding(self, text: str) -> Optional[List[float]]:
-        """Get OpenAI embedding for text"""
-        if not self.openai_client:
-            return None
-        
-        try:
-            response = self.openai_client.embeddings.create(
-                model="text-embedding-3-small",
-                input=text[:8000]
-            )
-            return response.data[0].embedding
-        except Exception as e:
-            logger.error(f"Error getting embedding: {e}")
-            return None
+        """Query embedding from the store's backend"""
+        return self.backend.embed_query(text) if self.backend else None
+    
+    async def _get_embeddings(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Document embeddings from the store's backend, batched"""
+        if not self.backend:
+            return [None] * len(texts)
+        return await self.backend.embed_documents(texts)
     
     async def upsert(self, docs: List[LegalDoc]) -> bool:
         """Insert or update documents in Supabase"""
         try:
             data = []
-            for doc in docs:
-                embedding = self._get_embedding(doc.text)
-                
+            doc_embeddings = await self._get_embeddings([doc.text for doc in docs])
+            for doc, embedding in zip(docs, doc_embeddings):
                 data.append({
                     'title': doc.title,
                     'url': doc.url,
@@ -300,7 +768,7 @@ class SupabaseVectorStore(VectorStore):
             logger.error(f"Error upserting to Supabase: {e}")
             return False
     
-    async def search(
+    def search_sync(
         self, 
         query: str, 
         k: int = 10, 
@@ -364,7 +832,21 @@ class SupabaseVectorStore(VectorStore):
             return []
 
 
+_vector_store: Optional[VectorStore] = None
+_vector_store_lock = threading.Lock()
+
+
 def get_vector_store() -> VectorStore:
+    """Process-wide vector store, created on first use and shared by all requests"""
+    global _vector_store
+    if _vector_store is None:
+        with _vector_store_lock:
+            if _vector_store is None:
+                _vector_store = create_vector_store()
+    return _vector_store
+
+
+def create_vector_store() -> VectorStore:
     """Factory function to get appropriate vector store"""
     # Try Supabase first
     if os.getenv("SUPABASE_URL") and os.getenv("SUPABASE_ANON_KEY"):
@@ -114,7 +114,9 @@ class LegalDataIngester:
                     date=doc.date,
                     type=doc.type,
                     jurisdiction=doc.jurisdiction,
-                    text=chunk
+                    text=chunk,
+                    doc_id=doc.doc_id or doc.url,
+                    chunk_index=i
                 )
                 all_chunks.append(chunk_doc)
         
@@ -336,8 +338,14 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Ingest French legal data")
     parser.add_argument("--since", type=int, default=24, 
                        help="Ingest documents from the last N months (default: 24)")
+    parser.add_argument("--compact", action="store_true",
+                       help="Then drop replaced chunks from the local embedding matrix and FAISS index")
     
     args = parser.parse_args()
     
     # Run ingestion
-    asyncio.run(run_ingestion(args.since))
\ No newline at end of file
+    asyncio.run(run_ingestion(args.since))
+    
+    store = get_vector_store()
+    if args.compact and hasattr(store, "compact"):
+        print(f"Compaction: {store.compact()} replaced chunks dropped")
\ No newline at end of file
@@ -0,0 +1,117 @@
+"""
+Keyword search for the local legal store
+
+An SQLite FTS5 index over document titles and texts, kept in sync by
+triggers. The unicode61 tokenizer folds case and accents, so "indemnite"
+finds "indemnité". BM25 results are fused with the semantic ranking by
+reciprocal rank fusion, which needs no score calibration between the two.
+"""
+import re
+import logging
+import sqlite3
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+from text_utils import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Reciprocal rank fusion constant: damps the weight of the very first ranks
+RRF_K = 60
+
+# BM25 weights of the title and text columns
+TITLE_WEIGHT = 2.0
+TEXT_WEIGHT = 1.0
+
+FTS_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS legal_documents_fts USING fts5(
+        title, text,
+        content='legal_documents', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    );
+    CREATE TRIGGER IF NOT EXISTS legal_documents_fts_insert AFTER INSERT ON legal_documents BEGIN
+        INSERT INTO legal_documents_fts (rowid, title, text) VALUES (new.id, new.title, new.text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS legal_documents_fts_delete AFTER DELETE ON legal_documents BEGIN
+        INSERT INTO legal_documents_fts (legal_documents_fts, rowid, title, text)
+        VALUES ('delete', old.id, old.title, old.text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS legal_documents_fts_update AFTER UPDATE OF title, text ON legal_documents BEGIN
+        INSERT INTO legal_documents_fts (legal_documents_fts, rowid, title, text)
+        VALUES ('delete', old.id, old.title, old.text);
+        INSERT INTO legal_documents_fts (rowid, title, text) VALUES (new.id, new.title, new.text);
+    END;
+"""
+
+# Question words that carry no search value (compared accent-folded)
+STOPWORDS = {
+    "le", "la", "les", "de", "des", "du", "un", "une", "et", "ou", "en", "au", "aux", "a", "pour",
+    "par", "sur", "dans", "avec", "sans", "est", "sont", "ce", "cet", "cette", "ces", "mon", "ma",
+    "mes", "son", "sa", "ses", "je", "tu", "il", "elle", "on", "nous", "vous", "ils", "elles", "que",
+    "qui", "quoi", "quel", "quelle", "quels", "quelles", "comment", "pourquoi", "ne", "pas", "plus",
+    "se", "si", "me", "te", "lui", "leur", "leurs", "notre", "votre", "nos", "vos", "ai", "as", "dois",
+    "doit", "peut", "puis", "faire", "etre", "avoir", "mais", "donc", "car", "quand", "y", "dit", "dire"
+}
+
+# Words, and references such as "L1233-3", "23-12345" or "2024/123" kept whole
+QUERY_TERM = re.compile(r"\w+(?:[-/.]\w+)*")
+REFERENCE_SEPARATOR = re.compile(r"[-/.]")
+
+
+def create_fts(conn: sqlite3.Connection) -> bool:
+    """Create the FTS index (filled from existing rows); False if SQLite lacks FTS5"""
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'legal_documents_fts'"
+        ).fetchone()
+        conn.executescript(FTS_SCHEMA)
+        if not exists:
+            conn.execute("INSERT INTO legal_documents_fts (legal_documents_fts) VALUES ('rebuild')")
+        return True
+    except sqlite3.OperationalError as e:
+        logger.warning(f"FTS5 not available, keyword search disabled: {e}")
+        return False
+
+
+def fts_query(question: str) -> Optional[str]:
+    """FTS5 MATCH expression: any of the question's words, references as exact phrases"""
+    terms = []
+    for term in QUERY_TERM.findall(question.lower()):
+        parts = [part for part in REFERENCE_SEPARATOR.split(term.replace("_", " ")) if part.strip()]
+        if len(parts) == 1 and (len(term) < 2 or normalize_text(term) in STOPWORDS):
+            continue
+        # The tokenizer splits "l1233-3" into "l1233" and "3": the phrase keeps them adjacent
+        phrase = f'"{" ".join(parts)}"'
+        if parts and phrase not in terms:
+            terms.append(phrase)
+    return " OR ".join(terms) or None
+
+
+def lexical_search(conn: sqlite3.Connection, question: str, limit: int,
+                   since_date: Optional[datetime] = None) -> List[int]:
+    """Row ids of the best BM25 matches, best first"""
+    match = fts_query(question)
+    if not match:
+        return []
+    sql = """
+        SELECT legal_documents_fts.rowid
+        FROM legal_documents_fts JOIN legal_documents ON legal_documents.id = legal_documents_fts.rowid
+        WHERE legal_documents_fts MATCH ?
+    """
+    params: list = [match]
+    if since_date:
+        sql += " AND legal_documents.date >= ?"
+        params.append(since_date.isoformat())
+    sql += f" ORDER BY bm25(legal_documents_fts, {TITLE_WEIGHT}, {TEXT_WEIGHT}) LIMIT ?"
+    params.append(limit)
+    return [row_id for (row_id,) in conn.execute(sql, params)]
+
+
+def fuse_rankings(rankings: Sequence[Sequence[int]], k: int = RRF_K) -> Dict[int, float]:
+    """Reciprocal rank fusion: sum of 1 / (k + rank) over the rankings listing each id"""
+    fused: Dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, row_id in enumerate(ranking, 1):
+            fused[row_id] += 1.0 / (k + rank)
+    return dict(fused)
@@ -0,0 +1,103 @@
+"""
+Offline embeddings for self-hosted legal search
+
+Texts are turned into accent-folded character n-grams and words, then sent
+through a fixed sparse random projection. Each feature is hashed to a few
+signed output dimensions, which approximates a dense Gaussian projection
+without storing a matrix. No network and no model files: vectors depend only
+on the text, the dimension and the feature version in the backend name.
+Large batches are split across processes, since hashing is CPU-bound Python.
+"""
+import os
+import asyncio
+import hashlib
+import logging
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from text_utils import normalize_text
+
+logger = logging.getLogger(__name__)
+
+LOCAL_BACKEND_NAME = "local:ngram-hash-v1"
+# At most 65536 (dimensions are drawn from 16-bit hash slices)
+LOCAL_EMBEDDING_DIM = int(os.getenv("LEGAL_LOCAL_EMBEDDING_DIM", "384"))
+LOCAL_EMBEDDING_WORKERS = int(os.getenv("LEGAL_LOCAL_EMBEDDING_WORKERS", str(os.cpu_count() or 1)))
+
+NGRAM_SIZES = (3, 4, 5)
+
+# Signed output dimensions per feature (non-zeros per row of the projection)
+PROJECTIONS = 4
+
+# Below this many texts a process pool costs more than it saves
+PARALLEL_MIN_TEXTS = 64
+
+# Characters of a text that are embedded
+INPUT_CHARS = 8000
+
+
+def text_features(text: str) -> Counter:
+    """Character n-grams within word boundaries, plus whole words"""
+    normalized = normalize_text(text[:INPUT_CHARS])
+    features: Counter = Counter()
+    for word in normalized.split():
+        features["w:" + word] += 1
+        padded = f" {word} "
+        for size in NGRAM_SIZES:
+            for start in range(len(padded) - size + 1):
+                features[padded[start:start + size]] += 1
+    return features
+
+
+def embed_text(text: str, dimensions: int = LOCAL_EMBEDDING_DIM) -> np.ndarray:
+    """Unit-length embedding of one text (zeros for a text without features)"""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    features = text_features(text)
+    if not features:
+        return vector
+    # 16-bit slices of each feature's hash: output dimensions, then signs
+    digests = b"".join(
+        hashlib.blake2b(feature.encode(), digest_size=4 * PROJECTIONS).digest() for feature in features
+    )
+    hashed = np.frombuffer(digests, dtype="<u2").reshape(-1, 2 * PROJECTIONS)
+    positions = hashed[:, :PROJECTIONS] % dimensions
+    signs = np.where(hashed[:, PROJECTIONS:] & 1, 1.0, -1.0)
+    # Sublinear term frequency, so repeated boilerplate does not dominate
+    weights = 1.0 + np.log(np.fromiter(features.values(), dtype=np.float32, count=len(features)))
+    np.add.at(vector, positions.ravel(), (signs * weights[:, None]).ravel())
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def _embed_chunk(args) -> List[List[float]]:
+    texts, dimensions = args
+    return [embed_text(text, dimensions).tolist() for text in texts]
+
+
+class LocalEmbeddings:
+    """CPU-only embedding backend"""
+
+    def __init__(self, dimensions: int = LOCAL_EMBEDDING_DIM, workers: int = LOCAL_EMBEDDING_WORKERS):
+        self.name = LOCAL_BACKEND_NAME
+        self.dimensions = dimensions
+        self.workers = max(1, workers)
+
+    def embed_query(self, text: str) -> Optional[List[float]]:
+        return embed_text(text, self.dimensions).tolist()
+
+    def embed_many(self, texts: Sequence[str]) -> List[List[float]]:
+        """Embeddings in input order, spread over worker processes for large batches"""
+        if self.workers == 1 or len(texts) < PARALLEL_MIN_TEXTS:
+            return _embed_chunk((texts, self.dimensions))
+        size = -(-len(texts) // (self.workers * 4))
+        chunks = [(list(texts[start:start + size]), self.dimensions) for start in range(0, len(texts), size)]
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            return [vector for chunk in pool.map(_embed_chunk, chunks) for vector in chunk]
+
+    async def embed_documents(self, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        embeddings = await asyncio.to_thread(self.embed_many, texts)
+        logger.info(f"Embedded {len(texts)} chunks locally")
+        return embeddings
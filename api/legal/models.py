@@ -15,6 +15,8 @@ class LegalDoc(BaseModel):
     type: str  # code, decret, decision, fiche_pratique, etc.
     jurisdiction: Optional[str] = None  # For court decisions
     text: str
+    doc_id: Optional[str] = None  # Source document of a chunk (defaults to the URL)
+    chunk_index: int = 0  # Position of the chunk in its document
     
 
 class LegalQueryIn(BaseModel):
@@ -47,4 +49,4 @@ class VectorSearchResult(BaseModel):
     """Internal model for vector search results"""
     doc: LegalDoc
     score: float
-    relevance: float  # Combined score + freshness
\ No newline at end of file
+    relevance: float  # Ranking score: similarity + freshness, fused with keyword rank
\ No newline at end of file
@@ -1,6 +1,7 @@
 """
 FastAPI router for legal search functionality
 """
+import asyncio
 import logging
 import os
 from datetime import datetime, timedelta
@@ -8,8 +9,9 @@ from typing import List
 from fastapi import APIRouter, HTTPException
 from openai import OpenAI
 
-from .models import LegalQueryIn, LegalAnswer, LegalCitation
+from .models import LegalQueryIn, LegalAnswer, LegalCitation, VectorSearchResult
 from .index import get_vector_store
+from admission import legal_admission, Overloaded
 
 logger = logging.getLogger(__name__)
 
@@ -149,41 +151,17 @@ async def search_legal(query: LegalQueryIn):
         if len(query.question) > 500:
             raise HTTPException(status_code=400, detail="Question too long (max 500 characters)")
         
-        # Calculate date filter
-        since_date = datetime.now() - timedelta(days=query.since_months * 30)
-        
-        # Get vector store and search
-        vector_store = get_vector_store()
-        results = await vector_store.search(
-            query=query.question,
-            k=query.limit * 2,  # Get more for better filtering
-            since_date=since_date
-        )
-        
-        if not results:
-            return LegalAnswer(
-                answer=f"Aucune source juridique pertinente trouvée dans les {query.since_months} derniers mois pour votre question : \"{query.question}\". Cela peut signifier que votre domaine juridique nécessite des sources plus spécialisées ou que les termes de recherche doivent être adaptés.",
-                citations=[],
-                disclaimer="Recherche automatisée dans les sources officielles récentes. En l'absence de résultats, consultez un professionnel du droit ou les bases de données juridiques spécialisées."
+        # Reject early when retrieval + synthesis would miss the latency target
+        try:
+            async with legal_admission.admit():
+                return await run_legal_search(query)
+        except Overloaded as e:
+            raise HTTPException(
+                status_code=503,
+                detail="Recherche juridique momentanément surchargée. Merci de réessayer dans quelques instants.",
+                headers={"Retry-After": str(e.retry_after)}
             )
         
-        # Take best results and create citations
-        best_results = results[:query.limit]
-        citations = [format_citation(result.doc, i) for i, result in enumerate(best_results)]
-        
-        # Generate AI response
-        answer = generate_legal_response(
-            query.question,
-            [result.doc for result in best_results],
-            citations
-        )
-        
-        return LegalAnswer(
-            answer=answer,
-            citations=citations,
-            disclaimer="Synthèse automatisée à partir de sources officielles récentes. Ne constitue pas un avis juridique personnalisé. Consultez un avocat pour votre situation spécifique."
-        )
-        
     except HTTPException:
         raise
     except Exception as e:
@@ -191,19 +169,71 @@ async def search_legal(query: LegalQueryIn):
         raise HTTPException(status_code=500, detail="Internal server error during legal search")
 
 
+async def retrieve_legal_documents(question: str, limit: int, since_months: int) -> List[VectorSearchResult]:
+    """Most relevant recent documents for a question, searched in a worker thread"""
+    # Calculate date filter
+    since_date = datetime.now() - timedelta(days=since_months * 30)
+    
+    # Query embedding, SQLite and FAISS calls all block, and so does building the
+    # store on first use (migrations, index loading): keep them off the event loop
+    vector_store = await asyncio.to_thread(get_vector_store)
+    return await asyncio.to_thread(
+        vector_store.search_sync,
+        question,
+        limit * 2,  # Get more for better filtering
+        since_date
+    )
+
+
+async def find_legal_citations(question: str, limit: int = 2, since_months: int = 12) -> List[LegalCitation]:
+    """Citations only (no synthesis), used to enrich chat answers"""
+    results = await retrieve_legal_documents(question, limit, since_months)
+    return [format_citation(result.doc, i) for i, result in enumerate(results[:limit])]
+
+
+async def run_legal_search(query: LegalQueryIn) -> LegalAnswer:
+    """Retrieve relevant documents and synthesize the answer"""
+    results = await retrieve_legal_documents(query.question, query.limit, query.since_months)
+    
+    if not results:
+        return LegalAnswer(
+            answer=f"Aucune source juridique pertinente trouvée dans les {query.since_months} derniers mois pour votre question : \"{query.question}\". Cela peut signifier que votre domaine juridique nécessite des sources plus spécialisées ou que les termes de recherche doivent être adaptés.",
+            citations=[],
+            disclaimer="Recherche automatisée dans les sources officielles récentes. En l'absence de résultats, consultez un professionnel du droit ou les bases de données juridiques spécialisées."
+        )
+    
+    # Take best results and create citations
+    best_results = results[:query.limit]
+    citations = [format_citation(result.doc, i) for i, result in enumerate(best_results)]
+    
+    # Generate AI response off the event loop
+    answer = await asyncio.to_thread(
+        generate_legal_response,
+        query.question,
+        [result.doc for result in best_results],
+        citations
+    )
+    
+    return LegalAnswer(
+        answer=answer,
+        citations=citations,
+        disclaimer="Synthèse automatisée à partir de sources officielles récentes. Ne constitue pas un avis juridique personnalisé. Consultez un avocat pour votre situation spécifique."
+    )
+
+
 @router.get("/legal/health")
 async def legal_health():
-    """Health check for legal search service"""
-    vector_store = get_vector_store()
+    """Readiness of the legal search service (no embedding call, no search)"""
+    # The first call builds the store
+    vector_store = await asyncio.to_thread(get_vector_store)
     
-    # Try a simple search to check if the system is working
     try:
-        test_results = await vector_store.search("test", k=1)
+        status = await asyncio.to_thread(vector_store.status)
         return {
-            "status": "ok",
+            "status": "ok" if status.pop("ready") else "empty",
             "vector_store": type(vector_store).__name__,
             "openai_available": openai_client is not None,
-            "test_search": len(test_results) >= 0
+            **status
         }
     except Exception as e:
         return {
@@ -211,4 +241,4 @@ async def legal_health():
             "error": str(e),
             "vector_store": type(vector_store).__name__,
             "openai_available": openai_client is not None
-        }
\ No newline at end of file
+        }
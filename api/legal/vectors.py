@@ -0,0 +1,200 @@
+"""
+Binary embedding storage for the local legal store
+
+Embeddings are kept in SQLite as raw float32 (or float16) blobs instead of
+JSON text, and mirrored in a matrix file aligned with the SQLite row ids. The
+matrix is one contiguous .npy array of (id, day, vector) records, with the
+document date as a day ordinal and unit-length vectors, memory-mapped with NumPy: it is loaded without copying or parsing
+and shared with the page cache across processes.
+
+Ingestion appends new rows at the end of the file and marks replaced ones as
+removed in place; compact() drops removed rows when asked to.
+"""
+import io
+import json
+import os
+from typing import Any, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Blob precision in SQLite; the matrix is always float32 for fast products
+EMBEDDING_DTYPE = np.dtype(os.getenv("LEGAL_EMBEDDING_DTYPE", "float32"))
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int]]:
+    """(mtime, size) of a file, None if it does not exist"""
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        return None
+
+
+def encode_embedding(embedding: Iterable[float]) -> bytes:
+    """Embedding as a little-endian binary blob"""
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE.newbyteorder("<")).tobytes()
+
+
+def decode_embedding(value: Any, dim: int) -> np.ndarray:
+    """Embedding from a blob (float32 or float16, told apart by size) or legacy JSON text"""
+    if isinstance(value, str):
+        return np.array(json.loads(value), dtype=np.float32)
+    dtype = "<f2" if len(value) == dim * 2 else "<f4"
+    return np.frombuffer(value, dtype=dtype).astype(np.float32)
+
+
+def record_dtype(dim: int) -> np.dtype:
+    return np.dtype([("id", "<i8"), ("day", "<i4"), ("vector", "<f4", (dim,))])
+
+
+RECORD_FIELDS = record_dtype(1).names
+
+# Day of removed rows: not a date ordinal (those start at 1)
+TOMBSTONE_DAY = 0
+
+
+def unit(embedding: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm > 0 else embedding
+
+
+class EmbeddingMatrix:
+    """Memory-mapped, row-normalized embeddings of the stored documents, sorted by row id"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records: Optional[np.ndarray] = None
+        self._signature = None
+
+    def __len__(self) -> int:
+        return 0 if self.records is None else len(self.records)
+
+    @property
+    def ids(self) -> np.ndarray:
+        return np.zeros(0, dtype=np.int64) if self.records is None else self.records["id"]
+
+    @property
+    def days(self) -> np.ndarray:
+        """Document dates as proleptic Gregorian ordinals (date.toordinal())"""
+        return self.records["day"]
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """(n, dim) view over the mapped file, no copy"""
+        return self.records["vector"]
+
+    @property
+    def live(self) -> np.ndarray:
+        """Mask of the rows not removed since the last compaction"""
+        return np.zeros(0, dtype=bool) if self.records is None else self.records["day"] != TOMBSTONE_DAY
+
+    @property
+    def live_count(self) -> int:
+        return int(self.live.sum())
+
+    def refresh(self) -> bool:
+        """Map the file again if it changed on disk"""
+        signature = file_signature(self.path)
+        if signature == self._signature:
+            return False
+        records = np.load(self.path, mmap_mode="r") if signature else None
+        # Files from an older record layout are treated as missing, to be rewritten
+        self.records = records if records is not None and records.dtype.names == RECORD_FIELDS else None
+        self._signature = signature
+        return True
+
+    def write(self, rows: Iterable[Tuple[int, int, np.ndarray]], count: int, dim: int):
+        """Replace the file with (row id, day, embedding) rows given in increasing id order"""
+        tmp_path = f"{self.path}.tmp"
+        records = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=record_dtype(dim), shape=(count,))
+        written = 0
+        for row_id, day, embedding in rows:
+            records[written] = (row_id, day, unit(embedding))
+            written += 1
+        records.flush()
+        del records
+        # Readers keep their mapping of the old file until they refresh
+        os.replace(tmp_path, self.path)
+        self.refresh()
+
+    def append(self, rows: Sequence[Tuple[int, int, np.ndarray]], dim: int) -> bool:
+        """Add (row id, day, embedding) rows with ids above the last one at the end of the file
+
+        Returns False, leaving the file untouched, when the rows cannot be
+        appended (no file, other layout, ids out of order): rewrite it instead.
+        """
+        dtype = record_dtype(dim)
+        if self.records is None or self.records.dtype != dtype:
+            return False
+        if not rows:
+            return True
+        ids = [row_id for row_id, _, _ in rows]
+        last = int(self.ids[-1]) if len(self.records) else -1
+        if ids[0] <= last or any(a >= b for a, b in zip(ids, ids[1:])):
+            return False
+        added = np.zeros(len(rows), dtype=dtype)
+        for position, (row_id, day, embedding) in enumerate(rows):
+            added[position] = (row_id, day, unit(embedding))
+
+        with open(self.path, "r+b") as f:
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran_order, file_dtype = read_header(f)
+            offset = f.tell()
+            if fortran_order or file_dtype != dtype or shape != (len(self.records),):
+                return False
+            # NumPy pads headers so the row count can grow in place
+            header = io.BytesIO()
+            write_header = np.lib.format.write_array_header_1_0 if version == (1, 0) else np.lib.format.write_array_header_2_0
+            write_header(header, {
+                "descr": np.lib.format.dtype_to_descr(dtype),
+                "fortran_order": False,
+                "shape": (len(self.records) + len(rows),)
+            })
+            if len(header.getvalue()) != offset:
+                return False
+            # Rows first, then the count: readers mapping the file meanwhile see the old rows only
+            f.seek(offset + len(self.records) * dtype.itemsize)
+            f.write(added.tobytes())
+            f.flush()
+            f.seek(0)
+            f.write(header.getvalue())
+        self.refresh()
+        return True
+
+    def tombstone(self, row_ids: Iterable[int]) -> int:
+        """Mark rows as removed in place (day TOMBSTONE_DAY, zero vector), returns how many were live"""
+        positions = self.positions(list(row_ids))
+        positions = positions[positions >= 0]
+        if not len(positions):
+            return 0
+        records = np.load(self.path, mmap_mode="r+")
+        records["vector"][positions] = 0
+        records["day"][positions] = TOMBSTONE_DAY
+        records.flush()
+        del records
+        self.refresh()
+        return len(positions)
+
+    def compact(self) -> int:
+        """Rewrite the file without the removed rows, returns how many were dropped"""
+        live = self.live
+        dropped = len(live) - int(live.sum())
+        if dropped:
+            records = self.records
+            self.write(
+                ((int(records["id"][position]), int(records["day"][position]), records["vector"][position])
+                 for position in np.flatnonzero(live)),
+                len(live) - dropped, records.dtype["vector"].shape[0]
+            )
+        return dropped
+
+    def positions(self, row_ids: np.ndarray) -> np.ndarray:
+        """Matrix positions of row ids, -1 for ids not in the matrix or removed"""
+        ids = self.ids
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        if not len(ids):
+            return np.full(len(row_ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(ids, row_ids), len(ids) - 1)
+        found = (ids[positions] == row_ids) & (self.records["day"][positions] != TOMBSTONE_DAY)
+        return np.where(found, positions, -1)
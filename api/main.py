@@ -1,6 +1,7 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
 import json
 import os
 import time
@@ -11,6 +12,13 @@ import logging
 from jinja2 import Template
 import re
 import prompting
+from idempotency import (
+    idempotency_store, scoped_key, fingerprint_payload,
+    IdempotencyConflict, IDEMPOTENCY_HEADER, REPLAY_HEADER
+)
+from admission import generate_admission, Overloaded, GENERATE_DEGRADE_ON_OVERLOAD
+from encadrement import prefill_loyer_reference, lookup_rent_cap, rent_cap_checklist
+from intent import get_intent_model
 from collections import defaultdict
 from datetime import datetime, timedelta
 
@@ -23,6 +31,10 @@ rate_limit_store = defaultdict(list)
 
 app = FastAPI(title="Outils Citoyens API")
 
+# Index few-shot examples once per process
+logger.info(f"Indexed {prompting.index_fewshots()} few-shot examples")
+intent_model = get_intent_model()
+
 # Configure CORS origins
 allowed_origins = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000,https://outils-citoyens-three.vercel.app").split(",")
 
@@ -37,6 +49,10 @@ app.add_middleware(
 # OpenAI client
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY")) if os.getenv("OPENAI_API_KEY") else None
 
+# Generation mode: "full" (LLM writes all 4 sections), "blueprint" (LLM writes only the letter)
+# or "sectioned" (letter body, header and resume generated concurrently)
+GENERATION_MODE = os.getenv("GENERATION_MODE", "full")
+
 # Pydantic models
 class Lettre(BaseModel):
     destinataire_bloc: str
@@ -217,13 +233,37 @@ async def health():
     return {"ok": True}
 
 @app.post("/generate", response_model=Output)
-async def generate_document(request: GenerateRequest, req: Request):
+async def generate_document(request: GenerateRequest, req: Request, response: Response):
     """Generate document based on tool_id and fields"""
     # Rate limiting
     client_ip = req.client.host if req.client else "unknown"
     if not check_rate_limit(client_ip):
         raise HTTPException(status_code=429, detail="Rate limit exceeded. Please try again later.")
     
+    # Idempotency: retries with the same key reuse the original generation
+    try:
+        idempotency_key = scoped_key("generate", client_ip, req.headers.get(IDEMPOTENCY_HEADER))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if not idempotency_key:
+        return await run_generation(request)
+    
+    try:
+        result, replayed = await idempotency_store.run(
+            idempotency_key,
+            fingerprint_payload(request.model_dump()),
+            lambda: run_generation(request)
+        )
+    except IdempotencyConflict:
+        raise HTTPException(status_code=422, detail=f"{IDEMPOTENCY_HEADER} already used with a different payload")
+    
+    if replayed:
+        response.headers[REPLAY_HEADER] = "true"
+    return result
+
+async def run_generation(request: GenerateRequest) -> Output:
+    """Validate the request and generate the document"""
     try:
         tool_id = request.tool_id
         fields = request.fields
@@ -238,11 +278,31 @@ async def generate_document(request: GenerateRequest, req: Request):
         if tool_id == "travail":
             fields = format_work_fields(fields)
         
+        # Rent-cap figures come from the local index rather than user input
+        if tool_id == "loyers":
+            fields = prefill_loyer_reference(fields)
+        
         logger.info(f"Generating document for tool: {tool_id}")
         
-        # Generate base content using OpenAI
+        # Generate base content using OpenAI, behind admission control
         if client:
-            result = await generate_with_openai(tool_id, fields)
+            try:
+                async with generate_admission.admit():
+                    if GENERATION_MODE == "blueprint":
+                        result = await generate_letter_with_openai(tool_id, fields)
+                    elif GENERATION_MODE == "sectioned":
+                        result = await generate_sections_with_openai(tool_id, fields)
+                    else:
+                        result = await generate_with_openai(tool_id, fields)
+            except Overloaded as e:
+                if not GENERATE_DEGRADE_ON_OVERLOAD:
+                    raise HTTPException(
+                        status_code=503,
+                        detail="Service momentanément surchargé. Merci de réessayer dans quelques instants.",
+                        headers={"Retry-After": str(e.retry_after)}
+                    )
+                logger.warning(f"Degrading {tool_id} generation to template path under load")
+                result = generate_template_response(tool_id, fields)
         else:
             result = generate_mock_response(tool_id, fields)
         
@@ -270,7 +330,8 @@ async def generate_with_openai(tool_id: str, fields: Dict[str, Any]) -> Output:
             {"role": "user", "content": f"{prompt['instructions']}\n\n=== CONTEXTE ===\n{prompt['context']}\n\n=== TEMPLATE ===\n{prompt['template']}\n\nIMPORTANT: Réponds uniquement en JSON valide avec les clés attendues (resume, lettre{{destinataire_bloc, objet, corps, pj[], signature}}, checklist[], mentions)."}
         ]
         
-        response = client.chat.completions.create(
+        response = await asyncio.to_thread(
+            client.chat.completions.create,
             model="gpt-4o",
             messages=messages,
             temperature=0.2,
@@ -287,7 +348,8 @@ async def generate_with_openai(tool_id: str, fields: Dict[str, Any]) -> Output:
             # Retry once with error message
             logger.warning("First JSON parse failed, retrying with corrected prompt")
             try:
-                retry_response = client.chat.completions.create(
+                retry_response = await asyncio.to_thread(
+                    client.chat.completions.create,
                     model="gpt-4o",
                     messages=[
                         {"role": "system", "content": system_prompt},
@@ -314,7 +376,8 @@ async def generate_with_openai(tool_id: str, fields: Dict[str, Any]) -> Output:
             tool_template = load_tool_template(tool_id)
             user_prompt = create_user_prompt(tool_id, fields, tool_template)
             
-            response = client.chat.completions.create(
+            response = await asyncio.to_thread(
+                client.chat.completions.create,
                 model="gpt-4o",
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -330,6 +393,95 @@ async def generate_with_openai(tool_id: str, fields: Dict[str, Any]) -> Output:
         except Exception:
             return generate_mock_response(tool_id, fields)
 
+async def generate_letter_with_openai(tool_id: str, fields: Dict[str, Any]) -> Output:
+    """Ask the LLM for the letter only, assemble resume/checklist/mentions from blueprints"""
+    prompt = prompting.build_prompt(tool_id, fields, letter_only=True)
+    sections = prompting.build_local_sections(tool_id, fields, prompt)
+    
+    messages = [
+        {"role": "system", "content": prompt["system"]},
+        {"role": "user", "content": f"{prompt['instructions']}\n\n=== CONTEXTE ===\n{prompt['context']}\n\n=== TEMPLATE ===\n{prompt['template']}\n\nIMPORTANT: Réponds uniquement en JSON valide avec la seule clé lettre{{destinataire_bloc, objet, corps, pj[], signature}}."}
+    ]
+    
+    try:
+        response = await asyncio.to_thread(
+            client.chat.completions.create,
+            model="gpt-4o",
+            messages=messages,
+            temperature=0.2,
+            max_tokens=700
+        )
+        
+        result_data = json.loads(response.choices[0].message.content)
+        lettre = Lettre(**result_data.get("lettre", result_data))
+    except Exception as e:
+        logger.error(f"Letter-only generation failed: {str(e)}")
+        lettre = generate_mock_response(tool_id, fields).lettre
+    
+    return Output(lettre=lettre, **sections)
+
+async def generate_section(section: str, prompt: Dict[str, Any]) -> Dict[str, Any]:
+    """Generate one independent section as a JSON object"""
+    spec = prompting.SECTION_SPECS[section]
+    response = await asyncio.to_thread(
+        client.chat.completions.create,
+        model=spec["model"],
+        messages=prompting.build_section_messages(section, prompt),
+        temperature=0.2,
+        max_tokens=spec["max_tokens"]
+    )
+    return json.loads(response.choices[0].message.content)
+
+async def generate_sections_with_openai(tool_id: str, fields: Dict[str, Any]) -> Output:
+    """Generate letter body, header and resume concurrently, then merge into Output"""
+    prompt = prompting.build_prompt(tool_id, fields, letter_only=True)
+    sections = prompting.build_local_sections(tool_id, fields, prompt)
+    fallback = generate_mock_response(tool_id, fields)
+    
+    names = list(prompting.SECTION_SPECS)
+    results = await asyncio.gather(
+        *[generate_section(name, prompt) for name in names],
+        return_exceptions=True
+    )
+    
+    generated: Dict[str, Any] = {}
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            # A failed section falls back on its own, the others are kept
+            logger.error(f"Section {name} generation failed for {tool_id}: {str(result)}")
+            continue
+        problem = section_problem(name, result)
+        if problem:
+            logger.error(f"Invalid section {name} for {tool_id}: {problem}")
+            continue
+        generated.update({key: result[key] for key in prompting.SECTION_SPECS[name]["fields"]})
+    
+    lettre = Lettre(
+        destinataire_bloc=generated.get("destinataire_bloc", fallback.lettre.destinataire_bloc),
+        objet=generated.get("objet", fallback.lettre.objet),
+        corps=generated.get("corps", fallback.lettre.corps),
+        pj=generated.get("pj", fallback.lettre.pj),
+        signature=prompting.build_signature(fields)
+    )
+    return Output(
+        resume=generated.get("resume", sections["resume"]),
+        lettre=lettre,
+        checklist=sections["checklist"],
+        mentions=sections["mentions"]
+    )
+
+def section_problem(name: str, result: Any) -> Optional[str]:
+    """Why a section's JSON cannot be used as is, None if every expected key is there and well typed"""
+    if not isinstance(result, dict):
+        return f"expected an object, got {type(result).__name__}"
+    for key, expected in prompting.SECTION_SPECS[name]["fields"].items():
+        value = result.get(key)
+        if not value or not isinstance(value, expected):
+            return f"{key} missing or not a {expected.__name__}"
+        if expected is list and not all(isinstance(item, str) and item.strip() for item in value):
+            return f"{key} holds non-text items"
+    return None
+
 def generate_mock_response(tool_id: str, fields: Dict[str, Any]) -> Output:
     """Generate mock response when OpenAI is not available"""
     return Output(
@@ -355,6 +507,16 @@ def generate_mock_response(tool_id: str, fields: Dict[str, Any]) -> Output:
         mentions="Aide automatisée - ne remplace pas un conseil d'avocat. En cas de situation complexe, consultez un professionnel du droit."
     )
 
+def generate_template_response(tool_id: str, fields: Dict[str, Any]) -> Output:
+    """Build a response locally from the schema model when one is selected, else the mock letter"""
+    try:
+        modele_result = prompting.build_from_modele(prompting.load_schema(tool_id), fields)
+        if modele_result:
+            return Output(**modele_result)
+    except Exception as e:
+        logger.warning(f"Template generation failed for {tool_id}: {e}")
+    return generate_mock_response(tool_id, fields)
+
 def post_process_output(output: Output, tool_id: str, fields: Dict[str, Any]) -> Output:
     """Post-process the output to apply normalization rules"""
     # Remove emojis from resume and mentions
@@ -376,6 +538,12 @@ def post_process_output(output: Output, tool_id: str, fields: Dict[str, Any]) ->
             if len(paragraphs) >= 2:
                 paragraphs[1] += f" {price_calc}"
                 output.lettre.corps = '\n\n'.join(paragraphs)
+        
+        # Exact rent-cap items lead the checklist, whichever mode produced it
+        rent_cap = lookup_rent_cap(fields)
+        if rent_cap:
+            items = [item for item in rent_cap_checklist(rent_cap, fields) if item not in output.checklist]
+            output.checklist = items + output.checklist
     
     return output
 
@@ -3,10 +3,14 @@ Schema-driven prompt building module for Outils Citoyens
 """
 import json
 import os
+import re
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, NamedTuple, Optional
 import logging
 
+from encadrement import lookup_rent_cap, describe_rent_cap
+from text_utils import normalize_text, tokenize
+
 logger = logging.getLogger(__name__)
 
 def load_schema(tool_id: str) -> Dict[str, Any]:
@@ -130,6 +134,105 @@ def load_fewshots(tool_id: str) -> str:
     
     return ""
 
+# Number of few-shot examples injected per request
+FEWSHOTS_PER_REQUEST = int(os.getenv("FEWSHOTS_PER_REQUEST", "1"))
+
+class FewshotExample(NamedTuple):
+    """One example parsed from fewshots/{tool}.md"""
+    title: str
+    raw: str
+    input_fields: Dict[str, Any]
+    output: Optional[Dict[str, Any]]
+    values: frozenset  # "field=value" pairs for short, enum-like values
+    words: frozenset   # accent-folded words of all input values
+
+def _flatten_fields(payload: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    """Flatten nested form data, skipping identity (never informative for similarity)"""
+    flat = {}
+    for key, value in payload.items():
+        if key == 'identite':
+            continue
+        if isinstance(value, dict):
+            flat.update(_flatten_fields(value, f"{prefix}{key}."))
+        elif isinstance(value, list):
+            flat[f"{prefix}{key}"] = " ".join(str(item) for item in value)
+        elif value not in (None, ""):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+def _fewshot_features(payload: Dict[str, Any]) -> tuple:
+    """Exact field values and word set used to compare a request with examples"""
+    flat = _flatten_fields(payload)
+    values = frozenset(
+        f"{key}={normalize_text(value)}" for key, value in flat.items()
+        if len(str(value)) <= 40
+    )
+    words = frozenset(word for value in flat.values() for word in tokenize(value, min_length=4))
+    return values, words
+
+def parse_fewshots(text: str) -> List[FewshotExample]:
+    """Split a few-shot markdown file into its "## " examples"""
+    examples = []
+    for section in re.split(r'^## ', text, flags=re.M)[1:]:
+        title = section.splitlines()[0].strip()
+        blocks = re.findall(r'```json\s*\n(.*?)```', section, re.S)
+        try:
+            input_fields = json.loads(blocks[0]) if blocks else {}
+            output = json.loads(blocks[1]) if len(blocks) > 1 else None
+        except json.JSONDecodeError:
+            input_fields, output = {}, None
+        values, words = _fewshot_features(input_fields)
+        examples.append(FewshotExample(title, f"## {section.strip()}", input_fields, output, values, words))
+    return examples
+
+_fewshot_index: Dict[str, List[FewshotExample]] = {}
+
+def get_fewshot_examples(tool_id: str) -> List[FewshotExample]:
+    """Parsed examples for a tool, indexed once per process"""
+    if tool_id not in _fewshot_index:
+        _fewshot_index[tool_id] = parse_fewshots(load_fewshots(tool_id))
+    return _fewshot_index[tool_id]
+
+def index_fewshots() -> int:
+    """Index every few-shot file at startup, returns the number of examples"""
+    for fewshot_path in Path("fewshots").glob("*.md"):
+        get_fewshot_examples(fewshot_path.stem)
+    return sum(len(examples) for examples in _fewshot_index.values())
+
+def score_fewshot(example: FewshotExample, values: frozenset, words: frozenset) -> float:
+    """Exact field matches (type_amende, motif...) dominate, word overlap breaks ties"""
+    matches = len(example.values & values)
+    union = len(example.words | words)
+    overlap = len(example.words & words) / union if union else 0.0
+    return matches * 2.0 + overlap
+
+def render_fewshot(example: FewshotExample, letter_only: bool = False) -> str:
+    """Render an example, keeping only the letter when the other sections are built locally"""
+    if example.output is None:
+        return example.raw
+    output = {"lettre": example.output.get("lettre")} if letter_only else example.output
+    return f"""## {example.title}
+
+**Contexte d'entrée JSON:**
+```json
+{json.dumps(example.input_fields, ensure_ascii=False, indent=2)}
+```
+
+**Sortie JSON attendue:**
+```json
+{json.dumps(output, ensure_ascii=False, indent=2)}
+```"""
+
+def select_fewshots(tool_id: str, payload: Dict[str, Any], k: Optional[int] = None, letter_only: bool = False) -> str:
+    """The k examples most similar to the submitted fields"""
+    examples = get_fewshot_examples(tool_id)
+    if not examples:
+        return ""
+    k = FEWSHOTS_PER_REQUEST if k is None else k
+    values, words = _fewshot_features(payload)
+    ranked = sorted(examples, key=lambda example: score_fewshot(example, values, words), reverse=True)
+    return "\n\n".join(render_fewshot(example, letter_only) for example in ranked[:k])
+
 def get_checklist_blueprint(tool_id: str) -> List[str]:
     """Get checklist blueprint for a tool"""
     blueprints = {
@@ -191,6 +294,116 @@ def get_mentions_blueprint(tool_id: str) -> List[str]:
         "Aide juridique disponible si nécessaire"
     ])
 
+MENTIONS_DISCLAIMER = "Aide automatisée – ne remplace pas un conseil d'avocat."
+
+def build_resume(tool_id: str, payload: Dict[str, Any], schema: Dict[str, Any], mentions_blueprint: List[str]) -> List[str]:
+    """Assemble the action summary locally from schema data and blueprints"""
+    properties = schema.get('properties', {})
+    title = schema.get('title', f"Démarche {tool_id}")
+    
+    resume = [f"Vérifier les informations de votre démarche : {title}"]
+    
+    # Required fields the user left empty, named with their schema titles
+    missing = [
+        properties.get(name, {}).get('title', name.replace('_', ' '))
+        for name in schema.get('required', [])
+        if name != 'identite' and not payload.get(name)
+    ]
+    if missing:
+        resume.append(f"Compléter les éléments manquants dans la lettre : {', '.join(missing)}")
+    
+    pieces = schema.get('x-options', {}).get('pieces_suggerees', [])[:3]
+    if pieces:
+        resume.append(f"Rassembler les pièces justificatives : {', '.join(pieces)}")
+    else:
+        resume.append("Rassembler les pièces justificatives mentionnées dans la lettre")
+    
+    # Surface the deadline from the mentions blueprint when there is one
+    deadline = next((item for item in mentions_blueprint if item.lower().startswith('délai')), None)
+    if deadline:
+        resume.append(f"Respecter le {deadline[0].lower()}{deadline[1:]}")
+    
+    resume.extend([
+        "Envoyer le courrier en lettre recommandée avec accusé de réception",
+        "Conserver une copie du courrier et l'accusé de réception"
+    ])
+    return resume
+
+def build_mentions(mentions_blueprint: List[str]) -> str:
+    """Assemble the legal reminders locally from the mentions blueprint"""
+    reminders = " ".join(f"{item.rstrip('.')}." for item in mentions_blueprint)
+    return f"{MENTIONS_DISCLAIMER} {reminders}".strip()
+
+def build_local_sections(tool_id: str, payload: Dict[str, Any], prompt: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build resume, checklist and mentions without the LLM
+    
+    Args:
+        tool_id: Tool identifier
+        payload: Form data from user
+        prompt: Output of build_prompt (carries the blueprints)
+        
+    Returns:
+        Dictionary with resume, checklist, mentions
+    """
+    schema = load_schema(tool_id)
+    mentions_blueprint = prompt.get("mentions_blueprint") or get_mentions_blueprint(tool_id)
+    return {
+        "resume": build_resume(tool_id, payload, schema, mentions_blueprint),
+        "checklist": prompt.get("checklist_blueprint") or get_checklist_blueprint(tool_id),
+        "mentions": build_mentions(mentions_blueprint)
+    }
+
+def build_signature(payload: Dict[str, Any]) -> str:
+    """Signature block from the identity fields"""
+    identite = payload.get('identite') or {}
+    return f"{identite.get('prenom', '[Prénom]')} {identite.get('nom', '[Nom]')}\n{identite.get('adresse', '[Adresse]')}"
+
+# Independent sections generated concurrently in "sectioned" mode
+# fields: keys each section must return, with their JSON type (lists hold strings)
+SECTION_SPECS = {
+    "corps": {
+        "keys": "corps (4 paragraphes séparés par une ligne vide, formule d'appel et de politesse incluses), pj[] (pièces jointes)",
+        "model": "gpt-4o",
+        "max_tokens": 700,
+        "fields": {"corps": str, "pj": list},
+        "with_examples": True
+    },
+    "entete": {
+        "keys": "destinataire_bloc (nom et adresse du destinataire sur plusieurs lignes), objet (une ligne sobre)",
+        "model": "gpt-4o-mini",
+        "max_tokens": 150,
+        "fields": {"destinataire_bloc": str, "objet": str},
+        "with_examples": False
+    },
+    "resume": {
+        "keys": "resume[] (5 à 8 étapes concrètes commençant par un verbe à l'infinitif)",
+        "model": "gpt-4o-mini",
+        "max_tokens": 300,
+        "fields": {"resume": list},
+        "with_examples": False
+    }
+}
+
+def build_section_messages(section: str, prompt: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Messages for one section, with only the context that section needs"""
+    spec = SECTION_SPECS[section]
+    system_prompt = """Tu es un assistant juridique français expert et bienveillant, spécialisé en démarches administratives. 
+Tu maintiens un ton administratif français, factuel, sans donner de conseils juridiques personnalisés.
+
+Ta mission : rédiger uniquement la partie demandée d'un courrier officiel, au format JSON."""
+    
+    context = prompt["context"] if spec["with_examples"] else prompt["base_context"]
+    user_prompt = f"{prompt['instructions']}\n\n=== CONTEXTE ===\n{context}"
+    if section == "corps":
+        user_prompt += f"\n\n=== TEMPLATE ===\n{prompt['template']}"
+    user_prompt += f"\n\nIMPORTANT: Réponds uniquement en JSON valide avec les seules clés : {spec['keys']}."
+    
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
 def build_from_modele(schema: Dict[str, Any], payload: Dict[str, Any]) -> Dict[str, Any]:
     """
     Build response from a pre-filled model using Jinja2
@@ -248,8 +461,7 @@ def build_from_modele(schema: Dict[str, Any], payload: Dict[str, Any]) -> Dict[s
     destinataire_bloc = get_destinataire_bloc(destinataire_id, schema)
     
     # Generate signature
-    identite = payload.get('identite', {})
-    signature = f"{identite.get('prenom', '[Prénom]')} {identite.get('nom', '[Nom]')}\n{identite.get('adresse', '[Adresse]')}"
+    signature = build_signature(payload)
     
     # Build pieces jointes from schema suggestions and user selection
     pieces_jointes = payload.get('pieces_suggerees', [])
@@ -298,13 +510,14 @@ def get_destinataire_bloc(destinataire_id: str, schema: Dict[str, Any]) -> str:
     
     return destinataire_map.get(destinataire_id, "Service compétent\n[Adresse à compléter]")
 
-def build_prompt(tool_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+def build_prompt(tool_id: str, payload: Dict[str, Any], letter_only: bool = False) -> Dict[str, Any]:
     """
     Main function to build schema-driven prompt
     
     Args:
         tool_id: Tool identifier (e.g., 'amendes', 'caf')
         payload: Form data from user
+        letter_only: Ask only for the letter, other sections are built locally
         
     Returns:
         Dict with prompt components
@@ -316,17 +529,21 @@ def build_prompt(tool_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
         
         # Load template and few-shot examples
         template = load_template(tool_id)
-        fewshots = load_fewshots(tool_id)
+        fewshots = select_fewshots(tool_id, payload, letter_only=letter_only)
         
         # Get blueprints
         checklist_blueprint = get_checklist_blueprint(tool_id)
         mentions_blueprint = get_mentions_blueprint(tool_id)
         
         # Build system prompt
-        system_prompt = """Tu es un assistant juridique français expert et bienveillant, spécialisé en démarches administratives. 
+        if letter_only:
+            mission = "rédiger uniquement la lettre officielle (clé JSON \"lettre\"). Le résumé, la checklist et les mentions sont produits séparément."
+        else:
+            mission = "générer une réponse JSON complète avec 4 clés pour des lettres officielles."
+        system_prompt = f"""Tu es un assistant juridique français expert et bienveillant, spécialisé en démarches administratives. 
 Tu maintiens un ton administratif français, factuel, sans donner de conseils juridiques personnalisés.
 
-Ta mission : générer une réponse JSON complète avec 4 clés pour des lettres officielles."""
+Ta mission : {mission}"""
 
         # Build instructions
         instructions = f"""Contraintes de style et structure :
@@ -336,6 +553,15 @@ Ta mission : générer une réponse JSON complète avec 4 clés pour des lettres
 - Aucun conseil juridique personnalisé, seulement des faits et procédures
 - Formules de politesse appropriées mais chaleureuses"""
 
+        # Exact rent-cap figures from the local reference index
+        if tool_id == "loyers":
+            rent_cap = lookup_rent_cap(payload)
+            if rent_cap:
+                context = f"{context}\n\n=== ENCADREMENT DES LOYERS ===\n" + "\n".join(describe_rent_cap(rent_cap, payload))
+        
+        # Context without examples, for the small section prompts
+        base_context = context
+        
         # Add few-shot examples if available
         if fewshots:
             context = f"{context}\n\n=== EXEMPLES ===\n{fewshots}"
@@ -344,6 +570,7 @@ Ta mission : générer une réponse JSON complète avec 4 clés pour des lettres
             "system": system_prompt,
             "instructions": instructions,
             "context": context,
+            "base_context": base_context,
             "template": template,
             "checklist_blueprint": checklist_blueprint,
             "mentions_blueprint": mentions_blueprint
@@ -356,6 +583,7 @@ Ta mission : générer une réponse JSON complète avec 4 clés pour des lettres
             "system": "Assistant juridique français pour courriers administratifs",
             "instructions": "Répondre en français administratif, ton factuel",
             "context": f"Outil: {tool_id}\nDonnées: {json.dumps(payload, ensure_ascii=False)}",
+            "base_context": f"Outil: {tool_id}\nDonnées: {json.dumps(payload, ensure_ascii=False)}",
             "template": load_template("_generic"),
             "checklist_blueprint": get_checklist_blueprint(tool_id),
             "mentions_blueprint": get_mentions_blueprint(tool_id)
@@ -0,0 +1,123 @@
+"""
+Semantic cache for first-turn chat answers
+
+Single-turn questions asked outside any form ("comment contester une amende
+de stationnement ?") are frequent and near-identical. Their answers are kept
+in a local vector table: a question is embedded as a hashed word n-gram
+vector and the closest cached question above a similarity threshold is
+served without calling the LLM. Entries expire after a TTL and are tagged
+with a version (hash of the system prompt), so a prompt change invalidates
+them. Short words and numbers are part of the vector, and the numbers of a
+question (amounts, delays, dates) must also match exactly: "35 euros" and
+"90 euros" read alike but call for different answers.
+"""
+import hashlib
+import logging
+import os
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from intent import hash_features
+from text_utils import tokenize
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENABLED = os.getenv("CHAT_CACHE_ENABLED", "true").lower() == "true"
+CACHE_THRESHOLD = float(os.getenv("CHAT_CACHE_THRESHOLD", "0.9"))
+CACHE_TTL_SECONDS = int(os.getenv("CHAT_CACHE_TTL_SECONDS", str(24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "5000"))
+
+EMBEDDING_BITS = 10
+
+
+def embed_question(text: str, bits: int = EMBEDDING_BITS) -> np.ndarray:
+    """L2-normalized hashed n-gram vector of a question"""
+    vector = np.zeros(1 << bits, dtype=np.float32)
+    # Every token counts: "en hiver" or "15 jours" change the question
+    for index, count in hash_features(text, bits, min_length=1).items():
+        vector[index] = np.log1p(count)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def numbers_key(text: str) -> int:
+    """Hash of the tokens holding digits, in order (0 when there are none)"""
+    numbers = [token for token in tokenize(text) if any(c.isdigit() for c in token)]
+    return zlib.crc32(" ".join(numbers).encode("utf-8")) if numbers else 0
+
+
+def prompt_version(*parts: str) -> str:
+    """Version tag of the prompt configuration answers were produced with"""
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()[:12]
+
+
+class SemanticCache:
+    """Fixed-size vector table of answered questions (oldest entries overwritten first)"""
+
+    def __init__(
+        self,
+        threshold: float = CACHE_THRESHOLD,
+        ttl_seconds: int = CACHE_TTL_SECONDS,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        bits: int = EMBEDDING_BITS
+    ):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self.bits = bits
+        self._vectors = np.zeros((self.max_entries, 1 << bits), dtype=np.float32)
+        self._expires = np.zeros(self.max_entries, dtype=np.float64)
+        self._versions = np.full(self.max_entries, "", dtype="<U12")
+        self._numbers = np.zeros(self.max_entries, dtype=np.int64)
+        self._values: List[Optional[Dict[str, Any]]] = [None] * self.max_entries
+        self._next = 0
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, question: str, version: str) -> Optional[Dict[str, Any]]:
+        """Cached answer of the most similar live question, None below the threshold"""
+        vector = embed_question(question, self.bits)
+        scores = self._vectors @ vector
+        # Expired entries, answers from another prompt version and questions
+        # with other numbers never match
+        stale = (self._expires < time.time()) | (self._versions != version)
+        scores[stale | (self._numbers != numbers_key(question))] = -1
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        logger.info(f"Chat cache hit (similarity {scores[best]:.3f})")
+        return dict(self._values[best])
+
+    def store(self, question: str, version: str, value: Dict[str, Any]):
+        """Remember the answer to a question"""
+        slot = self._next
+        self._vectors[slot] = embed_question(question, self.bits)
+        self._expires[slot] = time.time() + self.ttl_seconds
+        self._versions[slot] = version
+        self._numbers[slot] = numbers_key(question)
+        self._values[slot] = dict(value)
+        self._next = (slot + 1) % self.max_entries
+
+    def clear(self):
+        self._vectors[:] = 0
+        self._expires[:] = 0
+        self._versions[:] = ""
+        self._numbers[:] = 0
+        self._values = [None] * self.max_entries
+        self._next = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": sum(1 for v in self._values if v is not None),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+# Shared cache for the chat router
+chat_cache = SemanticCache()
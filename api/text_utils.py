@@ -0,0 +1,20 @@
+"""
+Text normalization helpers shared by the matching and retrieval code
+"""
+import re
+import unicodedata
+from typing import Any, List
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def normalize_text(value: Any) -> str:
+    """Lowercase, strip accents and collapse whitespace"""
+    text = unicodedata.normalize("NFKD", str(value))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", text.lower()).strip()
+
+
+def tokenize(value: Any, min_length: int = 1) -> List[str]:
+    """Accent-folded word tokens"""
+    return [word for word in WORD_PATTERN.findall(normalize_text(value)) if len(word) >= min_length]
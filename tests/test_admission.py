@@ -0,0 +1,82 @@
+"""
+Tests for admission control and load shedding
+"""
+import pytest
+import sys
+import os
+import asyncio
+
+# Add the api directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from fastapi.testclient import TestClient
+import main
+from admission import AdmissionController, Overloaded, generate_admission
+
+client = TestClient(main.app)
+
+PAYLOAD = {
+    "tool_id": "amendes",
+    "fields": {"motif_contestation": "Erreur de lieu"}
+}
+
+def test_admits_until_latency_target_is_missed():
+    """Requests beyond the latency budget are rejected before queueing"""
+    controller = AdmissionController("test", max_concurrency=2, latency_target=2.5, initial_service_time=1.0)
+
+    async def scenario():
+        release = asyncio.Event()
+        admitted = []
+
+        async def hold():
+            async with controller.admit():
+                admitted.append(1)
+                await release.wait()
+
+        # 2 running + 2 queued => a fifth request would wait 3 waves (3s > 2.5s)
+        tasks = [asyncio.create_task(hold()) for _ in range(4)]
+        await asyncio.sleep(0)
+        assert controller.in_flight == 4
+
+        with pytest.raises(Overloaded) as excinfo:
+            async with controller.admit():
+                pass
+        assert excinfo.value.retry_after >= 1
+
+        release.set()
+        await asyncio.gather(*tasks)
+        return len(admitted)
+
+    assert asyncio.run(scenario()) == 4
+    assert controller.in_flight == 0
+    assert controller.rejected == 1
+
+def test_generate_sheds_with_retry_after(monkeypatch):
+    """/generate answers 503 + Retry-After when overloaded"""
+    async def fake_openai(tool_id, fields):
+        return main.generate_mock_response(tool_id, fields)
+
+    monkeypatch.setattr(main, "client", object())
+    monkeypatch.setattr(main, "generate_with_openai", fake_openai)
+    monkeypatch.setattr(generate_admission, "latency_target", 0.0)
+
+    response = client.post("/generate", json=PAYLOAD)
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+
+def test_generate_degrades_to_template(monkeypatch):
+    """/generate falls back to the template path when degradation is enabled"""
+    async def failing_openai(tool_id, fields):
+        raise AssertionError("LLM must not be called when shedding")
+
+    monkeypatch.setattr(main, "client", object())
+    monkeypatch.setattr(main, "generate_with_openai", failing_openai)
+    monkeypatch.setattr(main, "GENERATE_DEGRADE_ON_OVERLOAD", True)
+    monkeypatch.setattr(generate_admission, "latency_target", 0.0)
+
+    response = client.post("/generate", json=PAYLOAD)
+    assert response.status_code == 200
+    assert "lettre" in response.json()
+
+if __name__ == "__main__":
+    pytest.main([__file__])
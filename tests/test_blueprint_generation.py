@@ -0,0 +1,69 @@
+"""
+Tests for blueprint-driven generation (LLM writes only the letter)
+"""
+import pytest
+import sys
+import os
+import json
+from types import SimpleNamespace
+
+# Add the api directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from fastapi.testclient import TestClient
+import main
+import prompting
+
+LETTRE = {
+    "destinataire_bloc": "ANTAI\nService de Contestation",
+    "objet": "Contestation du procès-verbal n° 12345678",
+    "corps": "Madame, Monsieur,\n\nUn.\n\nDeux.\n\nTrois.",
+    "pj": ["Copie du procès-verbal"],
+    "signature": "Pierre MARTIN"
+}
+
+class FakeCompletions:
+    def __init__(self):
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        message = SimpleNamespace(content=json.dumps({"lettre": LETTRE}))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+def test_local_sections_from_blueprints():
+    """Resume, checklist and mentions are assembled without the LLM"""
+    fields = {"type_amende": "stationnement", "lieu": "Rue Victor Hugo, Lyon"}
+    prompt = prompting.build_prompt("amendes", fields, letter_only=True)
+    sections = prompting.build_local_sections("amendes", fields, prompt)
+
+    assert sections["checklist"] == prompting.get_checklist_blueprint("amendes")
+    assert sections["mentions"].startswith(prompting.MENTIONS_DISCLAIMER)
+    assert "45 jours" in sections["mentions"]
+    assert any("45 jours" in item for item in sections["resume"])
+    # Missing required fields are listed with their schema titles
+    assert any("Numéro du PV" in item for item in sections["resume"])
+    assert "uniquement la lettre" in prompt["system"]
+
+def test_blueprint_mode_asks_only_for_letter(monkeypatch):
+    """/generate in blueprint mode requests the letter alone with a smaller cap"""
+    completions = FakeCompletions()
+    monkeypatch.setattr(main, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    monkeypatch.setattr(main, "GENERATION_MODE", "blueprint")
+
+    response = TestClient(main.app).post("/generate", json={
+        "tool_id": "amendes",
+        "fields": {"numero_process_verbal": "12345678"}
+    })
+    assert response.status_code == 200
+    data = response.json()
+
+    assert len(completions.calls) == 1
+    assert completions.calls[0]["max_tokens"] < 1200
+    assert "seule clé lettre" in completions.calls[0]["messages"][1]["content"]
+    assert data["lettre"]["objet"] == "Objet : Contestation du procès-verbal n° 12345678"
+    assert data["checklist"] == prompting.get_checklist_blueprint("amendes")
+    assert data["mentions"].startswith("Aide automatisée")
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,124 @@
+"""
+Tests for the semantic cache of first-turn chat answers
+"""
+import pytest
+import sys
+import os
+import time
+from types import SimpleNamespace
+
+# Add the api directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from fastapi.testclient import TestClient
+import main
+import chat
+from response_cache import SemanticCache, embed_question
+
+client = TestClient(main.app)
+
+class CountingCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"Réponse {self.calls}"))])
+
+@pytest.fixture
+def completions(monkeypatch):
+    completions = CountingCompletions()
+    monkeypatch.setattr(chat, "openai_client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    monkeypatch.setattr(chat, "chat_cache", SemanticCache())
+    return completions
+
+def test_repeated_question_served_from_cache(completions):
+    """A near-identical first question skips the LLM"""
+    first = client.post("/chat", json={"message": "Comment contester une amende de stationnement ?"})
+    second = client.post("/chat", json={"message": "comment contester une amende de stationnement"})
+    assert completions.calls == 1
+    assert second.json()["answer"] == first.json()["answer"]
+    # Each conversation still gets its own session
+    assert second.json()["conversation_id"] != first.json()["conversation_id"]
+
+def test_different_question_misses(completions):
+    """Related but different questions are not confused"""
+    client.post("/chat", json={"message": "Comment contester une amende de stationnement ?"})
+    client.post("/chat", json={"message": "Quel délai pour payer une amende de stationnement ?"})
+    assert completions.calls == 2
+
+def test_follow_up_and_form_context_not_cached(completions):
+    """Only single-turn questions outside a form are cached"""
+    question = "Comment contester une amende de stationnement ?"
+    first = client.post("/chat", json={"message": question})
+    client.post("/chat", json={"conversation_id": first.json()["conversation_id"], "message": question})
+    client.post("/chat", json={"message": question, "tool_id": "amendes", "current_form_values": {"lieu": "Paris"}})
+    assert completions.calls == 3
+
+def test_prompt_change_invalidates(monkeypatch, completions):
+    """Changing the system prompt invalidates cached answers"""
+    question = "Comment contester une amende de stationnement ?"
+    client.post("/chat", json={"message": question})
+    monkeypatch.setattr(chat, "CHAT_SYSTEM_PROMPT", chat.CHAT_SYSTEM_PROMPT + "\nNouvelle consigne.")
+    client.post("/chat", json={"message": question})
+    assert completions.calls == 2
+
+def test_emotional_context_not_shared(completions):
+    """A stressed asker's prompt and footer are not served to a calm one"""
+    client.post("/chat", json={"message": "URGENT comment contester une amende de stationnement ?"})
+    calm = client.post("/chat", json={"message": "Comment contester une amende de stationnement ?"})
+    assert completions.calls == 2
+    assert calm.json()["answer"] == "Réponse 2"
+
+def test_footer_applied_per_request(completions):
+    """Cached answers hold the model text only, the footer is added for each asker"""
+    question = "C'est scandaleux, comment contester une amende de stationnement ?"
+    first = client.post("/chat", json={"message": question})
+    second = client.post("/chat", json={"message": question})
+    assert completions.calls == 1
+    assert second.json()["answer"] == first.json()["answer"]
+    assert first.json()["answer"].count("Votre colère est légitime") == 1
+
+def test_stream_uses_cache(completions):
+    """The streaming endpoint shares the cache"""
+    question = "Comment contester une amende de stationnement ?"
+    client.post("/chat", json={"message": question})
+    response = client.post("/chat/stream", json={"message": question})
+    assert completions.calls == 1
+    assert '"answer": "Réponse 1"' in response.text
+
+def test_entries_expire():
+    """Entries past their TTL are ignored"""
+    cache = SemanticCache(ttl_seconds=60)
+    cache.store("Comment contester une amende ?", "v1", {"answer": "ok"})
+    assert cache.lookup("comment contester une amende", "v1") == {"answer": "ok"}
+    assert cache.lookup("comment contester une amende", "v2") is None
+    cache._expires[:] = time.time() - 1
+    assert cache.lookup("comment contester une amende", "v1") is None
+
+def test_oldest_entries_overwritten():
+    """The table has a fixed size"""
+    cache = SemanticCache(max_entries=2)
+    for i, text in enumerate(["amende stationnement", "facture electricite", "expulsion logement"]):
+        cache.store(text, "v", {"answer": str(i)})
+    assert cache.lookup("amende stationnement", "v") is None
+    assert cache.lookup("expulsion logement", "v") == {"answer": "2"}
+
+def test_different_numbers_miss():
+    """Amounts and delays must match exactly, even when the wording is the same"""
+    cache = SemanticCache()
+    cache.store("Comment contester une amende de 35 euros reçue il y a 45 jours ?", "v", {"answer": "35"})
+    assert cache.lookup("Comment contester une amende de 90 euros reçue il y a 15 jours ?", "v") is None
+    assert cache.lookup("comment contester une amende de 35 euros recue il y a 45 jours", "v") == {"answer": "35"}
+
+def test_short_words_count():
+    """A short qualifier changes the question"""
+    cache = SemanticCache()
+    cache.store("Mon bailleur veut m'expulser", "v", {"answer": "toute l'année"})
+    assert cache.lookup("Mon bailleur veut m'expulser en hiver", "v") is None
+
+def test_embedding_is_accent_insensitive():
+    assert float(embed_question("Contester l'amende") @ embed_question("contester l amende")) > 0.99
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,64 @@
+"""
+Tests for token-budgeted chat history compaction
+"""
+import pytest
+import sys
+import os
+
+# Add the api directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+import chat_history
+from chat_history import HistoryCompactor, estimate_tokens
+
+def conversation(turns: int):
+    messages = []
+    for i in range(turns):
+        messages.append(("user", f"Message numéro {i}. Mon amende date du {i + 1} mars et le PV porte le numéro {1000 + i}."))
+        messages.append(("assistant", f"Réponse {i}. " + "Voici des explications détaillées. " * 10))
+    return messages
+
+def test_prompt_size_stays_bounded():
+    """History size is bounded whatever the conversation length"""
+    compactor = HistoryCompactor(token_budget=300, summary_budget=120)
+    sizes = []
+    for turns in (5, 50, 200):
+        summary, recent = compactor.build(conversation(turns))
+        total = estimate_tokens(summary or "") + sum(estimate_tokens(m["content"]) for m in recent)
+        sizes.append(total)
+    assert max(sizes) <= 300 + 120 + 10
+
+def test_recent_turns_verbatim_and_older_summarized():
+    """The latest turns are kept as-is, older user facts survive in the summary"""
+    compactor = HistoryCompactor(token_budget=200, summary_budget=200)
+    messages = conversation(6)
+    summary, recent = compactor.build(messages)
+
+    assert recent[-1] == {"role": messages[-1][0], "content": messages[-1][1]}
+    assert summary.startswith(chat_history.SUMMARY_HEADER)
+    assert "PV porte le numéro 1000" in summary
+
+def test_single_long_message_is_truncated():
+    """One oversized message cannot blow the budget"""
+    compactor = HistoryCompactor(token_budget=200, message_cap=100)
+    long_text = "Début du récit. " + "x" * 20000 + " Fin du récit."
+    summary, recent = compactor.build([("user", long_text)])
+    assert summary is None
+    assert estimate_tokens(recent[0]["content"]) <= 110
+    assert recent[0]["content"].startswith("Début du récit.")
+    assert recent[0]["content"].endswith("Fin du récit.")
+
+def test_summary_extends_from_cached_prefix(monkeypatch):
+    """A new turn only summarizes the messages that left the verbatim window"""
+    compactor = HistoryCompactor(token_budget=150, summary_budget=400)
+    messages = conversation(10)
+    compactor.build(messages)
+
+    summarized = []
+    original = chat_history.summarize_turn
+    monkeypatch.setattr(chat_history, "summarize_turn", lambda role, content: summarized.append(content) or original(role, content))
+    compactor.build(conversation(11))
+    assert len(summarized) == 2
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,118 @@
+"""
+Tests for concurrent legal enrichment of chat answers
+"""
+import pytest
+import sys
+import os
+import time
+import asyncio
+from types import SimpleNamespace
+
+# Add the api directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from fastapi.testclient import TestClient
+import main
+import chat
+from legal.models import LegalCitation
+
+client = TestClient(main.app)
+
+CITATION = LegalCitation(
+    title="Article L. 1232-1 du Code du travail",
+    source="Légifrance",
+    date="01/03/2024",
+    url="https://www.legifrance.gouv.fr/",
+    type="Code"
+)
+
+class SlowCompletions:
+    def __init__(self, delay):
+        self.delay = delay
+
+    def create(self, **kwargs):
+        time.sleep(self.delay)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="Voici vos droits."))])
+
+@pytest.fixture
+def llm(monkeypatch):
+    monkeypatch.setattr(chat, "openai_client", SimpleNamespace(chat=SimpleNamespace(completions=SlowCompletions(0.2))))
+
+def fake_search(delay, calls=None):
+    async def find(question, limit=2, since_months=12):
+        if calls is not None:
+            calls.append(time.monotonic())
+        await asyncio.sleep(delay)
+        return [CITATION]
+    return find
+
+def test_citations_merged_within_budget(monkeypatch, llm):
+    """Retrieval runs alongside the LLM call and its citations are appended"""
+    calls = []
+    monkeypatch.setattr(chat, "find_legal_citations", fake_search(0.1, calls))
+    started = time.monotonic()
+    response = client.post("/chat", json={"message": "Quel article du code du travail protège contre le licenciement ?"})
+    elapsed = time.monotonic() - started
+
+    answer = response.json()["answer"]
+    assert answer.startswith("Voici vos droits.")
+    assert "Références juridiques récentes" in answer
+    assert "Article L. 1232-1" in answer
+    # Started before the LLM answered: no serial latency
+    assert calls[0] - started < 0.15
+    assert elapsed < 0.25 + 0.15
+
+def test_late_citations_dropped(monkeypatch, llm):
+    """Retrieval slower than the budget does not delay the answer"""
+    monkeypatch.setattr(chat, "LEGAL_ENRICHMENT_BUDGET", 0.3)
+    monkeypatch.setattr(chat, "find_legal_citations", fake_search(5))
+    started = time.monotonic()
+    response = client.post("/chat", json={"message": "Que dit la loi sur les amendes ?"})
+    assert time.monotonic() - started < 1
+    assert "Références juridiques" not in response.json()["answer"]
+
+def test_no_retrieval_for_non_legal_message(monkeypatch, llm):
+    """Messages without legal keywords skip retrieval"""
+    calls = []
+    monkeypatch.setattr(chat, "find_legal_citations", fake_search(0, calls))
+    client.post("/chat", json={"message": "Bonjour, pouvez-vous m'aider ?"})
+    assert calls == []
+
+@pytest.mark.parametrize("message", ["Je cherche un emploi", "À quel endroit déposer mon dossier ?", "Quel est mon code postal ?"])
+def test_no_retrieval_for_words_containing_legal_keywords(monkeypatch, llm, message):
+    """Legal keywords only count as whole words ("emploi" contains "loi")"""
+    calls = []
+    monkeypatch.setattr(chat, "find_legal_citations", fake_search(0, calls))
+    client.post("/chat", json={"message": message})
+    assert calls == []
+
+def test_dropped_retrieval_keeps_admission_slot(monkeypatch):
+    """A search over the budget holds its slot until its worker thread returns"""
+    async def blocking_search(question, limit=2, since_months=12):
+        await asyncio.to_thread(time.sleep, 0.3)
+        return [CITATION]
+    monkeypatch.setattr(chat, "find_legal_citations", blocking_search)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        task = chat.start_legal_enrichment("Que dit la loi ?")
+        enrichment = await chat.collect_legal_enrichment(task, loop.time() + 0.05)
+        await asyncio.sleep(0.05)
+        held = chat.legal_admission.in_flight
+        await asyncio.sleep(0.4)
+        return enrichment, held, chat.legal_admission.in_flight
+
+    enrichment, held, released = asyncio.run(run())
+    assert enrichment == ""
+    assert (held, released) == (1, 0)
+
+def test_failed_retrieval_keeps_answer(monkeypatch, llm):
+    """A retrieval error leaves the answer untouched"""
+    async def broken(question, limit=2, since_months=12):
+        raise RuntimeError("index unavailable")
+    monkeypatch.setattr(chat, "find_legal_citations", broken)
+    response = client.post("/chat", json={"message": "Quel est mon droit ?"})
+    assert response.json()["answer"] == "Voici vos droits."
+
+if __name__ == "__main__":
+    pytest.main([__file__])
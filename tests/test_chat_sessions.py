@@ -0,0 +1,154 @@
+"""
+Tests for server-side chat sessions
+"""
+import pytest
+import sys
+import os
+import time
+import json
+import threading
+from types import SimpleNamespace
+
+# Add the api directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from fastapi.testclient import TestClient
+import main
+import chat
+import chat_sessions
+from chat_sessions import SessionStore, ChatSession
+
+client = TestClient(main.app)
+
+class RecordingCompletions:
+    def __init__(self):
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"Réponse {len(self.calls)}"))])
+
+@pytest.fixture
+def store(monkeypatch):
+    store = SessionStore()
+    monkeypatch.setattr(chat, "session_store", store)
+    return store
+
+def test_client_sends_only_new_message(monkeypatch, store):
+    """Follow-up turns only carry the new message, the history is rebuilt server-side"""
+    completions = RecordingCompletions()
+    monkeypatch.setattr(chat, "openai_client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+    first = client.post("/chat", json={"tool_id": "amendes", "message": "J'ai reçu une amende de stationnement injuste"})
+    conversation_id = first.json()["conversation_id"]
+    assert conversation_id
+
+    second = client.post("/chat", json={"conversation_id": conversation_id, "message": "Que dois-je faire ?"})
+    assert second.json()["conversation_id"] == conversation_id
+    # Tool and analysis carried over from the first turn
+    assert second.json()["suggested_fields"] == {"type_amende": "stationnement"}
+
+    sent = [m["content"] for m in completions.calls[1]["messages"] if m["role"] != "system"]
+    assert sent[0] == "J'ai reçu une amende de stationnement injuste"
+    assert sent[1].startswith("Réponse 1")
+    assert sent[2] == "Que dois-je faire ?"
+    # Anger detected on turn one still shapes the system prompt
+    assert "en colère" in completions.calls[1]["messages"][0]["content"]
+
+@pytest.mark.parametrize("path", ["/chat", "/chat/stream"])
+def test_unknown_conversation_asks_for_history(store, path):
+    """An expired or unknown id is reported, so the client can resend the history"""
+    response = client.post(path, json={"conversation_id": "inconnu", "message": "Bonjour"})
+    assert response.status_code == 409
+    assert response.json()["detail"]["code"] == "session_expired"
+
+    resent = client.post(path, json={
+        "conversation_id": "inconnu",
+        "messages": [{"role": "user", "content": "Bonjour"}, {"role": "assistant", "content": "Bonjour !"}, {"role": "user", "content": "Encore"}]
+    })
+    assert resent.status_code == 200
+
+def test_full_history_still_accepted(store):
+    """Clients sending the whole conversation keep working"""
+    response = client.post("/chat", json={"messages": [{"role": "user", "content": "Bonjour"}]})
+    assert response.status_code == 200
+    session = store.get(response.json()["conversation_id"])
+    assert [m["role"] for m in session.messages] == ["user", "assistant"]
+
+def test_failed_turn_not_recorded(monkeypatch, store):
+    """A turn that fails is not kept in the session"""
+    session = ChatSession("abc")
+    session.append("user", "Bonjour")
+    store.save(session)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(chat, "get_enhanced_chat_response", fail)
+    client.post("/chat", json={"conversation_id": "abc", "message": "Encore"})
+    assert len(store.get("abc").messages) == 1
+
+def test_lru_and_ttl_eviction():
+    """Least recently used sessions are evicted and idle ones expire"""
+    store = SessionStore(max_sessions=2, ttl_seconds=60)
+    for conversation_id in ("a", "b"):
+        store.save(ChatSession(conversation_id))
+    store.get("a")
+    store.save(ChatSession("c"))
+    assert store.get("b") is None
+    assert store.get("a") is not None
+
+    store.get("a").updated_at = time.time() - 120
+    assert store.get("a") is None
+
+def test_sqlite_tier_survives_restart(tmp_path):
+    """Sessions are reloaded from SQLite by a fresh store"""
+    db_path = str(tmp_path / "sessions.db")
+    session = ChatSession("persist", tool_id="caf", form_values={"nom": "Dupont"})
+    session.append("user", "Ma CAF a suspendu mes APL")
+    SessionStore(db_path=db_path).save(session)
+
+    reloaded = SessionStore(db_path=db_path).get("persist")
+    assert reloaded.tool_id == "caf"
+    assert reloaded.form_values == {"nom": "Dupont"}
+    assert reloaded.messages == [{"role": "user", "content": "Ma CAF a suspendu mes APL"}]
+
+def test_sqlite_io_off_the_event_loop(monkeypatch, tmp_path):
+    """The chat handlers read and write the SQLite tier from worker threads"""
+    store = SessionStore(db_path=str(tmp_path / "sessions.db"))
+    monkeypatch.setattr(chat, "session_store", store)
+    store.save(ChatSession("persist"))
+    store._sessions.clear()
+    loop_thread = threading.get_ident()
+    threads = []
+    for name in ("_load", "_write"):
+        original = getattr(store, name)
+        def record(*args, original=original):
+            threads.append(threading.get_ident())
+            return original(*args)
+        monkeypatch.setattr(store, name, record)
+
+    response = client.post("/chat", json={"conversation_id": "persist", "message": "Bonjour"})
+    assert response.status_code == 200
+    assert len(threads) == 2
+    assert loop_thread not in threads
+    assert len(SessionStore(db_path=store.db_path).get("persist").messages) == 2
+
+def test_stale_write_does_not_overwrite(tmp_path):
+    """A write landing late from a worker thread keeps the newer turn"""
+    store = SessionStore(db_path=str(tmp_path / "sessions.db"))
+    now = time.time()
+    store._write("abc", json.dumps(ChatSession("abc", messages=[{"role": "user", "content": "Récent"}], updated_at=now).to_dict()), now)
+    store._write("abc", json.dumps(ChatSession("abc", updated_at=now - 1).to_dict()), now - 1)
+    assert store._load("abc").messages == [{"role": "user", "content": "Récent"}]
+
+def test_old_turns_folded_into_summary(monkeypatch):
+    """Sessions keep a bounded number of verbatim turns"""
+    monkeypatch.setattr(chat_sessions, "MAX_SESSION_MESSAGES", 4)
+    session = ChatSession("long")
+    for i in range(6):
+        session.append("user", f"Message {i}.")
+    assert [m["content"] for m in session.messages] == ["Message 2.", "Message 3.", "Message 4.", "Message 5."]
+    assert session.summary == ["- Utilisateur : Message 0.", "- Utilisateur : Message 1."]
+
+if __name__ == "__main__":
+    pytest.main([__file__])
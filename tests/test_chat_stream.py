@@ -0,0 +1,168 @@
+"""
+Tests for the /chat/stream SSE endpoint
+"""
+import pytest
+import sys
+import os
+import json
+import time
+import asyncio
+from types import SimpleNamespace
+
+# Add the api directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from fastapi.testclient import TestClient
+import main
+import chat
+from response_cache import SemanticCache
+
+client = TestClient(main.app)
+
+def parse_events(body: str):
+    """Parse an SSE body into (event, data) pairs"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+class StreamingCompletions:
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        return iter(
+            SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+            for delta in self.deltas
+        )
+
+def test_stream_tokens_then_final_events(monkeypatch):
+    """Tokens arrive first, the footer and suggested fields as final events"""
+    completions = StreamingCompletions(["Vous pouvez ", None, "contester ", "cette amende."])
+    monkeypatch.setattr(chat, "openai_client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+    response = client.post("/chat/stream", json={
+        "tool_id": "amendes",
+        "messages": [{"role": "user", "content": "Amende de stationnement injuste, c'est scandaleux"}]
+    })
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert completions.calls[0]["stream"] is True
+
+    events = parse_events(response.text)
+    names = [name for name, _ in events]
+    assert names == ["token", "token", "token", "footer", "suggested_fields", "done"]
+
+    tokens = "".join(data["delta"] for name, data in events if name == "token")
+    assert tokens == "Vous pouvez contester cette amende."
+    assert "Votre colère est légitime" in events[3][1]["delta"]
+    assert events[4][1] == {"type_amende": "stationnement"}
+    assert events[5][1]["answer"].startswith(tokens)
+
+class FunctionStreamCompletions:
+    """Streams the forced function call's arguments in small pieces"""
+    def __init__(self, arguments, size):
+        self.pieces = [arguments[i:i + size] for i in range(0, len(arguments), size)]
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        return iter(
+            SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None, tool_calls=[
+                SimpleNamespace(index=0, function=SimpleNamespace(arguments=piece))
+            ]))])
+            for piece in self.pieces
+        )
+
+@pytest.mark.parametrize("size", [1, 5, 1000])
+def test_stream_structured_answer_and_fields(monkeypatch, size):
+    """With a tool, the answer argument streams as tokens and the model's fields come last"""
+    answer = "Vous pouvez \"contester\" :\n1. écrire 💪"
+    arguments = json.dumps({
+        "answer": answer,
+        "fields": {"motif_contestation": "Panneau masqué", "type_amende": "Vitesse"}
+    })
+    completions = FunctionStreamCompletions(arguments, size)
+    monkeypatch.setattr(chat, "openai_client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    monkeypatch.setattr(chat, "chat_cache", SemanticCache())
+
+    response = client.post("/chat/stream", json={
+        "tool_id": "amendes",
+        "messages": [{"role": "user", "content": "Amende de stationnement, le panneau était caché"}]
+    })
+    assert completions.calls[0]["tool_choice"]["function"]["name"] == chat.ANSWER_FUNCTION
+
+    events = parse_events(response.text)
+    assert "".join(data["delta"] for name, data in events if name == "token") == answer
+    # The model's fields, with values found verbatim in the messages winning
+    assert dict(events)["suggested_fields"] == {"motif_contestation": "Panneau masqué", "type_amende": "stationnement"}
+    assert dict(events)["done"]["answer"] == answer
+
+class SlowStream:
+    """Upstream stream yielding a delta every 50 ms, recording when it is closed"""
+    def __init__(self):
+        self.read = 0
+        self.closed = False
+
+    def __iter__(self):
+        for _ in range(40):
+            time.sleep(0.05)
+            self.read += 1
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="mot "))])
+
+    def close(self):
+        self.closed = True
+
+def test_disconnect_stops_upstream_and_holds_slot(monkeypatch):
+    """A consumer leaving stops the producer thread, which keeps its admission slot until it returns"""
+    stream = SlowStream()
+    completions = SimpleNamespace(create=lambda **kwargs: stream)
+    monkeypatch.setattr(chat, "openai_client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+    async def run():
+        deltas = chat.stream_completion([{"role": "user", "content": "Bonjour"}])
+        await deltas.__anext__()
+        await deltas.aclose()
+        held = chat.chat_admission.in_flight
+        await asyncio.sleep(0.2)
+        return held, chat.chat_admission.in_flight
+
+    held, released = asyncio.run(run())
+    assert (held, released) == (1, 0)
+    assert stream.closed
+    assert stream.read < 5
+
+@pytest.mark.parametrize("error, status", [
+    (RuntimeError("upstream error"), 500),
+    (chat.Overloaded("chat", 12.0, 5), 503)
+])
+def test_stream_error_carries_status(monkeypatch, error, status):
+    """Errors after the stream started carry the status the client should act on"""
+    def fail(**kwargs):
+        raise error
+    monkeypatch.setattr(chat, "openai_client", SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=fail))))
+    monkeypatch.setattr(chat, "chat_cache", SemanticCache())
+
+    response = client.post("/chat/stream", json={"messages": [{"role": "user", "content": "Bonjour"}]})
+    assert response.status_code == 200
+    name, data = parse_events(response.text)[-1]
+    assert name == "error" and data["status"] == status
+
+def test_stream_without_openai():
+    """Without a key the fallback answer is streamed as a single token"""
+    response = client.post("/chat/stream", json={
+        "messages": [{"role": "user", "content": "Bonjour"}]
+    })
+    events = parse_events(response.text)
+    assert [name for name, _ in events] == ["token", "suggested_fields", "done"]
+    assert events[-1][1]["answer"] == chat.OPENAI_UNAVAILABLE_ANSWER
+
+def test_stream_rejects_empty_messages():
+    """An empty conversation is refused before streaming"""
+    assert client.post("/chat/stream", json={"messages": []}).status_code == 400
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,102 @@
+"""
+Tests for the single structured completion returning the answer and form fields
+"""
+import pytest
+import sys
+import os
+import json
+from types import SimpleNamespace
+
+# Add the api directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from fastapi.testclient import TestClient
+import main
+import chat
+from chat_sessions import SessionStore
+from response_cache import SemanticCache
+
+client = TestClient(main.app)
+
+class FunctionCompletions:
+    def __init__(self, arguments):
+        self.arguments = arguments
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        call = SimpleNamespace(function=SimpleNamespace(name=chat.ANSWER_FUNCTION, arguments=self.arguments))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=None, tool_calls=[call]))])
+
+@pytest.fixture
+def llm(monkeypatch):
+    def install(arguments):
+        completions = FunctionCompletions(arguments)
+        monkeypatch.setattr(chat, "openai_client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+        return completions
+    monkeypatch.setattr(chat, "session_store", SessionStore())
+    monkeypatch.setattr(chat, "chat_cache", SemanticCache())
+    return install
+
+def test_one_call_returns_answer_and_fields(llm):
+    """Answer and validated fields come from the same completion"""
+    completions = llm(json.dumps({
+        "answer": "Vous pouvez contester cette amende.",
+        "fields": {
+            "motif_contestation": "Panneau de stationnement masqué par un arbre",
+            "type_amende": "Stationnement",
+            "numero_process_verbal": 12345678
+        }
+    }))
+    response = client.post("/chat", json={"tool_id": "amendes", "message": "Amende de stationnement le 12/03/2024, le panneau était caché"})
+
+    assert len(completions.calls) == 1
+    assert response.json()["answer"].startswith("Vous pouvez contester cette amende.")
+    assert response.json()["suggested_fields"] == {
+        "motif_contestation": "Panneau de stationnement masqué par un arbre",
+        "type_amende": "stationnement",
+        "numero_process_verbal": "12345678",
+        "date_infraction": "12/03/2024"
+    }
+
+def test_function_parameters_follow_the_schema(llm):
+    completions = llm(json.dumps({"answer": "D'accord.", "fields": {}}))
+    client.post("/chat", json={"tool_id": "loyers", "message": "Mon loyer me paraît trop élevé"})
+
+    function = completions.calls[0]["tools"][0]["function"]
+    assert completions.calls[0]["tool_choice"]["function"]["name"] == function["name"]
+    fields = function["parameters"]["properties"]["fields"]["properties"]
+    assert fields["epoque_construction"]["enum"] == ["Avant 1946", "1946-1970", "1971-1990", "Après 1990"]
+    assert fields["meuble"]["type"] == "boolean"
+    # Nested objects are not suggested
+    assert "identite" not in fields
+
+def test_invalid_model_values_are_dropped(llm):
+    """Values outside the schema never reach the form"""
+    llm(json.dumps({
+        "answer": "Je vois.",
+        "fields": {"type_probleme": "loyer_trop_cher", "nombre_pieces": "deux", "surface_m2": "45 m²", "inconnu": "x"}
+    }))
+    response = client.post("/chat", json={"tool_id": "travail", "message": "Problème avec mon patron"})
+    assert response.json()["suggested_fields"] is None
+    response = client.post("/chat", json={"tool_id": "loyers", "message": "Problème avec mon bailleur"})
+    assert response.json()["suggested_fields"] == {"surface_m2": 45}
+
+def test_local_values_win_over_the_model(llm):
+    """Values found verbatim in the messages override the model's reading"""
+    llm(json.dumps({"answer": "Très bien.", "fields": {"loyer_actuel": 1000, "bailleur": "SCI Dupont"}}))
+    response = client.post("/chat", json={"tool_id": "loyers", "message": "Mon loyer est de 1 150 €"})
+    assert response.json()["suggested_fields"] == {"loyer_actuel": 1150, "bailleur": "SCI Dupont"}
+
+def test_plain_mode_without_tool(llm):
+    """Without a tool in context the completion is not structured"""
+    completions = llm(json.dumps({"answer": "unused", "fields": {}}))
+    completions.create = lambda **kwargs: completions.calls.append(kwargs) or SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="Bonjour !"))]
+    )
+    response = client.post("/chat", json={"message": "Bonjour"})
+    assert "tools" not in completions.calls[0]
+    assert response.json()["answer"] == "Bonjour !"
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,126 @@
+"""
+Tests for the local rent-cap reference index
+"""
+import pytest
+import sys
+import os
+import json
+from types import SimpleNamespace
+
+# Add the api directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from fastapi.testclient import TestClient
+import encadrement
+import main
+import prompting
+from encadrement import RentReferenceIndex
+
+PARIS_CSV = """id_zone;id_quartier;nom_quartier;piece;epoque;meuble_txt;ref;max;min;annee;ville
+1;41;Folie-Méricourt;2;1946-1970;non meublé;27,1;32,52;18,97;2023;PARIS
+1;41;Folie-Méricourt;2;1946-1970;non meublé;28,3;33,96;19,81;2024;PARIS
+1;41;Folie-Méricourt;2;1946-1970;meublé;31,4;37,68;21,98;2024;PARIS
+1;41;Folie-Méricourt;4;Apres 1990;non meublé;24,0;28,8;16,8;2024;PARIS
+"""
+
+LILLE_CSV = """zone,pieces,epoque,meuble,reference,ref_majore,ref_minore
+Lille,1,Avant 1946,Non meublé,"17,2","20,64","12,04"
+"""
+
+@pytest.fixture
+def index(tmp_path):
+    paris = tmp_path / "paris.csv"
+    paris.write_text(PARIS_CSV, encoding="utf-8")
+    lille = tmp_path / "lille.csv"
+    lille.write_text(LILLE_CSV, encoding="utf-8")
+    return RentReferenceIndex.build([str(paris), str(lille)], str(tmp_path / "encadrement"))
+
+def test_lookup_exact_cell(index):
+    """Lookups are accent-insensitive and keep the most recent year"""
+    cap = index.lookup("folie-mericourt", 2, "1946-1970", False)
+    assert cap is not None
+    assert cap.reference == 28.3
+    assert cap.majore == 33.96
+    assert cap.annee == 2024
+
+    assert index.lookup("Folie-Méricourt", "2", "1955", "meublé").majore == 37.68
+    assert index.lookup("Folie-Méricourt", 6, "Après 1990", "non").reference == 24.0
+    assert index.lookup("Folie-Méricourt", 3, "1946-1970", False) is None
+    assert index.lookup("Inconnue", 2, "1946-1970", False) is None
+
+def test_index_is_memory_mapped(index):
+    """The built index is read back as a memory map"""
+    import numpy as np
+    assert isinstance(index.records, np.memmap)
+    assert len(index.records) == 4
+
+def test_zone_resolved_from_address(index):
+    """Without an explicit zone, the commune of the address is used"""
+    fields = {
+        "adresse_logement": "12 rue Nationale, 59000 Lille",
+        "nombre_pieces": 1,
+        "epoque_construction": "Avant 1946",
+        "meuble": False
+    }
+    cap = index.lookup_fields(fields)
+    assert cap is not None
+    assert cap.reference == 17.2
+
+def test_figures_injected_into_loyers_prompt(index, monkeypatch):
+    """The loyers context and checklist carry the exact cap figures"""
+    monkeypatch.setattr(encadrement, "_index", index)
+    monkeypatch.setattr(encadrement, "_index_loaded", True)
+
+    fields = {
+        "zone_encadrement": "Folie-Méricourt",
+        "nombre_pieces": 2,
+        "epoque_construction": "1946-1970",
+        "meuble": False,
+        "surface_m2": 40,
+        "loyer_actuel": 1500
+    }
+    prompt = prompting.build_prompt("loyers", fields)
+    assert "33.96 €/m²" in prompt["context"]
+    assert "Loyer maximum autorisé pour 40 m² : 1358.40 €" in prompt["context"]
+    assert "Dépassement du plafond : 141.60 €" in prompt["context"]
+
+    prefilled = encadrement.prefill_loyer_reference(fields)
+    assert prefilled["loyer_reference"] == 1358.4
+    assert "loyer_reference" not in fields
+
+# One answer that fits every generation mode's prompt
+LETTRE = {"destinataire_bloc": "M. Bailleur", "objet": "Loyer", "corps": "A\n\nB\n\nC\n\nD", "pj": ["Bail"], "signature": "M. Martin"}
+MODEL_OUTPUT = {
+    "resume": ["Vérifier le bail"], "lettre": LETTRE, "checklist": ["Envoyer en recommandé"], "mentions": "Info",
+    **{key: LETTRE[key] for key in ("destinataire_bloc", "objet", "corps", "pj")}
+}
+
+@pytest.mark.parametrize("mode", ["full", "blueprint", "sectioned"])
+def test_cap_items_lead_the_checklist_in_every_mode(index, monkeypatch, mode):
+    """The figures reach the generated checklist whichever mode wrote the document"""
+    monkeypatch.setattr(encadrement, "_index", index)
+    monkeypatch.setattr(encadrement, "_index_loaded", True)
+    monkeypatch.setattr(main, "GENERATION_MODE", mode)
+    answer = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(MODEL_OUTPUT)))])
+    completions = SimpleNamespace(create=lambda **kwargs: answer)
+    monkeypatch.setattr(main, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+    fields = {
+        "zone_encadrement": "Folie-Méricourt",
+        "nombre_pieces": 2,
+        "epoque_construction": "1946-1970",
+        "meuble": False,
+        "surface_m2": "40",
+        "loyer_actuel": "1.500,00 €"
+    }
+    checklist = TestClient(main.app).post("/generate", json={"tool_id": "loyers", "fields": fields}).json()["checklist"]
+    assert checklist[0].startswith("Vérifier le plafond de 33.96 €/m²")
+    assert "141.60 €" in checklist[1]
+    assert len([item for item in checklist if "33.96" in item]) == 1
+
+def test_french_numbers_in_fields():
+    """Thousands separators and decimal commas are read the French way"""
+    assert [encadrement.parse_number(text) for text in ["1.200,50", "1 200,50 €", "32,52", "33.96", 12, "", "n/a"]] == [1200.5, 1200.5, 32.52, 33.96, 12.0, None, None]
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,129 @@
+"""
+Tests for schema-driven field extraction from chat messages
+"""
+import pytest
+import sys
+import os
+from types import SimpleNamespace
+
+# Add the api directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from fastapi.testclient import TestClient
+import main
+import chat
+from chat_sessions import SessionStore
+from response_cache import SemanticCache
+from extraction import FieldExtractor, field_extractor, load_schemas, merge_fields, parse_number, parse_date
+
+client = TestClient(main.app)
+
+def test_every_tool_is_covered():
+    assert sorted(field_extractor.tools) == sorted(load_schemas())
+    assert len(field_extractor.tools) == 12
+
+def test_values_are_schema_valid():
+    """Enum values come from the schemas, whatever the synonyms"""
+    schemas = load_schemas()
+    extracted = field_extractor.extract(
+        "J'ai été licencié, je suis en intérim, au chômage, sans mutuelle, la CAF me réclame un indu, "
+        "mon fils est au collège et victime de harcèlement, crédit renouvelable, coupure de courant"
+    )
+    assert extracted["travail"] == {"type_probleme": "licenciement_abusif", "type_contrat": "Interim"}
+    for tool_id, values in extracted.items():
+        for field, value in values.items():
+            enum = schemas[tool_id]["properties"][field].get("enum")
+            if enum:
+                assert value in enum, (tool_id, field, value)
+
+def test_synonym_priorities_and_whole_words():
+    """Curated order breaks ties, and short values only match whole words"""
+    assert field_extractor.extract("Location non meublée")["loyers"] == {"meuble": False}
+    assert field_extractor.extract("Location meublée")["loyers"] == {"meuble": True}
+    assert field_extractor.extract("Je n'ai pas de mutuelle")["sante"] == {"couverture": "aucune"}
+    # "marche" is not the "marche" (offre de marché) contract type
+    assert "energie" not in field_extractor.extract("Le compteur ne marche plus")
+
+def test_typed_values():
+    extracted = field_extractor.extract(
+        "Amende de stationnement reçue le 12 mars 2024 au 3 rue de la Paix, 75002 Paris"
+    )
+    assert extracted["amendes"] == {
+        "type_amende": "stationnement",
+        "date_infraction": "12/03/2024",
+        "lieu": "3 rue de la Paix, 75002 Paris"
+    }
+    assert extracted["sante"] == {"ville": "Paris"}
+
+def test_amounts_go_to_the_announced_field():
+    """Several amount fields: the words before the amount decide, and an amount alone fills nothing"""
+    extracted = field_extractor.extract(
+        "Mon loyer est de 1 200 € alors que le loyer de référence est de 950,50 euros, T3 de 45 m², immeuble de 1965"
+    )
+    assert extracted["loyers"] == {
+        "loyer_actuel": 1200,
+        "loyer_reference": 950.5,
+        "nombre_pieces": 3,
+        "surface_m2": 45,
+        "epoque_construction": "1946-1970"
+    }
+    assert "aides" not in extracted
+    assert field_extractor.extract("Ça m'a coûté 35 €") == {}
+
+def test_caf_text_fields():
+    extracted = field_extractor.extract("Mon numéro d'allocataire est le 1234567, la CAF réclame un trop perçu de 450 €")
+    assert extracted["caf"] == {"type_courrier": "indu", "numero_allocataire": "1234567", "montant": "450 €"}
+
+def test_invalid_dates_are_skipped():
+    assert parse_date("31/02/2024") is None
+    assert parse_date("1er avril 2024") == "01/04/2024"
+    assert parse_date("05/06/24") == "05/06/2024"
+
+def test_french_numbers():
+    assert [parse_number(text) for text in ["1 200", "1.250,30", "1.200", "12,5"]] == [1200, 1250.3, 1200, 12.5]
+
+def test_synonyms_for_unknown_values_are_ignored():
+    schemas = {"amendes": {"properties": {"type_amende": {"type": "string", "enum": ["stationnement", "autre"]}}}}
+    extractor = FieldExtractor(schemas, {"amendes": {"type_amende": {"transports": ["bus"]}}})
+    assert extractor.extract("Amende dans le bus") == {}
+    assert extractor.extract("Amende de stationnement") == {"amendes": {"type_amende": "stationnement"}}
+
+def test_newer_values_win():
+    merged = merge_fields({"caf": {"montant": "450 €", "type_courrier": "indu"}}, {"caf": {"montant": "500 €"}})
+    assert merged == {"caf": {"montant": "500 €", "type_courrier": "indu"}}
+
+def test_chat_suggests_fields_for_any_tool(monkeypatch):
+    """Values accumulate across the turns of a conversation"""
+    answer = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="D'accord."))])
+    completions = SimpleNamespace(create=lambda **kwargs: answer)
+    monkeypatch.setattr(chat, "openai_client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    monkeypatch.setattr(chat, "session_store", SessionStore())
+    monkeypatch.setattr(chat, "chat_cache", SemanticCache())
+
+    first = client.post("/chat", json={"tool_id": "usure", "message": "On me propose un crédit renouvelable à 22,5 %"})
+    assert first.json()["suggested_fields"] == {"type_credit": "renouvelable", "taux_propose": 22.5}
+    second = client.post("/chat", json={
+        "conversation_id": first.json()["conversation_id"],
+        "message": "Le prêt est de 3 000 €, offre reçue le 02/05/2024"
+    })
+    assert second.json()["suggested_fields"] == {
+        "type_credit": "renouvelable",
+        "taux_propose": 22.5,
+        "montant_emprunte": 3000,
+        "date_offre": "02/05/2024"
+    }
+
+def test_cached_answer_keeps_own_fields(monkeypatch):
+    """A cached answer does not carry the field values of the conversation it came from"""
+    answer = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="Voici la marche à suivre."))])
+    completions = SimpleNamespace(create=lambda **kwargs: answer)
+    monkeypatch.setattr(chat, "openai_client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    cache = SemanticCache(threshold=0.5)
+    monkeypatch.setattr(chat, "chat_cache", cache)
+    client.post("/chat", json={"tool_id": "amendes", "message": "Comment contester mon amende de stationnement ?"})
+    second = client.post("/chat", json={"tool_id": "amendes", "message": "Comment contester mon amende de radar ?"})
+    assert cache.hits == 1
+    assert second.json()["suggested_fields"]["type_amende"] == "vitesse"
+
+if __name__ == "__main__":
+    pytest.main([__file__])
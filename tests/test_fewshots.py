@@ -0,0 +1,54 @@
+"""
+Tests for retrieval-based few-shot selection
+"""
+import pytest
+import sys
+import os
+
+# Add the api directory to Python path
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api')
+sys.path.insert(0, API_DIR)
+
+import prompting
+
+@pytest.fixture(autouse=True)
+def api_cwd(monkeypatch):
+    """Few-shot files are resolved relative to the api directory"""
+    monkeypatch.chdir(API_DIR)
+    prompting._fewshot_index.clear()
+
+def test_fewshot_files_split_into_examples():
+    """Each "## Exemple" section becomes one indexed example"""
+    assert prompting.index_fewshots() == 4
+    examples = prompting.get_fewshot_examples("amendes")
+    assert [example.title for example in examples] == [
+        "Exemple 1: Feu rouge masqué par travaux",
+        "Exemple 2: Stationnement contesté"
+    ]
+    assert examples[0].input_fields["numero_process_verbal"] == "12345678"
+
+def test_most_similar_example_is_selected():
+    """Only the example closest to the submitted fields is injected"""
+    parking = prompting.select_fewshots("amendes", {
+        "type_amende": "stationnement",
+        "motif_contestation": "Ticket de stationnement valide posé sur le tableau de bord"
+    })
+    assert "Stationnement contesté" in parking
+    assert "Feu rouge masqué" not in parking
+
+    red_light = prompting.select_fewshots("amendes", {
+        "type_amende": "autre",
+        "motif_contestation": "Feu masque par des travaux"
+    })
+    assert "Feu rouge masqué" in red_light
+    assert "Stationnement contesté" not in red_light
+
+def test_letter_only_examples_drop_other_sections():
+    """In letter-only mode the examples show only the lettre output"""
+    text = prompting.select_fewshots("caf", {"motif": "indu RSA"}, letter_only=True)
+    assert '"lettre"' in text
+    assert '"checklist"' not in text
+    assert prompting.select_fewshots("energie", {"motif": "coupure"}) == ""
+
+if __name__ == "__main__":
+    pytest.main([__file__])
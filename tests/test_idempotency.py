@@ -0,0 +1,104 @@
+"""
+Tests for Idempotency-Key handling
+"""
+import pytest
+import sys
+import os
+import asyncio
+
+# Add the api directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from fastapi.testclient import TestClient
+import main
+from idempotency import IdempotencyStore, IdempotencyConflict
+
+client = TestClient(main.app)
+
+PAYLOAD = {
+    "tool_id": "amendes",
+    "fields": {"motif_contestation": "Erreur de lieu"}
+}
+
+def test_concurrent_retries_share_one_execution():
+    """Concurrent calls with the same key run the function once"""
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"ok": len(calls)}
+
+    async def scenario():
+        store = IdempotencyStore(ttl_seconds=60)
+        return await asyncio.gather(*[store.run("k", "fp", work) for _ in range(3)])
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert [r for r, _ in results] == [{"ok": 1}] * 3
+    assert sorted(replayed for _, replayed in results) == [False, True, True]
+
+def test_failures_are_not_cached():
+    """A failed execution is retried on the next call"""
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("upstream timeout")
+        return "done"
+
+    async def scenario():
+        store = IdempotencyStore(ttl_seconds=60)
+        with pytest.raises(RuntimeError):
+            await store.run("k", "fp", flaky)
+        return await store.run("k", "fp", flaky)
+
+    assert asyncio.run(scenario()) == ("done", False)
+    assert len(attempts) == 2
+
+def test_key_reuse_with_other_payload_conflicts():
+    """Reusing a key for a different payload is rejected"""
+    async def work():
+        return "done"
+
+    async def scenario():
+        store = IdempotencyStore(ttl_seconds=60)
+        await store.run("k", "fp-1", work)
+        await store.run("k", "fp-2", work)
+
+    with pytest.raises(IdempotencyConflict):
+        asyncio.run(scenario())
+
+def test_generate_replays_with_same_key(monkeypatch):
+    """/generate only generates once for a repeated Idempotency-Key"""
+    calls = []
+    original = main.run_generation
+
+    async def counting_generation(request):
+        calls.append(request.tool_id)
+        return await original(request)
+
+    monkeypatch.setattr(main, "run_generation", counting_generation)
+    headers = {"Idempotency-Key": "test-generate-replay"}
+
+    first = client.post("/generate", json=PAYLOAD, headers=headers)
+    second = client.post("/generate", json=PAYLOAD, headers=headers)
+
+    assert first.status_code == 200
+    assert second.status_code == 200
+    assert second.json() == first.json()
+    assert second.headers.get("Idempotent-Replayed") == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert len(calls) == 1
+
+def test_generate_key_conflict():
+    """/generate rejects a key reused with another payload"""
+    headers = {"Idempotency-Key": "test-generate-conflict"}
+    assert client.post("/generate", json=PAYLOAD, headers=headers).status_code == 200
+
+    other = {"tool_id": "caf", "fields": {"probleme": "Suspension"}}
+    assert client.post("/generate", json=other, headers=headers).status_code == 422
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,79 @@
+"""
+Tests for the local intent classifier
+"""
+import pytest
+import sys
+import os
+import numpy as np
+
+# Add the api directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from fastapi.testclient import TestClient
+import main
+from intent import IntentClassifier, training_documents, merge_intent
+
+client = TestClient(main.app)
+
+@pytest.fixture(scope="module")
+def model():
+    return IntentClassifier.train(training_documents())
+
+EXAMPLES = {
+    "amendes": "J'ai reçu une amende pour excès de vitesse, radar",
+    "caf": "La CAF me réclame un trop perçu d'APL",
+    "loyers": "Mon propriétaire refuse de baisser le loyer",
+    "travail": "Mon employeur m'a licencié sans motif",
+    "sante": "La sécurité sociale ne rembourse pas mes soins",
+    "energie": "Ma facture d'électricité est énorme, EDF se trompe",
+    "expulsions": "Je vais être expulsé de mon logement",
+    "css": "Je voudrais la complémentaire santé solidaire",
+    "ecole": "Mon fils est harcelé au collège",
+    "decodeur": "Je ne comprends pas ce courrier des impôts",
+    "usure": "Taux d'intérêt abusif sur mon crédit",
+    "aides": "Je voudrais demander la prime d'activité",
+}
+
+def test_covers_all_tools(model):
+    """Every tool is scored"""
+    assert sorted(model.tools) == sorted(EXAMPLES)
+
+def test_routes_each_tool(model):
+    """A typical request is routed to its tool"""
+    for tool_id, text in EXAMPLES.items():
+        assert model.predict(text) == tool_id, text
+
+def test_small_talk_is_not_routed(model):
+    """Messages without a topic stay below the threshold"""
+    assert model.predict("Bonjour") is None
+    assert model.predict("Merci beaucoup pour votre aide") is None
+
+def test_batch_matches_single(model):
+    """Batch scoring gives the same scores as one-by-one scoring"""
+    texts = list(EXAMPLES.values())
+    batch = model.score_batch(texts)
+    assert batch.shape == (len(texts), 12)
+    for row, text in enumerate(texts):
+        assert np.allclose(batch[row], model.score(text), atol=1e-5)
+
+def test_save_and_load(model, tmp_path):
+    """The trained model round-trips through its .npz file"""
+    path = str(tmp_path / "intent_model")
+    model.save(path)
+    loaded = IntentClassifier.load(path)
+    assert loaded.tools == model.tools
+    assert loaded.predict(EXAMPLES["usure"]) == "usure"
+
+def test_merge_intent_favours_recent_messages():
+    """Older messages decay in the rolling scores"""
+    intent = merge_intent(None, np.array([1.0, 0.0]))
+    intent = merge_intent(intent, np.array([0.0, 0.8]))
+    assert intent == [0.5, 0.8]
+
+def test_chat_suggests_tool_without_tool_id():
+    """The chat reports the locally identified tool"""
+    response = client.post("/chat", json={"message": "Ma facture d'électricité EDF est bien trop élevée"})
+    assert response.json()["suggested_tool"] == "energie"
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,69 @@
+"""
+Tests for the compiled keyword matcher used by the chat analysis
+"""
+import pytest
+import sys
+import os
+
+# Add the api directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from keywords import KeywordMatcher, merge_matches, flatten_tables
+import chat
+from chat import ChatMessage
+
+def test_accents_and_case_are_folded():
+    """Keywords match whatever the accents or case of the message"""
+    matcher = KeywordMatcher({"emotions": {"anger": ["révoltant"], "anxiety": ["préoccupé"]}})
+    matches = matcher.scan("C'est REVOLTANT, je suis preoccupée")
+    assert matches == {"emotions": {"anger": ["revoltant"], "anxiety": ["preoccupe"]}}
+
+def test_nested_and_overlapping_keywords():
+    """Substring semantics: nested and overlapping keywords are all reported"""
+    matcher = KeywordMatcher({"x": {"a": ["trop cher"], "b": ["cher"], "c": ["herb"]}})
+    matches = matcher.scan("trop cherbourg")
+    assert matches["x"] == {"a": ["trop cher"], "b": ["cher"], "c": ["herb"]}
+
+def test_first_label_follows_table_order():
+    """Priority between labels is the table order"""
+    matcher = KeywordMatcher({"type": {"vitesse": ["radar"], "stationnement": ["stationnement"]}})
+    matches = matcher.scan("stationnement puis radar")
+    assert matcher.first_label(matches, "type") == "vitesse"
+
+def test_flatten_nested_tables():
+    """Nested tables become dotted categories"""
+    flat = flatten_tables({"fields": {"amendes": {"type_amende": {"vitesse": ["radar"]}}}, "topics": {"caf": ["caf"]}})
+    assert flat == {"fields.amendes.type_amende": {"vitesse": ["radar"]}, "topics": {"caf": ["caf"]}}
+
+def test_incremental_analysis_matches_full_scan():
+    """Merging per-message analyses gives the same context as analysing the whole conversation"""
+    texts = [
+        "Mon employeur veut me licencier, c'est injuste",
+        "Je suis très inquiet, il faut agir vite",
+        "Mon salaire n'est plus versé"
+    ]
+    analysis, intent, fields = None, None, None
+    for text in texts:
+        analysis = chat.merge_analysis(analysis, chat.analyze_message(text))
+        intent = chat.merge_message_intent(intent, text)
+        fields = chat.merge_message_fields(fields, text)
+
+    full = chat.analyze_conversation_context([ChatMessage(role="user", content=t) for t in texts])
+    assert chat.context_from_analysis(analysis, intent, fields) == full
+    assert full["topics"] == ["travail"]
+    assert full["urgency"] == "high"
+    # The latest message wins
+    assert full["fields"]["travail"] == {"type_probleme": "salaire_impaye"}
+
+def test_extract_info_with_accents():
+    """Field values tolerate missing accents"""
+    messages = [ChatMessage(role="user", content="Harcelement de mon manager depuis des mois")]
+    assert chat.extract_info_from_conversation(messages, "travail") == {"type_probleme": "harcelement"}
+    assert chat.extract_info_from_conversation(messages, "decodeur") is None
+
+def test_merge_matches_unions_keywords():
+    merged = merge_matches({"emotions": {"anger": ["injuste"]}}, {"emotions": {"anger": ["colere"], "stress": ["sos"]}})
+    assert merged == {"emotions": {"anger": ["colere", "injuste"], "stress": ["sos"]}}
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,169 @@
+"""
+Tests for batched ingestion embeddings
+"""
+import pytest
+import sys
+import os
+import time
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+
+# Add the api directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from openai import APIConnectionError, AuthenticationError
+from legal import embeddings
+from legal.embeddings import (
+    EmbeddingCache, OpenAIEmbeddings, QueryEmbeddingCache, content_key, embed_texts, make_batches
+)
+from legal.local_embeddings import LocalEmbeddings, embed_text
+
+class FakeEmbeddings:
+    """embeddings.create returning the input lengths, shuffled like an unordered response"""
+    def __init__(self, failures=0, error=None, delay=0.0):
+        self.failures = failures
+        self.error = error
+        self.delay = delay
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def create(self, model, input):
+        with self.lock:
+            self.calls.append(list(input))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            if self.failures:
+                self.failures -= 1
+                raise self.error
+            data = [SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)]
+            return SimpleNamespace(data=data[::-1])
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+def client_for(fake):
+    return SimpleNamespace(embeddings=fake)
+
+def connection_error():
+    return APIConnectionError(request=SimpleNamespace())
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(embeddings, "RETRY_BASE_DELAY", 0)
+
+def test_batches_respect_input_and_size_limits():
+    texts = ["a" * 10] * 5 + ["b" * 30]
+    assert make_batches(texts, max_inputs=2, max_chars=1000) == [[0, 1], [2, 3], [4, 5]]
+    assert make_batches(texts, max_inputs=10, max_chars=35) == [[0, 1, 2], [3, 4], [5]]
+
+def test_many_texts_per_request_in_input_order(monkeypatch):
+    monkeypatch.setattr(embeddings, "make_batches", lambda texts: [list(range(i, min(i + 4, len(texts)))) for i in range(0, len(texts), 4)])
+    fake = FakeEmbeddings()
+    texts = ["x" * n for n in range(1, 11)]
+    progress = []
+    result = asyncio.run(embed_texts(client_for(fake), texts, progress=lambda done, total: progress.append((done, total))))
+    assert result == [[float(n)] for n in range(1, 11)]
+    assert len(fake.calls) == 3
+    assert sorted(progress) == [(4, 10), (8, 10), (10, 10)]
+
+def test_concurrency_is_bounded(monkeypatch):
+    monkeypatch.setattr(embeddings, "EMBEDDING_CONCURRENCY", 2)
+    monkeypatch.setattr(embeddings, "make_batches", lambda texts: [[i] for i in range(len(texts))])
+    fake = FakeEmbeddings(delay=0.05)
+    asyncio.run(embed_texts(client_for(fake), [f"texte {i}" for i in range(6)]))
+    assert fake.max_in_flight == 2
+
+def test_transient_errors_are_retried():
+    fake = FakeEmbeddings(failures=2, error=connection_error())
+    assert asyncio.run(embed_texts(client_for(fake), ["abc"])) == [[3.0]]
+    assert len(fake.calls) == 3
+
+def test_failed_batches_leave_no_embedding():
+    """Errors that retrying cannot fix are not retried; the chunks are stored without embedding"""
+    response = SimpleNamespace(status_code=401, request=SimpleNamespace(), headers={})
+    error = AuthenticationError("bad key", response=response, body=None)
+    fake = FakeEmbeddings(failures=1, error=error)
+    assert asyncio.run(embed_texts(client_for(fake), ["abc", "de"])) == [None, None]
+    assert len(fake.calls) == 1
+
+def test_unchanged_texts_are_not_embedded_again(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"))
+    fake = FakeEmbeddings()
+    first = asyncio.run(embed_texts(client_for(fake), ["article 1", "article 22", "article 1"], cache=cache))
+    # Duplicates within a run are sent once
+    assert fake.calls == [["article 1", "article 22"]]
+
+    # A later run (new process) only pays for the new text
+    cache = EmbeddingCache(str(tmp_path / "cache.db"))
+    second = asyncio.run(embed_texts(client_for(fake), ["article  22\n", "article 333"], cache=cache))
+    assert fake.calls[1:] == [["article 333"]]
+    assert first == [[9.0], [10.0], [9.0]]
+    assert second == [[10.0], [11.0]]
+
+def test_cache_key_depends_on_model_and_dimensions():
+    assert content_key("texte") == content_key(" texte ")
+    assert content_key("texte") != content_key("texte", model="text-embedding-3-large")
+    assert content_key("texte") != content_key("texte", dimensions=256)
+    assert content_key("texte") != content_key("Texte")
+
+def test_failed_texts_are_not_cached(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"))
+    fake = FakeEmbeddings(failures=embeddings.EMBEDDING_MAX_ATTEMPTS, error=connection_error())
+    assert asyncio.run(embed_texts(client_for(fake), ["abc"], cache=cache)) == [None]
+    assert cache.get_many([content_key("abc")]) == {}
+
+def test_query_cache_normalizes_questions():
+    cache = QueryEmbeddingCache()
+    cache.put("Préavis  de départ ?", [1.0])
+    assert cache.get("preavis de DÉPART ?") == [1.0]
+    assert cache.get("préavis de départ") is None
+    assert cache.get("Préavis de départ ?", model="text-embedding-3-large") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+def test_query_cache_evicts_and_expires(monkeypatch):
+    cache = QueryEmbeddingCache(max_entries=2, ttl_seconds=60)
+    cache.put("a", [1.0])
+    cache.put("b", [2.0])
+    cache.get("a")
+    cache.put("c", [3.0])
+    # "b" was the least recently used
+    assert cache.get("b") is None and cache.get("a") == [1.0]
+
+    now = time.monotonic()
+    monkeypatch.setattr(embeddings.time, "monotonic", lambda: now + 61)
+    assert cache.get("c") is None
+    assert len(cache) == 1
+
+def test_query_embeddings_are_cached(monkeypatch):
+    """A repeated question does not pay another embeddings round trip"""
+    monkeypatch.setattr(embeddings, "query_embedding_cache", QueryEmbeddingCache())
+    calls = []
+    create = lambda model, input: calls.append(input) or SimpleNamespace(data=[SimpleNamespace(embedding=[1.0])])
+    backend = OpenAIEmbeddings(SimpleNamespace(embeddings=SimpleNamespace(create=create)))
+    assert backend.embed_query("Mon loyer a augmenté") == backend.embed_query("mon loyer a  augmenté") == [1.0]
+    assert len(calls) == 1
+
+def test_local_embeddings_capture_similarity():
+    """Same topic in other words (accents, inflections) scores above an unrelated text"""
+    deposit = embed_text("Le bailleur refuse de restituer le dépôt de garantie")
+    similar = embed_text("depot de garantie non restitue par le proprietaire")
+    unrelated = embed_text("Licenciement pour motif économique")
+    assert deposit @ similar > 0.4 > abs(deposit @ unrelated)
+    assert np.allclose(deposit, embed_text("Le bailleur refuse de restituer le dépôt de garantie"))
+    assert deposit.shape == (384,) and np.linalg.norm(deposit) == pytest.approx(1)
+    assert not embed_text("").any()
+
+def test_local_batches_are_spread_over_processes():
+    texts = [f"Document numéro {i} sur le loyer" for i in range(70)]
+    parallel = LocalEmbeddings(dimensions=32, workers=2).embed_many(texts)
+    assert parallel == LocalEmbeddings(dimensions=32, workers=1).embed_many(texts)
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,513 @@
+"""
+Tests for the local legal vector store
+"""
+import pytest
+import sys
+import os
+import pickle
+import time
+import threading
+import asyncio
+import json
+import sqlite3
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+
+# Add the api directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from fastapi.testclient import TestClient
+import main
+from legal import index, router
+from legal import embeddings
+from legal.embeddings import OPENAI_BACKEND_NAME
+from legal.local_embeddings import LOCAL_BACKEND_NAME, LocalEmbeddings
+from legal.lexical import fts_query, fuse_rankings
+from legal.index import LocalVectorStore
+from legal.models import LegalDoc
+from legal.vectors import EmbeddingMatrix
+
+class FakeIdIndex:
+    """Exact inner-product search with the ID-mapped FAISS interface"""
+    def __init__(self):
+        self.id_map = []
+        self.vectors = np.zeros((0, index.EMBEDDING_DIM), dtype=np.float32)
+        self.searches = []
+
+    @property
+    def ntotal(self):
+        return len(self.id_map)
+
+    def add_with_ids(self, vectors, ids):
+        self.vectors = np.vstack([self.vectors, vectors])
+        self.id_map.extend(int(i) for i in ids)
+
+    def search(self, queries, k, params=None):
+        self.searches.append(k)
+        scores = queries @ self.vectors.T
+        order = np.argsort(-scores, axis=1)[:, :k]
+        return np.take_along_axis(scores, order, axis=1), np.array(self.id_map)[order]
+
+class FakeFaiss:
+    """Stands in for the faiss module"""
+    METRIC_INNER_PRODUCT = 0
+
+    def __init__(self):
+        self.reads = 0
+
+    def IndexHNSWFlat(self, dim, m, metric):
+        return None
+
+    def IndexIDMap2(self, graph):
+        return FakeIdIndex()
+
+    def SearchParametersHNSW(self, efSearch):
+        return SimpleNamespace(efSearch=efSearch)
+
+    def write_index(self, faiss_index, path):
+        with open(path, "wb") as f:
+            pickle.dump(faiss_index, f)
+
+    def read_index(self, path):
+        self.reads += 1
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+def embed(text):
+    """Deterministic embedding: one axis per topic word"""
+    vector = np.zeros(index.EMBEDDING_DIM, dtype=np.float32)
+    for axis, word in enumerate(["loyer", "amende", "travail"]):
+        if word in text:
+            vector[axis] = 1.0
+    vector[3 + sum(map(ord, text)) % 100] = 0.1
+    return vector.tolist()
+
+class FakeBackend:
+    """Deterministic embeddings under the OpenAI name, like the vectors of existing stores"""
+    name = OPENAI_BACKEND_NAME
+    dimensions = index.EMBEDDING_DIM
+
+    def embed_query(self, text):
+        return embed(text)
+
+    async def embed_documents(self, texts):
+        return [embed(text) for text in texts]
+
+def make_store(tmp_path, faiss=None, backend=None):
+    store = LocalVectorStore(
+        db_path=str(tmp_path / "legal.db"),
+        index_path=str(tmp_path / "legal.index"),
+        matrix_path=str(tmp_path / "legal.npy"),
+        backend=backend or FakeBackend()
+    )
+    store.faiss = faiss or FakeFaiss()
+    store._load_index()
+    return store
+
+# Fixed, so that the same chunk built twice has the same content hash
+NOW = datetime.now()
+
+def doc(title, days_old, text, chunk_index=0):
+    return LegalDoc(
+        title=title, url=f"https://example.org/{title}", source="legifrance",
+        date=NOW - timedelta(days=days_old), type="code", text=text,
+        chunk_index=chunk_index
+    )
+
+class CountingBackend(FakeBackend):
+    def __init__(self):
+        self.embedded = []
+
+    async def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return await super().embed_documents(texts)
+
+@pytest.fixture(autouse=True)
+def no_openai(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+
+def test_store_is_shared_across_calls(tmp_path, monkeypatch):
+    """One store per process instead of one per request"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("SUPABASE_URL", raising=False)
+    monkeypatch.setattr(index, "_vector_store", None)
+    created = []
+    monkeypatch.setattr(index, "create_vector_store", lambda: created.append(1) or LocalVectorStore())
+    assert index.get_vector_store() is index.get_vector_store()
+    assert len(created) == 1
+
+def test_index_reloaded_only_when_file_changes(tmp_path):
+    store = make_store(tmp_path)
+    assert store.refresh() is False
+    asyncio.run(store.upsert([doc("a", 1, "loyer")]))
+    # Our own write is not reloaded
+    assert store.refresh() is False
+
+    other = make_store(tmp_path)
+    asyncio.run(other.upsert([doc("b", 1, "amende")]))
+    assert store.refresh() is True
+    assert store.index.ntotal == 2
+    assert store.refresh() is False
+
+def test_search_covers_old_documents(tmp_path):
+    """Relevant documents are found whatever their date, not only among the latest rows"""
+    store = make_store(tmp_path)
+    recent = [doc(f"recent-{i}", i, f"travail {i}") for i in range(30)]
+    asyncio.run(store.upsert(recent + [doc("ancien", 500, "loyer impayé")]))
+    results = asyncio.run(store.search("loyer", k=3))
+    assert results[0].doc.title == "ancien"
+
+def test_date_filter_fetches_more_neighbours(tmp_path):
+    """When the nearest documents are too old, the search widens until enough recent ones pass"""
+    store = make_store(tmp_path)
+    old = [doc(f"old-{i}", 900, f"loyer {i}") for i in range(40)]
+    asyncio.run(store.upsert(old + [doc("recent", 10, "loyer récent"), doc("other", 10, "amende")]))
+    results = asyncio.run(store.search("loyer", k=1, since_date=datetime.now() - timedelta(days=365)))
+    assert [r.doc.title for r in results] == ["recent"]
+    assert len(store.index.searches) > 1
+
+def test_replaced_rows_are_not_returned(tmp_path):
+    """Results map index ids back to the current SQLite rows"""
+    store = make_store(tmp_path)
+    asyncio.run(store.upsert([doc("a", 1, "loyer v1")]))
+    asyncio.run(store.upsert([doc("a", 1, "loyer v2")]))
+    results = asyncio.run(store.search("loyer", k=5))
+    assert [r.doc.text for r in results] == ["loyer v2"]
+
+def test_legacy_index_is_rebuilt_with_row_ids(tmp_path):
+    store = make_store(tmp_path)
+    asyncio.run(store.upsert([doc("a", 1, "loyer")]))
+    with open(tmp_path / "legal.index", "wb") as f:
+        pickle.dump(SimpleNamespace(ntotal=1), f)
+    store = make_store(tmp_path)
+    assert hasattr(store.index, "id_map") and store.index.ntotal == 1
+
+def test_embeddings_are_stored_as_binary(tmp_path):
+    store = make_store(tmp_path)
+    asyncio.run(store.upsert([doc("a", 1, "loyer"), doc("b", 1, "amende")]))
+    conn = sqlite3.connect(tmp_path / "legal.db")
+    kinds = conn.execute("SELECT typeof(embedding), length(embedding) FROM legal_documents").fetchall()
+    conn.close()
+    assert kinds == [("blob", index.EMBEDDING_DIM * 4)] * 2
+
+    # Memory-mapped matrix aligned with the row ids, unit-length rows
+    matrix = EmbeddingMatrix(str(tmp_path / "legal.npy"))
+    matrix.refresh()
+    assert isinstance(matrix.records, np.memmap)
+    assert list(matrix.ids) == [1, 2]
+    assert np.allclose(np.linalg.norm(matrix.vectors, axis=1), 1)
+    assert list(matrix.positions([2, 7, 1])) == [1, -1, 0]
+
+def test_json_embeddings_are_migrated(tmp_path):
+    """Databases written with JSON text embeddings are converted on startup"""
+    conn = sqlite3.connect(tmp_path / "legal.db")
+    conn.execute("""
+        CREATE TABLE legal_documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, url TEXT UNIQUE NOT NULL,
+            source TEXT NOT NULL, date TEXT NOT NULL, type TEXT NOT NULL, jurisdiction TEXT,
+            text TEXT NOT NULL, embedding TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute(
+        "INSERT INTO legal_documents (title, url, source, date, type, text, embedding) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ("ancien", "https://example.org/ancien", "legifrance", datetime.now().isoformat(), "code", "loyer", json.dumps(embed("loyer")))
+    )
+    conn.commit()
+    conn.close()
+
+    store = make_store(tmp_path)
+    conn = sqlite3.connect(tmp_path / "legal.db")
+    assert conn.execute("SELECT typeof(embedding) FROM legal_documents").fetchone() == ("blob",)
+    conn.close()
+    assert len(store.matrix) == 1 and store.index.ntotal == 1
+    assert asyncio.run(store.search("loyer", k=1))[0].doc.title == "ancien"
+
+def test_search_without_faiss_uses_the_matrix(tmp_path):
+    store = make_store(tmp_path)
+    asyncio.run(store.upsert([doc("a", 1, "amende"), doc("b", 2, "loyer impayé")]))
+    store.faiss = None
+    results = asyncio.run(store.search("loyer", k=2))
+    assert results[0].doc.title == "b"
+    assert results[0].score == pytest.approx(np.dot(embed("loyer"), embed("loyer impayé")) /
+                                             np.linalg.norm(embed("loyer")) / np.linalg.norm(embed("loyer impayé")), abs=1e-5)
+
+def test_exact_search_ranks_like_row_by_row_scoring(tmp_path):
+    """Without FAISS the whole corpus is ranked, with the same relevance as the per-row formula"""
+    store = make_store(tmp_path)
+    docs = [doc(f"doc-{i}", i * 37 % 1000, ["loyer", "amende", "travail loyer"][i % 3] + f" {i}") for i in range(60)]
+    asyncio.run(store.upsert(docs))
+    results = [result for _, result in store._exact_search(embed("loyer"), 5, None)]
+
+    expected = sorted(
+        (LocalVectorStore._make_result(
+            (d.title, d.url, d.source, d.date.isoformat(), d.type, d.jurisdiction, d.text),
+            float(np.dot(embed("loyer"), embed(d.text)) / np.linalg.norm(embed("loyer")) / np.linalg.norm(embed(d.text)))
+        ) for d in docs),
+        key=lambda r: r.relevance, reverse=True
+    )[:5]
+    assert [r.doc.title for r in results] == [r.doc.title for r in expected]
+    assert [r.relevance for r in results] == pytest.approx([r.relevance for r in expected], abs=1e-5)
+
+def test_exact_search_date_filter(tmp_path):
+    store = make_store(tmp_path)
+    asyncio.run(store.upsert([doc("old", 900, "loyer impayé"), doc("recent", 10, "amende"), doc("new", 5, "loyer")]))
+    store.faiss = None
+    results = asyncio.run(store.search("loyer", k=5, since_date=datetime.now() - timedelta(days=365)))
+    assert [r.doc.title for r in results] == ["new", "recent"]
+    assert asyncio.run(store.search("loyer", k=5, since_date=datetime.now() + timedelta(days=1))) == []
+
+def test_older_matrix_layout_is_rewritten(tmp_path):
+    store = make_store(tmp_path)
+    asyncio.run(store.upsert([doc("a", 1, "loyer")]))
+    np.save(tmp_path / "legal.npy", np.zeros(1, dtype=[("id", "<i8"), ("vector", "<f4", (index.EMBEDDING_DIM,))]))
+    store = make_store(tmp_path)
+    assert len(store.matrix) == 1 and store.matrix.days[0] > 0
+
+def test_health_reports_readiness_without_searching(tmp_path, monkeypatch):
+    store = make_store(tmp_path)
+    asyncio.run(store.upsert([doc("a", 1, "loyer"), doc("b", 2, "amende")]))
+    store._get_embedding = lambda text: pytest.fail("health probe must not embed")
+    store.search_sync = lambda *args, **kwargs: pytest.fail("health probe must not search")
+    monkeypatch.setattr(router, "get_vector_store", lambda: store)
+
+    health = TestClient(main.app).get("/legal/health").json()
+    assert health["status"] == "ok"
+    assert health["documents"] == 2 and health["embedded_documents"] == 2
+    assert health["index_loaded"] is True and health["index_vectors"] == 2
+    assert health["last_ingest"]
+
+def test_health_of_empty_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(router, "get_vector_store", lambda: make_store(tmp_path))
+    health = TestClient(main.app).get("/legal/health").json()
+    assert health["status"] == "empty" and health["documents"] == 0
+
+def test_legal_search_retrieves_off_the_event_loop(tmp_path, monkeypatch):
+    """A blocking query embedding does not stall other requests"""
+    store = make_store(tmp_path)
+    asyncio.run(store.upsert([doc("a", 1, "loyer")]))
+    search_sync = store.search_sync
+    def slow_search(*args):
+        time.sleep(0.3)
+        return search_sync(*args)
+    store.search_sync = slow_search
+    monkeypatch.setattr(router, "get_vector_store", lambda: store)
+
+    async def run():
+        search = asyncio.create_task(router.run_legal_search(router.LegalQueryIn(question="loyer")))
+        started = time.monotonic()
+        await asyncio.sleep(0.05)
+        stalled = time.monotonic() - started
+        return await search, stalled
+
+    answer, stalled = asyncio.run(run())
+    assert stalled < 0.2
+    assert [citation.title for citation in answer.citations] == ["a"]
+
+def test_store_is_built_off_the_event_loop(tmp_path, monkeypatch):
+    """The first search builds the store (migrations, index) without stalling other requests"""
+    def build_store():
+        time.sleep(0.3)
+        return make_store(tmp_path)
+    monkeypatch.setattr(router, "get_vector_store", build_store)
+
+    async def run():
+        search = asyncio.create_task(router.find_legal_citations("loyer"))
+        started = time.monotonic()
+        await asyncio.sleep(0.05)
+        stalled = time.monotonic() - started
+        return await search, stalled
+
+    citations, stalled = asyncio.run(run())
+    assert stalled < 0.2
+    assert citations == []
+
+def test_keyword_query_keeps_references_whole():
+    assert fts_query("Que dit l'article L1233-3 du code ?") == '"article" OR "l1233 3" OR "code"'
+    assert fts_query("arrêt n° 23-12345") == '"arrêt" OR "23 12345"'
+    assert fts_query("de la") is None
+
+def test_rank_fusion():
+    fused = fuse_rankings([[1, 2, 3], [3, 4]])
+    assert sorted(fused, key=fused.get, reverse=True) == [3, 1, 2, 4]
+
+def test_keyword_search_without_embeddings(tmp_path):
+    """Without embeddings, ranking comes from BM25 instead of the date alone, accents folded"""
+    store = make_store(tmp_path)
+    store.backend = None
+    asyncio.run(store.upsert([
+        doc("Licenciement économique", 300, "Article L1233-3 du Code du travail : définition du motif économique."),
+        doc("Congés payés", 1, "Le salarié a droit à 2,5 jours ouvrables de congé par mois (article L3141-3)."),
+        doc("Préavis", 2, "Durée du préavis de licenciement selon l'ancienneté."),
+    ]))
+    assert [r.doc.title for r in asyncio.run(store.search("article L1233-3", k=3))][0] == "Licenciement économique"
+    assert [r.doc.title for r in asyncio.run(store.search("preavis", k=3))] == ["Préavis"]
+    # No keyword match: most recent documents, as before
+    assert asyncio.run(store.search("zzz", k=1))[0].doc.title == "Congés payés"
+
+def test_hybrid_search_adds_keyword_matches(tmp_path):
+    """Exact references missed by the embedding are found through the keyword index"""
+    store = make_store(tmp_path)
+    asyncio.run(store.upsert(
+        [doc(f"travail-{i}", i, f"travail contrat {i}") for i in range(20)]
+        + [doc("Cass. Soc., n° 23-67890", 400, "Décision de la chambre sociale")]
+    ))
+    results = asyncio.run(store.search("Que dit l'arrêt n° 23-67890 ?", k=3))
+    assert "Cass. Soc., n° 23-67890" in [r.doc.title for r in results]
+    assert all(a.relevance >= b.relevance for a, b in zip(results, results[1:]))
+
+def test_keyword_index_follows_replaced_rows(tmp_path):
+    store = make_store(tmp_path)
+    asyncio.run(store.upsert([doc("a", 1, "ancienne version amende")]))
+    asyncio.run(store.upsert([doc("a", 1, "nouvelle version loyer")]))
+    assert store._lexical_search("ancienne", 5, None) == []
+    assert len(store._lexical_search("nouvelle", 5, None)) == 1
+
+def test_local_backend_is_recorded_and_kept(tmp_path, monkeypatch):
+    """Queries keep using the embedder that built the stored vectors, whatever the configuration"""
+    monkeypatch.setattr(embeddings, "EMBEDDING_BACKEND", "local")
+    store = make_store(tmp_path, backend=LocalEmbeddings(dimensions=64, workers=1))
+    asyncio.run(store.upsert([doc("a", 1, "dépôt de garantie non restitué"), doc("b", 1, "licenciement économique")]))
+    assert store.status()["embedding_backend"] == LOCAL_BACKEND_NAME
+    assert store.status()["embedding_dim"] == 64
+
+    monkeypatch.setattr(embeddings, "EMBEDDING_BACKEND", "openai")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    reopened = LocalVectorStore(
+        db_path=str(tmp_path / "legal.db"), index_path=str(tmp_path / "legal.index"), matrix_path=str(tmp_path / "legal.npy")
+    )
+    assert (reopened.backend.name, reopened.backend.dimensions) == (LOCAL_BACKEND_NAME, 64)
+    reopened.faiss = None
+    assert asyncio.run(reopened.search("le depot de garantie", k=1))[0].doc.title == "a"
+
+def test_unavailable_backend_disables_semantic_search(tmp_path):
+    """OpenAI vectors without a key: keyword search only, rather than comparing incompatible vectors"""
+    store = make_store(tmp_path)
+    asyncio.run(store.upsert([doc("a", 1, "loyer impayé")]))
+    reopened = LocalVectorStore(
+        db_path=str(tmp_path / "legal.db"), index_path=str(tmp_path / "legal.index"), matrix_path=str(tmp_path / "legal.npy")
+    )
+    assert reopened.backend is None and reopened.dimensions == index.EMBEDDING_DIM
+    assert asyncio.run(reopened.search("loyer", k=1))[0].doc.title == "a"
+
+def test_empty_store_adopts_the_configured_backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(embeddings, "EMBEDDING_BACKEND", "auto")
+    store = LocalVectorStore(
+        db_path=str(tmp_path / "legal.db"), index_path=str(tmp_path / "legal.index"), matrix_path=str(tmp_path / "legal.npy")
+    )
+    assert store.backend.name == LOCAL_BACKEND_NAME
+
+def test_every_chunk_of_a_document_is_kept(tmp_path):
+    """Chunks share the document URL without overwriting each other"""
+    store = make_store(tmp_path)
+    asyncio.run(store.upsert([doc("code", 1, f"loyer partie {i}", chunk_index=i) for i in range(3)]))
+    assert store.status()["documents"] == 3
+    assert len(store.matrix) == 3 and store.index.ntotal == 3
+
+def test_unchanged_chunks_are_skipped(tmp_path):
+    """Re-ingestion only embeds and indexes what changed"""
+    backend = CountingBackend()
+    store = make_store(tmp_path, backend=backend)
+    chunks = [doc("code", 1, f"loyer partie {i}", chunk_index=i) for i in range(3)]
+    asyncio.run(store.upsert(chunks))
+    asyncio.run(store.upsert(chunks))
+    assert len(backend.embedded) == 3 and store.index.ntotal == 3
+
+    chunks[1] = doc("code", 1, "loyer partie 1 modifiée", chunk_index=1)
+    asyncio.run(store.upsert(chunks))
+    assert backend.embedded[3:] == ["loyer partie 1 modifiée"]
+    assert store.status()["documents"] == 3
+    assert [r.doc.text for r in asyncio.run(store.search("modifiée", k=5)) if "partie 1" in r.doc.text] == ["loyer partie 1 modifiée"]
+
+def test_stale_chunks_are_deleted(tmp_path):
+    """A document that shrinks loses its extra chunks everywhere"""
+    store = make_store(tmp_path)
+    asyncio.run(store.upsert([doc("code", 1, f"amende partie {i}", chunk_index=i) for i in range(3)]))
+    asyncio.run(store.upsert([doc("code", 1, "amende partie 0", chunk_index=0)]))
+    assert store.status()["documents"] == 1
+    assert list(store.matrix.ids[store.matrix.live]) == [1]
+    assert store._lexical_search("partie", 5, None) == [1]
+    assert [r.doc.text for r in asyncio.run(store.search("amende", k=5))] == ["amende partie 0"]
+    # The HNSW graph cannot drop vectors: 3 vectors for 1 live row triggers a rebuild
+    assert store.index.ntotal == 1
+
+def test_upserts_append_to_the_matrix(tmp_path):
+    """Later upserts append and mark replaced rows instead of rewriting the matrix, compaction drops them"""
+    store = make_store(tmp_path)
+    asyncio.run(store.upsert([doc("code", 1, f"amende partie {i}", chunk_index=i) for i in range(3)]))
+    store.write_matrix = lambda: pytest.fail("upserts must not rewrite the matrix")
+    asyncio.run(store.upsert([doc("code", 1, "amende partie 0", chunk_index=0), doc("code", 1, "loyer partie 1", chunk_index=1)]))
+
+    reopened = EmbeddingMatrix(str(tmp_path / "legal.npy"))
+    reopened.refresh()
+    assert list(reopened.ids) == [1, 2, 3, 4]
+    assert list(reopened.ids[reopened.live]) == [1, 4]
+    assert store.status()["removed_vectors"] == 2
+    store.faiss = None
+    assert [r.doc.text for r in asyncio.run(store.search("amende", k=5))] == ["amende partie 0", "loyer partie 1"]
+
+    assert store.compact() == 2
+    assert list(store.matrix.ids) == [1, 4] and store.status()["removed_vectors"] == 0
+    assert np.allclose(store.matrix.vectors[1], np.array(embed("loyer partie 1")) / np.linalg.norm(embed("loyer partie 1")))
+
+class CheckedIndex(FakeIdIndex):
+    """Records searches overlapping a slow add"""
+    def __init__(self):
+        super().__init__()
+        self.adding = False
+        self.overlaps = 0
+
+    def add_with_ids(self, vectors, ids):
+        self.adding = True
+        time.sleep(0.2)
+        super().add_with_ids(vectors, ids)
+        self.adding = False
+
+    def search(self, queries, k, params=None):
+        self.overlaps += self.adding
+        return super().search(queries, k, params)
+
+def test_searches_wait_for_index_updates(tmp_path):
+    """FAISS indexes cannot be searched while vectors are added to them"""
+    store = make_store(tmp_path)
+    store.index = CheckedIndex()
+    asyncio.run(store.upsert([doc("a", 1, "loyer")]))
+
+    writer = threading.Thread(target=lambda: asyncio.run(store.upsert([doc("b", 1, "loyer impayé")])))
+    writer.start()
+    while not store.index.adding:
+        time.sleep(0.01)
+    results = store.search_sync("loyer", k=2)
+    writer.join()
+    assert store.index.overlaps == 0
+    assert {r.doc.title for r in results} == {"a", "b"}
+
+def test_url_unique_table_is_migrated(tmp_path):
+    conn = sqlite3.connect(tmp_path / "legal.db")
+    conn.execute("""
+        CREATE TABLE legal_documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, url TEXT UNIQUE NOT NULL,
+            source TEXT NOT NULL, date TEXT NOT NULL, type TEXT NOT NULL, jurisdiction TEXT,
+            text TEXT NOT NULL, embedding BLOB, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    old = doc("code", 1, "loyer")
+    conn.execute(
+        "INSERT INTO legal_documents (id, title, url, source, date, type, text) VALUES (7, ?, ?, ?, ?, ?, ?)",
+        (old.title, old.url, old.source, old.date.isoformat(), old.type, old.text)
+    )
+    conn.commit()
+    conn.close()
+
+    backend = CountingBackend()
+    store = make_store(tmp_path, backend=backend)
+    # The migrated row keeps its id and is recognized as chunk 0 of its URL
+    asyncio.run(store.upsert([old, doc("code", 1, "loyer suite", chunk_index=1)]))
+    assert backend.embedded == ["loyer suite"]
+    conn = sqlite3.connect(tmp_path / "legal.db")
+    assert conn.execute("SELECT id, chunk_index FROM legal_documents ORDER BY id").fetchall() == [(7, 0), (8, 1)]
+    conn.close()
+
+if __name__ == "__main__":
+    pytest.main([__file__])
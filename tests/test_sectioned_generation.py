@@ -0,0 +1,115 @@
+"""
+Tests for parallel sectioned generation
+"""
+import pytest
+import sys
+import os
+import json
+import time
+from types import SimpleNamespace
+
+# Add the api directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from fastapi.testclient import TestClient
+import main
+import prompting
+
+SECTION_OUTPUTS = {
+    "corps": {"corps": "Madame, Monsieur,\n\nUn.\n\nDeux.\n\nTrois.", "pj": ["Copie du bail"]},
+    "entete": {"destinataire_bloc": "M. Bailleur\n1 rue du Parc", "objet": "Contestation du loyer"},
+    "resume": {"resume": ["Vérifier le bail", "Envoyer la lettre", "Conserver les preuves"]}
+}
+
+class SlowCompletions:
+    """Answers each section after a fixed delay"""
+    def __init__(self, delay: float, failing: str = None, outputs: dict = None):
+        self.delay = delay
+        self.failing = failing
+        self.outputs = {**SECTION_OUTPUTS, **(outputs or {})}
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        time.sleep(self.delay)
+        content = kwargs["messages"][1]["content"]
+        section = next(name for name, spec in prompting.SECTION_SPECS.items() if spec["keys"] in content)
+        if section == self.failing:
+            raise RuntimeError("upstream error")
+        message = SimpleNamespace(content=json.dumps(self.outputs[section]))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+PAYLOAD = {
+    "tool_id": "loyers",
+    "fields": {
+        "identite": {"nom": "MARTIN", "prenom": "Marie", "adresse": "5 rue Haute, Lyon"},
+        "loyer_actuel": 900
+    }
+}
+
+def use_fake_client(monkeypatch, completions):
+    monkeypatch.setattr(main, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    monkeypatch.setattr(main, "GENERATION_MODE", "sectioned")
+
+def test_sections_run_concurrently_and_merge(monkeypatch):
+    """Wall-clock time tracks the slowest section, not the sum"""
+    completions = SlowCompletions(delay=0.3)
+    use_fake_client(monkeypatch, completions)
+
+    started = time.monotonic()
+    response = TestClient(main.app).post("/generate", json=PAYLOAD)
+    elapsed = time.monotonic() - started
+
+    assert response.status_code == 200
+    assert len(completions.calls) == len(prompting.SECTION_SPECS)
+    assert elapsed < 0.3 * len(prompting.SECTION_SPECS)
+
+    data = response.json()
+    assert data["lettre"]["destinataire_bloc"] == "M. Bailleur\n1 rue du Parc"
+    assert data["lettre"]["pj"] == ["Copie du bail"]
+    assert data["lettre"]["signature"] == "Marie MARTIN\n5 rue Haute, Lyon"
+    assert data["resume"] == SECTION_OUTPUTS["resume"]["resume"]
+    assert data["checklist"] == prompting.get_checklist_blueprint("loyers")
+
+    # Small sections get small prompts and token caps
+    by_tokens = sorted(completions.calls, key=lambda call: call["max_tokens"])
+    assert "=== EXEMPLES ===" not in by_tokens[0]["messages"][1]["content"]
+    assert by_tokens[-1]["max_tokens"] < 1200
+
+def test_failed_section_falls_back_alone(monkeypatch):
+    """A failing section is replaced locally while the others are kept"""
+    use_fake_client(monkeypatch, SlowCompletions(delay=0, failing="resume"))
+
+    response = TestClient(main.app).post("/generate", json=PAYLOAD)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["lettre"]["objet"] == "Objet : Contestation du loyer"
+    assert data["resume"][-1] == "Conserver une copie du courrier et l'accusé de réception"
+
+def test_non_object_section_falls_back_alone(monkeypatch):
+    """A section answering with a list instead of an object is replaced, the others are kept"""
+    use_fake_client(monkeypatch, SlowCompletions(delay=0, outputs={"resume": ["Vérifier le bail"]}))
+
+    response = TestClient(main.app).post("/generate", json=PAYLOAD)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["lettre"]["destinataire_bloc"] == "M. Bailleur\n1 rue du Parc"
+    assert data["lettre"]["pj"] == ["Copie du bail"]
+    assert data["resume"][-1] == "Conserver une copie du courrier et l'accusé de réception"
+
+def test_wrongly_typed_field_falls_back_with_its_section(monkeypatch):
+    """pj given as a string: the body section is replaced, the header and resume are kept"""
+    corps = {"corps": SECTION_OUTPUTS["corps"]["corps"], "pj": "Copie du bail"}
+    use_fake_client(monkeypatch, SlowCompletions(delay=0, outputs={"corps": corps}))
+
+    response = TestClient(main.app).post("/generate", json=PAYLOAD)
+    assert response.status_code == 200
+    data = response.json()
+    fallback = main.generate_mock_response("loyers", PAYLOAD["fields"]).lettre
+    assert data["lettre"]["pj"] == fallback.pj
+    assert data["lettre"]["destinataire_bloc"] == "M. Bailleur\n1 rue du Parc"
+    assert data["lettre"]["objet"] == "Objet : Contestation du loyer"
+    assert data["resume"] == SECTION_OUTPUTS["resume"]["resume"]
+
+if __name__ == "__main__":
+    pytest.main([__file__])
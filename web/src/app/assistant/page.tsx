@@ -1,10 +1,10 @@
 'use client'
 
 import { useState, useRef, useEffect } from 'react'
-import axios from 'axios'
 import { Button } from '@/components/ui/Button'
 import { Card } from '@/components/ui/Card'
 import { Toast } from '@/components/ui/Toast'
+import { streamChat } from '@/lib/chatStream'
 import { useRouter } from 'next/navigation'
 
 const API = process.env.NEXT_PUBLIC_API_BASE || 'http://127.0.0.1:8000'
@@ -14,11 +14,6 @@ interface ChatMessage {
   content: string
 }
 
-interface ChatResponse {
-  answer: string
-  suggested_fields?: Record<string, any>
-}
-
 export default function AssistantPage() {
   const [messages, setMessages] = useState<ChatMessage[]>([
     {
@@ -28,6 +23,7 @@ export default function AssistantPage() {
   ])
   const [input, setInput] = useState('')
   const [loading, setLoading] = useState(false)
+  const [conversationId, setConversationId] = useState<string | undefined>()
   const [lastSuggestedFields, setLastSuggestedFields] = useState<{
     tool_id: string
     fields: Record<string, any>
@@ -132,23 +128,32 @@ export default function AssistantPage() {
       // Check for legal keywords
       const hasLegal = hasLegalKeywords(input)
       
-      const response = await axios.post<ChatResponse>(`${API}/chat`, {
+      // Stream the answer token by token instead of waiting for the full reply.
+      // The conversation is kept server-side: only the new message is sent,
+      // the whole history only if the server session has expired.
+      const result = await streamChat(`${API}/chat/stream`, {
         tool_id,
-        messages: newMessages
-      })
+        conversation_id: conversationId,
+        message: userMessage.content
+      }, (partial) => {
+        setMessages([...newMessages, { role: 'assistant', content: partial }])
+      }, newMessages)
 
       const assistantMessage: ChatMessage = {
         role: 'assistant',
-        content: response.data.answer
+        content: result.answer
       }
 
       setMessages([...newMessages, assistantMessage])
+      setConversationId(result.conversation_id)
 
-      // If we have suggested fields, store them for the "Fill Form" button
-      if (response.data.suggested_fields && tool_id) {
+      // If we have suggested fields, store them for the "Fill Form" button.
+      // The API's local classifier covers tools the keyword check misses.
+      const suggestedTool = tool_id || result.suggested_tool
+      if (result.suggested_fields && suggestedTool) {
         setLastSuggestedFields({
-          tool_id,
-          fields: response.data.suggested_fields
+          tool_id: suggestedTool,
+          fields: result.suggested_fields
         })
       } else {
         setLastSuggestedFields(null)
@@ -370,12 +370,18 @@ export function ToolPageClient({ params }: { params: { id: string } }) {
 
   // Retry mechanism for network requests
   const makeRequestWithRetry = async (url: string, data: any, maxRetries = 2): Promise<any> => {
+    // Same key for every attempt so the API replays instead of generating twice
+    const idempotencyKey = typeof crypto !== 'undefined' && 'randomUUID' in crypto
+      ? crypto.randomUUID()
+      : `${Date.now()}-${Math.random().toString(36).slice(2)}`
+    
     for (let attempt = 0; attempt <= maxRetries; attempt++) {
       try {
         const response = await axios.post(url, data, {
           timeout: 30000, // 30 seconds timeout
           headers: {
-            'Content-Type': 'application/json'
+            'Content-Type': 'application/json',
+            'Idempotency-Key': idempotencyKey
           }
         })
         return response
@@ -1,23 +1,21 @@
 'use client'
 
 import { useState, useRef, useEffect } from 'react'
-import axios from 'axios'
+import { streamChat, ChatStreamError } from '@/lib/chatStream'
 import { Button } from './ui/Button'
 import { Card } from './ui/Card'
 import { MessageCircle, X, Send } from 'lucide-react'
 
 const API = process.env.NEXT_PUBLIC_API_BASE || 'http://127.0.0.1:8000'
 
+// Requests give up after this long without any data from the server
+const CHAT_TIMEOUT_MS = 30000
+
 interface ChatMessage {
   role: 'user' | 'assistant'
   content: string
 }
 
-interface ChatResponse {
-  answer: string
-  suggested_fields?: Record<string, any>
-}
-
 interface FormAssistantProps {
   toolId: string
   currentValues: Record<string, any>
@@ -35,6 +33,7 @@ export function FormAssistant({
   const [messages, setMessages] = useState<ChatMessage[]>([])
   const [input, setInput] = useState('')
   const [loading, setLoading] = useState(false)
+  const [conversationId, setConversationId] = useState<string | undefined>()
   const messagesEndRef = useRef<HTMLDivElement>(null)
 
   // Initialize conversation when opened
@@ -65,28 +64,35 @@ export function FormAssistant({
     setInput('')
     setLoading(true)
 
+    const controller = new AbortController()
+    let timeout = setTimeout(() => controller.abort(), CHAT_TIMEOUT_MS)
+
     try {
-      const response = await axios.post<ChatResponse>(`${API}/chat`, {
+      // Stream the answer token by token instead of waiting for the full reply.
+      // The conversation is kept server-side: only the new message is sent,
+      // the whole history only if the server session has expired.
+      const result = await streamChat(`${API}/chat/stream`, {
         tool_id: toolId,
-        messages: newMessages,
+        conversation_id: conversationId,
+        message: userMessage.content,
         current_form_values: currentValues
-      }, {
-        timeout: 30000, // 30 seconds timeout
-        headers: {
-          'Content-Type': 'application/json'
-        }
-      })
+      }, (partial) => {
+        clearTimeout(timeout)
+        timeout = setTimeout(() => controller.abort(), CHAT_TIMEOUT_MS)
+        setMessages([...newMessages, { role: 'assistant', content: partial }])
+      }, newMessages, controller.signal)
 
       const assistantMessage: ChatMessage = {
         role: 'assistant',
-        content: response.data.answer
+        content: result.answer
       }
 
       setMessages([...newMessages, assistantMessage])
+      setConversationId(result.conversation_id)
 
       // If the assistant suggests field values, pass them to the parent
-      if (response.data.suggested_fields) {
-        onFieldSuggestion(response.data.suggested_fields)
+      if (result.suggested_fields) {
+        onFieldSuggestion(result.suggested_fields)
       }
 
     } catch (error: any) {
@@ -95,11 +101,11 @@ export function FormAssistant({
       let errorContent = 'Désolé, j\'ai rencontré un problème technique. Pouvez-vous reformuler votre question ?'
       
       // Enhanced network error handling for chat
-      if (error.code === 'NETWORK_ERROR' || error.code === 'ERR_NETWORK') {
+      if (error?.name === 'AbortError') {
+        errorContent = 'Le serveur met trop de temps à répondre. Veuillez réessayer dans quelques instants.'
+      } else if (error instanceof TypeError) {
         errorContent = 'Erreur de connexion. Vérifiez votre connexion internet et réessayez.'
-      } else if (error.response?.status === 0) {
-        errorContent = 'Impossible de joindre le serveur. Vérifiez votre connexion internet.'
-      } else if (error.response?.status >= 500) {
+      } else if (error instanceof ChatStreamError && error.status >= 500) {
         errorContent = 'Le serveur rencontre des difficultés. Veuillez réessayer dans quelques instants.'
       }
       
@@ -109,6 +115,7 @@ export function FormAssistant({
       }
       setMessages([...newMessages, errorMessage])
     } finally {
+      clearTimeout(timeout)
       setLoading(false)
     }
   }
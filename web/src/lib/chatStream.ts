@@ -0,0 +1,108 @@
+export interface ChatStreamResult {
+  answer: string
+  suggested_fields?: Record<string, any> | null
+  suggested_tool?: string | null
+  conversation_id?: string
+}
+
+export class ChatStreamError extends Error {
+  status: number
+
+  constructor(message: string, status: number) {
+    super(message)
+    this.status = status
+  }
+}
+
+export interface ChatHistoryMessage {
+  role: 'user' | 'assistant'
+  content: string
+}
+
+/**
+ * POST to /chat/stream and consume the Server-Sent Events.
+ * `onDelta` receives the answer text accumulated so far, on every token.
+ * When the server no longer knows the conversation (409), it is resent
+ * whole from `history`, ending with the new user message.
+ * Aborting `signal` stops the request and the stream (AbortError).
+ */
+export async function streamChat(
+  url: string,
+  body: Record<string, unknown>,
+  onDelta: (answer: string) => void,
+  history?: ChatHistoryMessage[],
+  signal?: AbortSignal
+): Promise<ChatStreamResult> {
+  let response = await postChat(url, body, signal)
+  if (response.status === 409 && history) {
+    const { conversation_id, message, ...rest } = body
+    response = await postChat(url, { ...rest, messages: history }, signal)
+  }
+
+  if (!response.ok || !response.body) {
+    throw new ChatStreamError(`Chat stream failed (${response.status})`, response.status)
+  }
+
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+  let answer = ''
+  let suggestedFields: Record<string, any> | null = null
+  let conversationId: string | undefined
+  let suggestedTool: string | null = null
+
+  while (true) {
+    const { value, done } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+
+    let boundary = buffer.indexOf('\n\n')
+    while (boundary !== -1) {
+      const block = buffer.slice(0, boundary)
+      buffer = buffer.slice(boundary + 2)
+      boundary = buffer.indexOf('\n\n')
+
+      let event = 'message'
+      let data = ''
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event: ')) event = line.slice(7)
+        else if (line.startsWith('data: ')) data += line.slice(6)
+      }
+      if (!data) continue
+      const payload = JSON.parse(data)
+
+      if (event === 'token' || event === 'footer' || event === 'legal') {
+        answer += payload.delta
+        onDelta(answer)
+      } else if (event === 'suggested_fields') {
+        suggestedFields = payload
+      } else if (event === 'done') {
+        answer = payload.answer
+        conversationId = payload.conversation_id
+        suggestedTool = payload.suggested_tool ?? null
+      } else if (event === 'error') {
+        // The response is already a 200: the event carries the actual status
+        throw new ChatStreamError(payload.detail, payload.status ?? 500)
+      }
+    }
+  }
+
+  return {
+    answer,
+    suggested_fields: suggestedFields,
+    suggested_tool: suggestedTool,
+    conversation_id: conversationId
+  }
+}
+
+function postChat(url: string, body: unknown, signal?: AbortSignal): Promise<Response> {
+  return fetch(url, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      Accept: 'text/event-stream'
+    },
+    body: JSON.stringify(body),
+    signal
+  })
+}